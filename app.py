@@ -1,98 +1,94 @@
-from flask import Flask, render_template, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, abort
 from datetime import datetime, date, timedelta
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import base64
+import click
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
+import uuid
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
 from werkzeug.utils import secure_filename
+from importacao import (
+    EXTENSOES_PLANILHA, MENSAGEM_FORMATO_INVALIDO, MAX_REJEITADAS_RELATORIO, PlanilhaInvalida,
+    ORDEM_REFEICAO_DESCONHECIDA, CHAVE_VALOR_PADRAO, CatalogoRefeicoes, preparar_agendamentos, ler_planilha_em_lotes,
+    calcular_hash, ler_checkpoint, salvar_checkpoint, remover_checkpoint,
+    ler_planilha_pagamentos, preparar_pagamentos
+)
+from migracoes import aplicar_migracoes, reconstruir_resumo_diario
+from database import (
+    URL_BANCO, CAMINHO_BANCO, PASTA_BACKUPS, eh_sqlite, opcoes_engine, configurar_engine, criar_engine,
+    limpar_logs_antigos, fazer_backup, restaurar_backup, ler_checksum, rotacionar_backups, agendar_backups,
+    copiar_dados
+)
+from models import (
+    db, Aluno, Refeicao, Historico, Pagamento, Configuracao, Auditoria, ResumoDiario, ImportacaoJob,
+    COLUNAS_ALUNO, COLUNAS_HISTORICO, COLUNAS_PAGAMENTO, COLUNAS_AUDITORIA, data_br, data_hora_br
+)
+from relatorios import GRANULARIDADES, agregar_periodo
+from eventos import BarramentoEventos, formatar_sse
+from checkin import BufferPresencas, IndiceAlunos
+from bloqueio import (
+    CHAVES_POLITICA, EstadoNoLote, PoliticaBloqueio, avaliar_bloqueios, bloqueio_vale, faltas_restantes
+)
+from respostas import (
+    configurar_respostas, quer_ndjson, resposta_ndjson, resposta_planilha, FORMATOS_EXPORTACAO
+)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'sua_chave_secreta_aqui'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///refeitorio.db'
+# URL, pool e pragmas vêm de database.py (o mesmo usado pelos comandos de manutenção)
+app.config['SQLALCHEMY_DATABASE_URI'] = URL_BANCO
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(URL_BANCO)
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+# Limite de upload ajustável; a importação lê o arquivo em lotes, então ele
+# não precisa mais proteger a memória
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('REFEITORIO_MAX_UPLOAD_MB', 64)) * 1024 * 1024
+# Linhas da planilha processadas (e commitadas) por vez na importação
+app.config['IMPORTACAO_LOTE_LINHAS'] = int(os.environ.get('REFEITORIO_IMPORTACAO_LOTE', 20000))
+# Com vários workers no mesmo servidor: pasta onde cada um anota a porta
+# local em que recebe os eventos dos outros (caches e painéis em dia)
+app.config['EVENTOS_PASTA'] = os.environ.get('REFEITORIO_EVENTOS_PASTA')
+# Cada painel com /api/eventos aberto prende uma thread (ou greenlet) do
+# servidor enquanto a página está aberta. Use um worker que aguente isso:
+# gunicorn -k gthread --threads N (N bem acima do limite abaixo) ou -k gevent
+# com REFEITORIO_SSE_ASSINCRONO=1. Em worker síncrono (sem threads) o stream
+# é recusado e os painéis voltam a consultar a cada 30 s; o mesmo acontece
+# acima de REFEITORIO_SSE_MAX_CONEXOES conexões abertas no processo.
+app.config['SSE_MAX_CONEXOES'] = int(os.environ.get('REFEITORIO_SSE_MAX_CONEXOES', 4))
+app.config['SSE_ASSINCRONO'] = os.environ.get('REFEITORIO_SSE_ASSINCRONO') == '1'
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+if eh_sqlite(URL_BANCO):
+    os.makedirs(os.path.dirname(CAMINHO_BANCO), exist_ok=True)
 
-db = SQLAlchemy(app)
-
-# ORDEM DAS REFEIÇÕES
-ORDEM_REFEICOES = {
-    'Lanche da Manhã': 1,
-    'Lanche da manhã': 1,
-    'Almoço': 2,
-    'Almoco': 2,
-    'Lanche da Tarde': 3,
-    'Lanche da tarde': 3,
-    'Jantar': 4,
-    'Ceia': 5
-}
-
-def get_ordem_refeicao(refeicao):
-    return ORDEM_REFEICOES.get(refeicao, 999)
-
-# MODELOS
-class Aluno(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    matricula = db.Column(db.String(20), unique=True, nullable=False)
-    nome = db.Column(db.String(100), nullable=False)
-    curso = db.Column(db.String(100))
-    email = db.Column(db.String(100))
-    total_faltas = db.Column(db.Integer, default=0)
-    debito = db.Column(db.Float, default=0.0)
-    ultima_falta_data = db.Column(db.Date, nullable=True)
-    ultima_falta_refeicao = db.Column(db.String(50), nullable=True)
-    ultima_falta_valor = db.Column(db.Float, default=0.0)
-    bloqueado = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    historico = db.relationship('Historico', backref='aluno', lazy=True, cascade='all, delete-orphan')
-    pagamentos = db.relationship('Pagamento', backref='aluno', lazy=True, cascade='all, delete-orphan')
-
-class Historico(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id'), nullable=False)
-    data = db.Column(db.Date, nullable=False)
-    refeicao = db.Column(db.String(50))
-    tipo = db.Column(db.String(20), nullable=False)
-    status = db.Column(db.String(20), nullable=False)
-    valor = db.Column(db.Float, default=0.0)
-    registro_data = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Pagamento(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id'), nullable=False)
-    data = db.Column(db.Date, nullable=False)
-    valor = db.Column(db.Float, nullable=False)
-    motivo = db.Column(db.String(200))
-    faltas_quitadas = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Configuracao(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    chave = db.Column(db.String(50), unique=True, nullable=False)
-    valor = db.Column(db.String(100), nullable=False)
-    descricao = db.Column(db.String(200))
-    tipo = db.Column(db.String(20), default='geral')
-
-class Auditoria(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    usuario = db.Column(db.String(50), default='sistema')
-    acao = db.Column(db.String(200), nullable=False)
-    tipo = db.Column(db.String(20), default='info')
-    detalhes = db.Column(db.Text)
+db.init_app(app)
+configurar_respostas(app)
 
 with app.app_context():
+    configurar_engine(db.engine)
     db.create_all()
+    aplicar_migracoes(db.engine)
     
     configuracoes_padrao = [
         {'chave': 'max_faltas', 'valor': '3', 'descricao': 'Máximo de faltas para bloqueio', 'tipo': 'geral'},
+        {'chave': 'max_faltas_janela', 'valor': '0', 'descricao': 'Máximo de faltas na janela (0 = desligado)', 'tipo': 'geral'},
+        {'chave': 'janela_dias', 'valor': '30', 'descricao': 'Dias da janela de faltas', 'tipo': 'geral'},
+        {'chave': 'max_faltas_consecutivas', 'valor': '0', 'descricao': 'Máximo de faltas seguidas (0 = desligado)', 'tipo': 'geral'},
+        {'chave': 'dias_bloqueio', 'valor': '0', 'descricao': 'Dias de bloqueio por faltas seguidas (0 = até o pagamento)', 'tipo': 'geral'},
         {'chave': 'valor_lanche_manha', 'valor': '3.50', 'descricao': 'Valor do Lanche da Manhã', 'tipo': 'refeicao'},
         {'chave': 'valor_almoco', 'valor': '8.00', 'descricao': 'Valor do Almoço', 'tipo': 'refeicao'},
         {'chave': 'valor_lanche_tarde', 'valor': '3.50', 'descricao': 'Valor do Lanche da Tarde', 'tipo': 'refeicao'},
         {'chave': 'valor_janta', 'valor': '8.00', 'descricao': 'Valor do Jantar', 'tipo': 'refeicao'},
         {'chave': 'valor_ceia', 'valor': '4.00', 'descricao': 'Valor da Ceia', 'tipo': 'refeicao'},
+        {'chave': 'config_versao', 'valor': '0', 'descricao': 'Versão das configurações (cache)', 'tipo': 'sistema'},
     ]
     
     for conf in configuracoes_padrao:
@@ -107,38 +103,1039 @@ with app.app_context():
     
     db.session.commit()
 
+# ==================== CACHE DE CONFIGURAÇÕES ====================
+# Foto de todas as configurações já convertidas (int/float), compartilhada pelo
+# processo. Outros workers avisam mudanças incrementando 'config_versao' no
+# banco, que é conferida no máximo a cada CONFIG_VERIFICAR_A_CADA segundos.
+CONFIG_VERSAO_CHAVE = 'config_versao'
+CONFIG_VERIFICAR_A_CADA = 5
+
+_config_cache = {'versao': None, 'valores': {}, 'verificado_em': 0.0}
+_config_lock = threading.Lock()
+
+def converter_config(valor):
+    for tipo in (int, float):
+        try:
+            return tipo(valor)
+        except (TypeError, ValueError):
+            pass
+    return valor
+
+def ler_versao_config():
+    return db.session.query(Configuracao.valor).filter_by(chave=CONFIG_VERSAO_CHAVE).scalar()
+
+def config_snapshot():
+    agora = time.monotonic()
+    cache = _config_cache
+    if cache['versao'] is not None and agora - cache['verificado_em'] < CONFIG_VERIFICAR_A_CADA:
+        return cache['valores']
+    
+    with _config_lock:
+        versao = ler_versao_config() or '0'
+        if versao != cache['versao']:
+            cache['valores'] = {
+                c.chave: converter_config(c.valor)
+                for c in Configuracao.query.filter(Configuracao.tipo != 'sistema')
+            }
+            cache['versao'] = versao
+        cache['verificado_em'] = agora
+        return cache['valores']
+
+def invalidar_config():
+    """Marca nova versão no banco (vale para os outros processos após o commit)"""
+    db.session.query(Configuracao).filter_by(chave=CONFIG_VERSAO_CHAVE).update({
+        'valor': db.cast(db.cast(Configuracao.valor, db.Integer) + 1, db.String)
+    }, synchronize_session=False)
+    _config_cache['versao'] = None
+
+# ==================== CACHE DE RESPOSTAS ====================
+class CacheRespostas:
+    """Cache em memória, com validade curta, para respostas muito consultadas"""
+    
+    todos = []
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.itens = {}
+        self.lock = threading.Lock()
+        CacheRespostas.todos.append(self)
+    
+    def get(self, chave):
+        item = self.itens.get(chave)
+        if item and item[0] > time.monotonic():
+            return item[1]
+        return None
+    
+    def set(self, chave, valor):
+        with self.lock:
+            self.itens[chave] = (time.monotonic() + self.ttl, valor)
+    
+    def limpar(self):
+        with self.lock:
+            self.itens.clear()
+
+def limpar_caches():
+    for cache in CacheRespostas.todos:
+        cache.limpar()
+
+def invalidar_caches(origem=None):
+    """Chamada depois de importações, pagamentos e mudanças de configuração
+    
+    Vira um evento 'alteracao': limpa os caches deste processo e dos outros
+    workers e atualiza os painéis abertos. `origem` vai junto no evento
+    ('checkin' não muda bloqueios e não recarrega o índice do check-in).
+    """
+    barramento.publicar('alteracao', {'origem': origem} if origem else None)
+
+def resposta_com_etag(dados):
+    """jsonify com ETag; devolve 304 se o navegador já tem essa versão"""
+    resp = jsonify(dados)
+    # Fraca: a mesma versão vale comprimida (gzip/br) ou não
+    resp.set_etag(hashlib.md5(resp.get_data()).hexdigest(), weak=True)
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+# ==================== EVENTOS (SSE) ====================
+# Os painéis recebem as mudanças por /api/eventos em vez de consultar de
+# tempos em tempos. Cada processo com painéis abertos recalcula as
+# estatísticas uma única vez por alteração e manda só o que mudou; os logs
+# novos de auditoria vão direto do commit para os painéis.
+barramento = BarramentoEventos(app.config['EVENTOS_PASTA'])
+
+EVENTOS_PAINEL = ('estatisticas', 'auditoria', 'recarregar')
+# Junta alterações seguidas (os lotes de uma importação) num cálculo só
+ESPERA_ESTATISTICAS = 1.0
+# Comentário enviado às conexões paradas, para proxies não as derrubarem
+INTERVALO_PING = 15
+
+_estatisticas = {'ultimas': None, 'pendente': threading.Event(), 'thread': None, 'lock': threading.Lock()}
+
+def agendar_estatisticas():
+    _estatisticas['pendente'].set()
+
+def estatisticas_painel():
+    """Estatísticas já enviadas aos painéis deste processo (base das diferenças)"""
+    with _estatisticas['lock']:
+        if _estatisticas['ultimas'] is None:
+            _estatisticas['ultimas'] = calcular_estatisticas()
+        return _estatisticas['ultimas']
+
+def publicar_estatisticas():
+    """Thread: depois de cada alteração, recalcula e entrega só os campos que mudaram"""
+    while True:
+        _estatisticas['pendente'].wait()
+        time.sleep(ESPERA_ESTATISTICAS)
+        _estatisticas['pendente'].clear()
+        if not barramento.assinantes():
+            _estatisticas['ultimas'] = None
+            continue
+        try:
+            with app.app_context():
+                novas = calcular_estatisticas()
+        except Exception as e:
+            print(f'Erro ao atualizar estatísticas dos painéis: {e}')
+            continue
+        with _estatisticas['lock']:
+            anteriores = _estatisticas['ultimas'] or {}
+            _estatisticas['ultimas'] = novas
+        diferenca = {k: v for k, v in novas.items() if anteriores.get(k) != v}
+        if diferenca:
+            # Cada processo calcula as suas: a entrega é só local
+            barramento.entregar('estatisticas', diferenca)
+
+def iniciar_publicador_estatisticas():
+    with _estatisticas['lock']:
+        if _estatisticas['thread'] is None:
+            _estatisticas['thread'] = threading.Thread(
+                target=publicar_estatisticas, name='estatisticas', daemon=True
+            )
+            _estatisticas['thread'].start()
+
+def ao_alterar(dados):
+    limpar_caches()
+    agendar_estatisticas()
+
+barramento.ao_receber('alteracao', ao_alterar)
+
+# ==================== AUDITORIA ====================
+# Os eventos ficam guardados na sessão e vão para o banco num único INSERT em
+# lote (executemany) logo antes do commit de quem chamou: entram junto com os
+# dados a que se referem, ou somem com eles no rollback. Depois do commit
+# seguem para os painéis (evento 'auditoria').
+def log_auditoria(acao, tipo='info', detalhes=None):
+    log_auditoria_lote([(acao, tipo, detalhes)])
+
+def log_auditoria_lote(eventos):
+    """Enfileira vários eventos (acao, tipo, detalhes) na transação atual"""
+    agora = datetime.utcnow()
+    db.session.info.setdefault('auditoria', []).extend({
+        'timestamp': agora,
+        'usuario': 'sistema',
+        'acao': acao,
+        'tipo': tipo,
+        'detalhes': detalhes
+    } for acao, tipo, detalhes in eventos)
+
+@event.listens_for(Session, 'before_commit')
+def gravar_auditoria_pendente(session):
+    eventos = session.info.pop('auditoria', None)
+    if eventos:
+        ids = session.execute(
+            db.insert(Auditoria).returning(Auditoria.id, sort_by_parameter_order=True), eventos
+        ).scalars().all()
+        session.info['auditoria_gravada'] = [{'id': i, **e} for i, e in zip(ids, eventos)]
+
+@event.listens_for(Session, 'after_commit')
+def publicar_auditoria(session):
+    gravados = session.info.pop('auditoria_gravada', None)
+    if gravados:
+        barramento.publicar('auditoria', [{
+            'id': e['id'],
+            'timestamp': e['timestamp'].strftime('%d/%m/%Y %H:%M:%S'),
+            'usuario': e['usuario'],
+            'acao': e['acao'],
+            'tipo': e['tipo'],
+            'detalhes': e['detalhes']
+        } for e in gravados])
+
+@event.listens_for(Session, 'after_soft_rollback')
+def descartar_auditoria_pendente(session, transacao_anterior):
+    if transacao_anterior.parent is None:
+        session.info.pop('auditoria', None)
+        session.info.pop('auditoria_gravada', None)
+
 # FUNÇÕES AUXILIARES
 def get_config(chave):
-    conf = Configuracao.query.filter_by(chave=chave).first()
-    return conf.valor if conf else None
-
-def get_valor_refeicao(tipo_refeicao):
-    mapa = {
-        'Lanche da Manhã': 'valor_lanche_manha',
-        'Lanche da manhã': 'valor_lanche_manha',
-        'Almoço': 'valor_almoco',
-        'Almoco': 'valor_almoco',
-        'Lanche da Tarde': 'valor_lanche_tarde',
-        'Lanche da tarde': 'valor_lanche_tarde',
-        'Jantar': 'valor_janta',
-        'Ceia': 'valor_ceia'
-    }
-    chave = mapa.get(tipo_refeicao, 'valor_almoco')
+    return config_snapshot().get(chave)
+
+def get_max_faltas():
+    return int(get_config('max_faltas') or 3)
+
+# ==================== CATÁLOGO DE REFEIÇÕES ====================
+# Carregado uma vez por processo; só muda quando uma planilha traz uma
+# refeição nova, e aí quem cadastrou recarrega (os outros, ao ver um id novo)
+_catalogo = {'atual': None}
+
+def catalogo_refeicoes(recarregar=False):
+    if recarregar or _catalogo['atual'] is None:
+        itens = db.session.query(
+            Refeicao.id, Refeicao.nome, Refeicao.ordem, Refeicao.chave_valor, Refeicao.apelidos
+        ).all()
+        _catalogo['atual'] = CatalogoRefeicoes(itens)
+    return _catalogo['atual']
+
+def nome_refeicao(refeicao_id):
+    catalogo = catalogo_refeicoes()
+    if refeicao_id is not None and refeicao_id not in catalogo.itens:
+        catalogo = catalogo_refeicoes(recarregar=True)
+    return catalogo.nome(refeicao_id)
+
+def registrar_refeicoes(nomes):
+    """Cadastra no catálogo as refeições da planilha que não casam com nenhum apelido"""
+    catalogo = catalogo_refeicoes(recarregar=True)
+    novas = {}
+    for nome in nomes:
+        if catalogo.identificar(nome) is None:
+            novas.setdefault(nome.strip().lower(), nome.strip())
+    db.session.add_all([
+        Refeicao(nome=nome, ordem=ORDEM_REFEICAO_DESCONHECIDA, chave_valor=CHAVE_VALOR_PADRAO, apelidos=apelido)
+        for apelido, nome in novas.items()
+    ])
+    db.session.flush()
+    return catalogo_refeicoes(recarregar=True)
+
+def get_valor_refeicao(refeicao_id):
+    chave = catalogo_refeicoes().chave_valor(refeicao_id)
     valor = get_config(chave)
     return float(valor) if valor else 5.0
 
-def log_auditoria(acao, tipo='info', detalhes=None):
-    auditoria = Auditoria(acao=acao, tipo=tipo, detalhes=detalhes)
-    db.session.add(auditoria)
+# Tamanho dos lotes de IN (...) - fica abaixo do limite de variáveis do SQLite
+LOTE_CONSULTA = 500
+
+def em_lotes(itens, tamanho):
+    itens = list(itens)
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
+
+def carregar_alunos_por_matricula(matriculas):
+    alunos = {}
+    for lote in em_lotes(matriculas, LOTE_CONSULTA):
+        for aluno in Aluno.query.filter(Aluno.matricula.in_(lote)):
+            alunos[aluno.matricula] = aluno
+    return alunos
+
+# A partir desse número de linhas, no PostgreSQL, o histórico entra por COPY
+LIMITE_COPY = 1000
+
+COLUNAS_CARGA_HISTORICO = ('aluno_id', 'data', 'refeicao_id', 'ordem_refeicao', 'tipo', 'status', 'valor')
+
+def insert_com_conflito(modelo):
+    """insert() do dialeto em uso, que tem on_conflict_do_nothing/do_update"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(modelo)
+    return sqlite.insert(modelo)
+
+def inserir_historico_copy(linhas):
+    """COPY para uma tabela temporária e de lá um INSERT ... ON CONFLICT (PostgreSQL)"""
+    conn = db.session.connection().connection.driver_connection
+    colunas = ', '.join(COLUNAS_CARGA_HISTORICO)
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS historico_carga (
+                aluno_id INTEGER, data DATE, refeicao_id SMALLINT, ordem_refeicao SMALLINT,
+                tipo VARCHAR(20), status VARCHAR(20), valor DOUBLE PRECISION
+            ) ON COMMIT DELETE ROWS
+        """)
+        cur.execute('TRUNCATE historico_carga')
+        with cur.copy(f'COPY historico_carga ({colunas}) FROM STDIN') as copy:
+            for linha in linhas:
+                copy.write_row([linha[c] for c in COLUNAS_CARGA_HISTORICO])
+        cur.execute(f"""
+            INSERT INTO historico ({colunas}, created_at)
+            SELECT {colunas}, now() AT TIME ZONE 'utc' FROM historico_carga
+            ON CONFLICT DO NOTHING
+            RETURNING id, aluno_id, data, refeicao_id
+        """)
+        return {(aluno_id, data, refeicao_id): id for id, aluno_id, data, refeicao_id in cur.fetchall()}
+
+def inserir_historico(linhas):
+    """INSERT ... ON CONFLICT DO NOTHING em lote
+    
+    A chave única (aluno_id, data, refeicao_id) descarta o que já existe; devolve
+    {(aluno_id, data, refeicao_id): id} só das linhas que entraram de fato.
+    """
+    if not linhas:
+        return {}
+    if len(linhas) >= LIMITE_COPY and db.engine.dialect.name == 'postgresql':
+        return inserir_historico_copy(linhas)
+    stmt = insert_com_conflito(Historico).on_conflict_do_nothing().returning(
+        Historico.id, Historico.aluno_id, Historico.data, Historico.refeicao_id
+    )
+    return {(r.aluno_id, r.data, r.refeicao_id): r.id for r in db.session.execute(stmt, linhas)}
+
+def atualizar_resumo(deltas):
+    """Soma deltas {(data, refeicao, tipo): [qtd, valor, qtd_paga, valor_pago]} no resumo"""
+    if not deltas:
+        return
+    linhas = [{
+        'data': data,
+        'refeicao': refeicao or '',
+        'tipo': tipo,
+        'quantidade': d[0],
+        'valor_total': d[1],
+        'quantidade_paga': d[2],
+        'valor_pago': d[3]
+    } for (data, refeicao, tipo), d in deltas.items()]
+    stmt = insert_com_conflito(ResumoDiario)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['data', 'refeicao', 'tipo'],
+        set_={
+            'quantidade': ResumoDiario.quantidade + stmt.excluded.quantidade,
+            'valor_total': ResumoDiario.valor_total + stmt.excluded.valor_total,
+            'quantidade_paga': ResumoDiario.quantidade_paga + stmt.excluded.quantidade_paga,
+            'valor_pago': ResumoDiario.valor_pago + stmt.excluded.valor_pago
+        }
+    )
+    db.session.execute(stmt, linhas)
+
+# ==================== POLÍTICA DE BLOQUEIO ====================
+# As regras (bloqueio.py) são avaliadas para todos os alunos de uma vez, a
+# partir de uma consulta por aluno no histórico; recálculo, importação e os
+# relatórios de risco usam a mesma avaliação.
+def politica_bloqueio():
+    return PoliticaBloqueio.da_config(config_snapshot())
+
+def depois_do_ultimo_bloqueio(hoje):
+    """Linhas do histórico que ainda contam para a janela e para as seguidas"""
+    return (
+        db.or_(Aluno.fim_ultimo_bloqueio == None, Historico.data > Aluno.fim_ultimo_bloqueio),
+        db.or_(Aluno.bloqueado_ate == None, Aluno.bloqueado_ate >= hoje, Historico.data > Aluno.bloqueado_ate),
+    )
+
+def consulta_regras_bloqueio(politica, hoje, *condicoes):
+    """Por aluno: faltas seguidas (e a data da última), faltas na janela e a data
+    da max_faltas_janela-ésima falta pendente mais recente
+    
+    Uma passada no histórico com row_number() por aluno (todas as linhas e só
+    as faltas pendentes), contando só o que veio depois do último bloqueio
+    temporário já vencido (fim_ultimo_bloqueio, ou o bloqueado_ate gravado que
+    venceu e o recálculo ainda não moveu). `condicoes` filtram os alunos.
+    """
+    pendente = db.case((db.and_(Historico.tipo == 'falta', Historico.status == 'pendente'), 1), else_=0)
+    mais_recente = (Historico.data.desc(), Historico.ordem_refeicao.desc(), Historico.id.desc())
+    linhas = db.select(
+        Historico.aluno_id, Historico.data, pendente.label('pendente'),
+        db.func.row_number().over(partition_by=Historico.aluno_id, order_by=mais_recente).label('posicao'),
+        db.func.row_number().over(partition_by=(Historico.aluno_id, pendente), order_by=mais_recente).label('posicao_falta')
+    ).join(Aluno, Aluno.id == Historico.aluno_id).where(*depois_do_ultimo_bloqueio(hoje), *condicoes).subquery()
+    
+    falta = linhas.c.pendente == 1
+    na_janela = linhas.c.data > hoje - timedelta(days=politica.janela_dias)
+    return db.select(
+        linhas.c.aluno_id,
+        # Seguidas = linhas antes da mais recente que não é falta pendente
+        db.func.coalesce(db.func.min(db.case((~falta, linhas.c.posicao))) - 1, db.func.count()).label('consecutivas'),
+        db.func.max(db.case((db.and_(falta, linhas.c.posicao == 1), linhas.c.data))).label('ultima_consecutiva'),
+        db.func.sum(db.case((db.and_(falta, na_janela), 1), else_=0)).label('faltas_janela'),
+        db.func.max(db.case(
+            (db.and_(falta, linhas.c.posicao_falta == politica.max_faltas_janela), linhas.c.data)
+        )).label('limite_janela')
+    ).group_by(linhas.c.aluno_id)
+
+def regras_por_aluno(politica, hoje, aluno_ids, *condicoes):
+    """Colunas de consulta_regras_bloqueio alinhadas com aluno_ids (zeros sem histórico)"""
+    regras = {r.aluno_id: r for r in db.session.execute(consulta_regras_bloqueio(politica, hoje, *condicoes))}
+    linhas = [regras.get(i) for i in aluno_ids]
+    return {
+        'consecutivas': [r.consecutivas if r else 0 for r in linhas],
+        'ultima_consecutiva': [r.ultima_consecutiva if r else None for r in linhas],
+        'faltas_janela': [r.faltas_janela or 0 if r else 0 for r in linhas],
+        'limite_janela': [r.limite_janela if r else None for r in linhas],
+    }
+
+def faltas_na_janela(politica, hoje, aluno_ids):
+    """aluno_id -> datas das max_faltas_janela faltas pendentes mais recentes que contam"""
+    datas = {}
+    if politica.max_faltas_janela <= 0:
+        return datas
+    for lote in em_lotes(aluno_ids, LOTE_CONSULTA):
+        linhas = db.select(
+            Historico.aluno_id, Historico.data,
+            db.func.row_number().over(
+                partition_by=Historico.aluno_id, order_by=(Historico.data.desc(), Historico.ordem_refeicao.desc())
+            ).label('posicao')
+        ).join(Aluno, Aluno.id == Historico.aluno_id).where(
+            Historico.aluno_id.in_(lote), Historico.tipo == 'falta', Historico.status == 'pendente',
+            *depois_do_ultimo_bloqueio(hoje)
+        ).subquery()
+        for aluno_id, dia in db.session.execute(
+            db.select(linhas.c.aluno_id, linhas.c.data).where(linhas.c.posicao <= politica.max_faltas_janela)
+        ):
+            datas.setdefault(aluno_id, []).append(dia)
+    return datas
+
+def mudancas_bloqueio(diferencas):
+    """(bloqueados, desbloqueados) entre as diferenças de recalcular_alunos"""
+    bloqueados, desbloqueados = [], []
+    for d in diferencas:
+        if 'bloqueado' in d['campos']:
+            (bloqueados if d['campos']['bloqueado'][1] else desbloqueados).append(d)
+    return bloqueados, desbloqueados
+
+def auditar_bloqueios(diferencas, origem):
+    """Um único evento de auditoria com os bloqueios e desbloqueios aplicados"""
+    bloqueados, desbloqueados = mudancas_bloqueio(diferencas)
+    if not bloqueados and not desbloqueados:
+        return
+    detalhes = []
+    if bloqueados:
+        detalhes.append('Bloqueados: ' + ', '.join(f'{d["matricula"]} ({d["nome"]})' for d in bloqueados))
+    if desbloqueados:
+        detalhes.append('Desbloqueados: ' + ', '.join(f'{d["matricula"]} ({d["nome"]})' for d in desbloqueados))
+    log_auditoria(
+        f'{origem}: {len(bloqueados)} aluno(s) BLOQUEADO(s), {len(desbloqueados)} desbloqueado(s)',
+        'alerta' if bloqueados else 'info',
+        '\n'.join(detalhes)
+    )
+
+# ==================== RECÁLCULO DOS ALUNOS ====================
+# Campos do aluno que são só um resumo do histórico (faltas pendentes e regras de bloqueio)
+CAMPOS_DERIVADOS = (
+    'total_faltas', 'debito', 'ultima_falta_data', 'ultima_falta_refeicao', 'ultima_falta_valor',
+    'faltas_consecutivas', 'bloqueado', 'bloqueado_ate', 'fim_ultimo_bloqueio'
+)
+# Diferenças listadas pelo comando recalcular-alunos (o total sai sempre)
+MAX_DIFERENCAS_LISTADAS = 50
+
+def consulta_faltas_pendentes(aluno_ids=None):
+    """Uma linha por aluno com faltas pendentes: quantidade, soma e a última falta
+    
+    Uma única passada no histórico com funções de janela (PARTITION BY aluno_id).
+    """
+    condicoes = [Historico.tipo == 'falta', Historico.status == 'pendente']
+    if aluno_ids is not None:
+        condicoes.append(Historico.aluno_id.in_(aluno_ids))
+    por_aluno = {'partition_by': Historico.aluno_id}
+    faltas = db.select(
+        Historico.aluno_id, Historico.data, Historico.refeicao_id, Historico.valor,
+        db.func.count().over(**por_aluno).label('faltas'),
+        db.func.sum(Historico.valor).over(**por_aluno).label('debito'),
+        db.func.row_number().over(
+            **por_aluno,
+            order_by=(Historico.data.desc(), Historico.ordem_refeicao.desc(), Historico.id.desc())
+        ).label('posicao')
+    ).where(*condicoes).subquery()
+    return db.select(faltas).where(faltas.c.posicao == 1)
+
+def campos_derivados(pendentes):
+    if pendentes is None:
+        return {
+            'total_faltas': 0, 'debito': 0.0, 'ultima_falta_data': None,
+            'ultima_falta_refeicao': None, 'ultima_falta_valor': 0.0
+        }
+    return {
+        'total_faltas': pendentes.faltas,
+        'debito': round(pendentes.debito or 0, 2),
+        'ultima_falta_data': pendentes.data,
+        'ultima_falta_refeicao': nome_refeicao(pendentes.refeicao_id),
+        'ultima_falta_valor': pendentes.valor or 0.0
+    }
+
+def valor_mudou(antes, depois):
+    if isinstance(depois, float) and antes is not None:
+        return abs(antes - depois) > 0.005
+    return antes != depois
+
+def recalcular_alunos(aluno_ids=None, simular=False):
+    """Refaz os CAMPOS_DERIVADOS a partir do histórico e da política de bloqueio
+    
+    Sem aluno_ids recalcula todos; com aluno_ids, só esses (incremental). Só os alunos com
+    diferença são gravados, num UPDATE em lote por chave primária, na
+    transação de quem chama. Devolve as diferenças
+    [{'id', 'matricula', 'nome', 'campos': {campo: [antes, depois]}}]; com
+    simular nada é gravado.
+    """
+    politica = politica_bloqueio()
+    hoje = date.today()
+    diferencas = []
+    lotes = [None] if aluno_ids is None else em_lotes(aluno_ids, LOTE_CONSULTA)
+    for lote in lotes:
+        filtro = () if lote is None else (Aluno.id.in_(lote),)
+        pendentes = {p.aluno_id: p for p in db.session.execute(consulta_faltas_pendentes(lote))}
+        atuais = db.session.execute(db.select(
+            Aluno.id, Aluno.matricula, Aluno.nome, *(getattr(Aluno, c) for c in CAMPOS_DERIVADOS)
+        ).where(*filtro)).all()
+        
+        ids = [a.id for a in atuais]
+        novos = [campos_derivados(pendentes.get(i)) for i in ids]
+        regras = regras_por_aluno(politica, hoje, ids, *filtro)
+        decisao = avaliar_bloqueios(
+            politica, hoje, [n['total_faltas'] for n in novos],
+            regras['consecutivas'], regras['ultima_consecutiva'], regras['faltas_janela'], regras['limite_janela'],
+            [a.bloqueado_ate for a in atuais], [a.fim_ultimo_bloqueio for a in atuais]
+        )
+        bloqueado_ate = decisao['bloqueado_ate'].astype(object)
+        fim_ultimo_bloqueio = decisao['fim_ultimo_bloqueio'].astype(object)
+        
+        alteracoes = []
+        for i, aluno in enumerate(atuais):
+            novos[i].update(
+                faltas_consecutivas=regras['consecutivas'][i],
+                bloqueado=bool(decisao['bloqueado'][i]),
+                bloqueado_ate=bloqueado_ate[i],
+                fim_ultimo_bloqueio=fim_ultimo_bloqueio[i]
+            )
+            campos = {
+                c: [getattr(aluno, c), v] for c, v in novos[i].items() if valor_mudou(getattr(aluno, c), v)
+            }
+            if campos:
+                diferencas.append({'id': aluno.id, 'matricula': aluno.matricula, 'nome': aluno.nome, 'campos': campos})
+                alteracoes.append({'id': aluno.id, **novos[i]})
+        
+        if alteracoes and not simular:
+            db.session.execute(db.update(Aluno), alteracoes)
+    
+    # Um bloqueio temporário que venceu agora tira da conta as faltas até o
+    # fim dele: esses alunos passam de novo, já com fim_ultimo_bloqueio gravado
+    revisar = [d['id'] for d in diferencas if 'fim_ultimo_bloqueio' in d['campos']]
+    if revisar and not simular:
+        juntar_diferencas(diferencas, recalcular_alunos(revisar))
+    return diferencas
+
+def juntar_diferencas(diferencas, seguintes):
+    """Acrescenta às diferenças as de um recálculo seguinte (antes da primeira, depois da última)"""
+    por_id = {d['id']: d for d in diferencas}
+    for d in seguintes:
+        campos = por_id[d['id']]['campos']
+        for c, (antes, depois) in d['campos'].items():
+            campos[c] = [campos[c][0] if c in campos else antes, depois]
+            if not valor_mudou(campos[c][0], depois):
+                del campos[c]
+
+def importar_registros(lote):
+    """Grava o lote preparado da planilha usando consultas em conjunto"""
+    resultado = {'novos': 0, 'faltas': 0, 'inseridos': 0, 'bloqueados': []}
+    if lote.empty:
+        return resultado
+    
+    # Refeições fora do catálogo (id 0) entram nele com o nome da planilha
+    desconhecidas = lote['refeicao_id'] == 0
+    catalogo = catalogo_refeicoes()
+    if desconhecidas.any():
+        catalogo = registrar_refeicoes(lote.loc[desconhecidas, 'refeicao_original'].unique())
+        lote = lote.copy()
+        lote.loc[desconhecidas, 'refeicao_id'] = lote.loc[desconhecidas, 'refeicao_original'].map(
+            catalogo.identificar
+        ).astype('int16')
+    
+    registros = list(lote.itertuples(index=False))
+    
+    # 1 - mapa matricula -> aluno, criando os que faltam de uma vez
+    alunos = carregar_alunos_por_matricula(lote['matricula'].unique())
+    
+    novos_alunos = []
+    for reg in registros:
+        if reg.matricula not in alunos:
+            aluno = Aluno(
+                matricula=reg.matricula,
+                nome=reg.nome,
+                curso=reg.curso,
+                total_faltas=0,
+                debito=0.0,
+                ultima_falta_valor=0.0,
+                faltas_consecutivas=0,
+                bloqueado=False
+            )
+            alunos[reg.matricula] = aluno
+            novos_alunos.append(aluno)
+    
+    if novos_alunos:
+        db.session.add_all(novos_alunos)
+        db.session.flush()
+    resultado['novos'] = len(novos_alunos)
+    
+    # 2 - candidatos: deduplicados dentro do arquivo, sem o que cai dentro de
+    # um bloqueio (o temporário vale até bloqueado_ate)
+    candidatos = []
+    vistos = set()
+    for reg in registros:
+        aluno = alunos[reg.matricula]
+        
+        if bloqueio_vale(aluno.bloqueado, aluno.bloqueado_ate, reg.data):
+            continue
+        
+        chave = (aluno.id, reg.data, int(reg.refeicao_id))
+        if chave in vistos:
+            continue
+        vistos.add(chave)
+        
+        if reg.presente:
+            tipo, status, valor = 'presenca', 'presente', 0
+        else:
+            tipo, status, valor = 'falta', 'pendente', get_valor_refeicao(chave[2])
+        
+        candidatos.append((aluno, reg, chave, {
+            'aluno_id': aluno.id,
+            'data': reg.data,
+            'refeicao_id': chave[2],
+            'ordem_refeicao': int(reg.ordem),
+            'tipo': tipo,
+            'status': status,
+            'valor': valor
+        }))
+    
+    # 3 - inserção em lote; o banco descarta o que já foi importado antes
+    inseridos = inserir_historico([c[3] for c in candidatos])
+    
+    # 4 - corte na ordem (data, ordem), só com o que entrou: o que cai dentro
+    # de um bloqueio (qualquer regra) que o próprio lote causou não vale
+    politica = politica_bloqueio()
+    janelas = faltas_na_janela(
+        politica, date.today(), list({c[0].id for c in candidatos if c[2] in inseridos and c[0].total_faltas})
+    )
+    estados = {}
+    tocados = set()
+    descartados = []
+    resumo = {}
+    
+    for aluno, reg, chave, linha in candidatos:
+        if chave not in inseridos:
+            continue
+        
+        estado = estados.get(aluno.id)
+        if estado is None:
+            consecutivas = aluno.faltas_consecutivas or 0
+            estado = estados[aluno.id] = EstadoNoLote(
+                politica, aluno.total_faltas or 0, consecutivas,
+                aluno.ultima_falta_data if consecutivas else None, janelas.get(aluno.id, ()),
+                aluno.bloqueado, aluno.bloqueado_ate, aluno.fim_ultimo_bloqueio
+            )
+        if not estado.aceitar(linha['data'], linha['tipo'] == 'falta'):
+            descartados.append(inseridos[chave])
+            continue
+        tocados.add(aluno.id)
+        
+        delta = resumo.setdefault((linha['data'], catalogo.nome(linha['refeicao_id']), linha['tipo']), [0, 0.0, 0, 0.0])
+        delta[0] += 1
+        delta[1] += linha['valor']
+        if linha['tipo'] == 'falta':
+            resultado['faltas'] += 1
+    
+    for lote_ids in em_lotes(descartados, LOTE_CONSULTA):
+        Historico.query.filter(Historico.id.in_(lote_ids)).delete(synchronize_session=False)
+    atualizar_resumo(resumo)
+    # 5 - contadores e bloqueios (todas as regras) dos alunos do lote numa passada só
+    diferencas = recalcular_alunos(tocados)
+    resultado['bloqueados'] = [d['matricula'] for d in mudancas_bloqueio(diferencas)[0]]
+    auditar_bloqueios(diferencas, 'Importação')
+    resultado['inseridos'] = len(inseridos) - len(descartados)
+    
+    return resultado
+
+def importar_arquivo(filepath, nome_arquivo, progresso=None):
+    """Importa a planilha em lotes, com commit e checkpoint a cada lote
+    
+    Se a importação falhar no meio, reenviar o mesmo arquivo retoma a partir
+    da última linha confirmada. `progresso(checkpoint)` é chamado antes do
+    commit de cada lote, dentro da mesma transação.
+    """
+    pasta = app.config['UPLOAD_FOLDER']
+    hash_arquivo = calcular_hash(filepath)
+    checkpoint = ler_checkpoint(pasta, hash_arquivo) or {
+        'arquivo': nome_arquivo,
+        'linhas_confirmadas': 0,
+        'inseridos': 0,
+        'novos': 0,
+        'faltas': 0,
+        'bloqueados': 0,
+        'total_rejeitadas': 0,
+        'rejeitadas': []
+    }
+    retomada = checkpoint['linhas_confirmadas'] > 0
+    
+    try:
+        lotes = ler_planilha_em_lotes(
+            filepath,
+            app.config['IMPORTACAO_LOTE_LINHAS'],
+            pular=checkpoint['linhas_confirmadas']
+        )
+        for linha_inicial, df in lotes:
+            lote, rejeitadas = preparar_agendamentos(df, catalogo_refeicoes(), linha_inicial)
+            resultado = importar_registros(lote)
+            
+            checkpoint['linhas_confirmadas'] += len(df)
+            checkpoint['inseridos'] += resultado['inseridos']
+            checkpoint['novos'] += resultado['novos']
+            checkpoint['faltas'] += resultado['faltas']
+            checkpoint['bloqueados'] += len(resultado['bloqueados'])
+            checkpoint['total_rejeitadas'] += len(rejeitadas)
+            espaco = MAX_REJEITADAS_RELATORIO - len(checkpoint['rejeitadas'])
+            checkpoint['rejeitadas'].extend(rejeitadas[:max(0, espaco)])
+            
+            if progresso:
+                progresso(checkpoint)
+            db.session.commit()
+            invalidar_caches()
+            salvar_checkpoint(pasta, hash_arquivo, checkpoint)
+    except Exception:
+        db.session.rollback()
+        # Refeições cadastradas no lote desfeito não existem mais
+        _catalogo['atual'] = None
+        raise
+    
+    remover_checkpoint(pasta, hash_arquivo)
+    checkpoint['retomada'] = retomada
+    return checkpoint
+
+def mensagem_importacao(resultado):
+    msg = f'Importação OK! {resultado["novos"]} novos alunos, {resultado["faltas"]} faltas.'
+    if resultado['bloqueados']:
+        msg += f' {resultado["bloqueados"]} bloqueados.'
+    if resultado['total_rejeitadas']:
+        msg += f' {resultado["total_rejeitadas"]} linha(s) rejeitada(s).'
+    if resultado['retomada']:
+        msg += ' (importação retomada do último ponto salvo)'
+    return msg
+
+# ==================== FILA DE IMPORTAÇÃO ====================
+# Um worker por processo: o SQLite só aceita um escritor por vez
+executor_importacao = ThreadPoolExecutor(max_workers=1, thread_name_prefix='importacao')
+
+# Job em 'processando' sem sinal por esse tempo é considerado abandonado
+# (processo reiniciado no meio) e pode ser retomado. Enquanto o worker vive,
+# uma thread renova atualizado_em a cada JOB_IMPORTACAO_PULSO numa transação
+# curta e própria, então um lote demorado não faz o job parecer abandonado.
+# Quem reserva grava um token em dono; o progresso de cada lote só é gravado
+# se o token ainda for o mesmo, senão o lote é desfeito (JobPerdido).
+JOB_IMPORTACAO_EXPIRA = timedelta(minutes=10)
+JOB_IMPORTACAO_PULSO = 60
+
+class JobPerdido(Exception):
+    """Outro worker reservou o job (esta reserva foi dada como abandonada)"""
+
+_jobs_retomados = False
+_jobs_lock = threading.Lock()
+
+def enfileirar_importacao(job_id):
+    executor_importacao.submit(processar_job_importacao, job_id)
+
+def reservar_job(job_id):
+    """Token da reserva, ou None se o job já está com outro worker ou terminou"""
+    agora = datetime.utcnow()
+    dono = uuid.uuid4().hex
+    reservados = ImportacaoJob.query.filter(
+        ImportacaoJob.id == job_id,
+        db.or_(
+            ImportacaoJob.status == 'pendente',
+            db.and_(
+                ImportacaoJob.status == 'processando',
+                ImportacaoJob.atualizado_em < agora - JOB_IMPORTACAO_EXPIRA
+            )
+        )
+    ).update({
+        'status': 'processando',
+        'iniciado_em': db.func.coalesce(ImportacaoJob.iniciado_em, agora),
+        'atualizado_em': agora,
+        'dono': dono
+    }, synchronize_session=False)
+    db.session.commit()
+    return dono if reservados == 1 else None
+
+def manter_reserva(job_id, dono, parar):
+    """Renova atualizado_em do job até `parar` ser sinalizado"""
+    with app.app_context():
+        while not parar.wait(JOB_IMPORTACAO_PULSO):
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.update(ImportacaoJob).where(
+                        ImportacaoJob.id == job_id, ImportacaoJob.dono == dono
+                    ).values(atualizado_em=datetime.utcnow()))
+            except Exception as e:
+                # Banco ocupado pelo próprio lote: tenta de novo no próximo pulso
+                app.logger.warning(f'Pulso do job {job_id} falhou: {e}')
+
+def processar_job_importacao(job_id):
+    with app.app_context():
+        dono = reservar_job(job_id)
+        if not dono:
+            return
+        
+        job = db.session.get(ImportacaoJob, job_id)
+        caminho, arquivo = job.caminho, job.arquivo
+        
+        def progresso(checkpoint):
+            gravados = ImportacaoJob.query.filter_by(id=job_id, dono=dono).update({
+                'linhas_lidas': checkpoint['linhas_confirmadas'],
+                'linhas_inseridas': checkpoint['inseridos'],
+                'novos_alunos': checkpoint['novos'],
+                'faltas': checkpoint['faltas'],
+                'bloqueados': checkpoint['bloqueados'],
+                'rejeitadas': checkpoint['total_rejeitadas'],
+                'rejeitadas_detalhes': json.dumps(checkpoint['rejeitadas'], ensure_ascii=False),
+                'atualizado_em': datetime.utcnow()
+            }, synchronize_session=False)
+            if gravados != 1:
+                raise JobPerdido(job_id)
+        
+        parar = threading.Event()
+        pulso = threading.Thread(target=manter_reserva, args=(job_id, dono, parar), daemon=True)
+        pulso.start()
+        try:
+            resultado = importar_arquivo(caminho, arquivo, progresso)
+            status, mensagem = 'concluida', mensagem_importacao(resultado)
+        except JobPerdido:
+            # O lote foi desfeito; quem reservou depois segue do checkpoint
+            return
+        except PlanilhaInvalida as e:
+            status, mensagem = 'erro', str(e)
+        except Exception as e:
+            db.session.rollback()
+            status = 'erro'
+            mensagem = f'Erro: {str(e)}. Envie o mesmo arquivo novamente para retomar a importação.'
+        finally:
+            parar.set()
+            pulso.join()
+        
+        agora = datetime.utcnow()
+        gravados = ImportacaoJob.query.filter_by(id=job_id, dono=dono).update({
+            'status': status,
+            'mensagem': mensagem,
+            'atualizado_em': agora,
+            'concluido_em': agora
+        }, synchronize_session=False)
+        db.session.commit()
+        
+        # O arquivo fica para quem tiver reservado o job depois
+        if gravados == 1 and os.path.exists(caminho):
+            os.remove(caminho)
+
+def retomar_jobs_pendentes():
+    """Reenfileira jobs que ficaram para trás num reinício do servidor"""
+    limite = datetime.utcnow() - JOB_IMPORTACAO_EXPIRA
+    jobs = ImportacaoJob.query.filter(
+        db.or_(
+            ImportacaoJob.status == 'pendente',
+            db.and_(ImportacaoJob.status == 'processando', ImportacaoJob.atualizado_em < limite)
+        )
+    ).order_by(ImportacaoJob.created_at).all()
+    for job in jobs:
+        enfileirar_importacao(job.id)
+
+@app.before_request
+def iniciar_fila_importacao():
+    # Na primeira requisição (e não no import do módulo, que o reloader roda
+    # duas vezes); junto, passa a receber os eventos dos outros workers
+    global _jobs_retomados
+    if _jobs_retomados:
+        return
+    with _jobs_lock:
+        if not _jobs_retomados:
+            _jobs_retomados = True
+            barramento.iniciar_repasse()
+            retomar_jobs_pendentes()
+
+# ==================== FIM DOS BLOQUEIOS TEMPORÁRIOS ====================
+# bloqueado_ate vence na virada do dia. No primeiro acesso de cada dia, cada
+# processo recalcula (na fila de importação, o único escritor) os alunos com
+# bloqueio temporário vencido; sem isso, contagens, listas e exportações
+# continuariam mostrando-os bloqueados. Não precisa de cron.
+_liberacao = {'dia': None, 'lock': threading.Lock()}
+
+def liberar_bloqueios_vencidos():
+    """Recalcula os alunos cujo bloqueado_ate já passou; devolve as diferenças"""
+    ids = db.session.execute(db.select(Aluno.id).where(Aluno.bloqueado_ate < date.today())).scalars().all()
+    if not ids:
+        return []
+    diferencas = recalcular_alunos(ids)
+    auditar_bloqueios(diferencas, 'Fim de bloqueio temporário')
     db.session.commit()
+    invalidar_caches()
+    return diferencas
+
+def processar_liberacao():
+    with app.app_context():
+        try:
+            liberar_bloqueios_vencidos()
+        except Exception as e:
+            db.session.rollback()
+            print(f'Erro ao liberar bloqueios vencidos: {e}')
+
+@app.before_request
+def agendar_liberacao_do_dia():
+    hoje = date.today()
+    if _liberacao['dia'] == hoje:
+        return
+    with _liberacao['lock']:
+        if _liberacao['dia'] != hoje:
+            _liberacao['dia'] = hoje
+            executor_importacao.submit(processar_liberacao)
+
+def job_para_dict(job):
+    fim = job.concluido_em or datetime.utcnow()
+    duracao = (fim - job.iniciado_em).total_seconds() if job.iniciado_em else 0
+    return {
+        'id': job.id,
+        'arquivo': job.arquivo,
+        'status': job.status,
+        'linhas_lidas': job.linhas_lidas or 0,
+        'linhas_inseridas': job.linhas_inseridas or 0,
+        'novos_alunos': job.novos_alunos or 0,
+        'faltas': job.faltas or 0,
+        'bloqueados': job.bloqueados or 0,
+        'rejeitadas': job.rejeitadas or 0,
+        'rejeitadas_detalhes': json.loads(job.rejeitadas_detalhes) if job.rejeitadas_detalhes else [],
+        'linhas_por_segundo': round((job.linhas_lidas or 0) / duracao, 1) if duracao > 0 else 0,
+        'duracao_segundos': round(duracao, 1),
+        'mensagem': job.mensagem,
+        'criado_em': job.created_at.strftime('%d/%m/%Y %H:%M:%S'),
+        'concluido_em': job.concluido_em.strftime('%d/%m/%Y %H:%M:%S') if job.concluido_em else None
+    }
+
+# ==================== COMANDOS (flask --app app ...) ====================
+@app.cli.command('migrar')
+def comando_migrar():
+    """Aplica as migrações pendentes do banco"""
+    aplicadas = aplicar_migracoes(db.engine)
+    print(f'Migrações aplicadas: {aplicadas}' if aplicadas else 'Banco já está atualizado.')
+
+@app.cli.command('copiar-banco')
+@click.argument('destino')
+@click.option('--lote', default=5000, show_default=True, help='Linhas por INSERT em lote.')
+def comando_copiar_banco(destino, lote):
+    """Copia todos os dados do banco atual para DESTINO (URL, ex.: postgresql+psycopg://...)
+    
+    O destino é criado com o esquema atual e precisa estar vazio.
+    """
+    engine_destino = criar_engine(destino)
+    db.metadata.create_all(engine_destino)
+    aplicar_migracoes(engine_destino)
+    try:
+        copiados = copiar_dados(db.engine, engine_destino, db.metadata.sorted_tables, lote)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        engine_destino.dispose()
+    for tabela, linhas in copiados.items():
+        print(f'{tabela}: {linhas} linhas')
+
+@app.cli.command('reconstruir-resumo')
+def comando_reconstruir_resumo():
+    """Recalcula o resumo diário dos relatórios a partir do histórico"""
+    with db.engine.begin() as conn:
+        linhas = reconstruir_resumo_diario(conn)
+    print(f'Resumo diário reconstruído: {linhas} linhas.')
+
+@app.cli.command('recalcular-alunos')
+@click.option('--simular', is_flag=True, help='Só mostra as diferenças, sem gravar.')
+@click.option('--matricula', 'matriculas', multiple=True, help='Recalcula só esse aluno (pode repetir).')
+def comando_recalcular_alunos(simular, matriculas):
+    """Refaz débito, faltas, última falta e bloqueio dos alunos a partir do histórico
+    
+    Os bloqueios temporários vencidos o próprio app libera no primeiro
+    acesso do dia (liberar_bloqueios_vencidos); este comando refaz tudo.
+    """
+    aluno_ids = None
+    if matriculas:
+        aluno_ids = db.session.execute(db.select(Aluno.id).where(Aluno.matricula.in_(matriculas))).scalars().all()
+    diferencas = recalcular_alunos(aluno_ids, simular=simular)
+    for d in diferencas[:MAX_DIFERENCAS_LISTADAS]:
+        campos = ', '.join(f'{c}: {antes!r} -> {depois!r}' for c, (antes, depois) in d['campos'].items())
+        print(f'{d["matricula"]}: {campos}')
+    if len(diferencas) > MAX_DIFERENCAS_LISTADAS:
+        print(f'... e mais {len(diferencas) - MAX_DIFERENCAS_LISTADAS} aluno(s).')
+    
+    if simular:
+        db.session.rollback()
+        print(f'{len(diferencas)} aluno(s) com diferença (simulação, nada foi gravado).')
+        return
+    if diferencas:
+        log_auditoria(f'Recálculo dos alunos: {len(diferencas)} aluno(s) corrigido(s)', 'info')
+        auditar_bloqueios(diferencas, 'Recálculo dos alunos')
+    db.session.commit()
+    invalidar_caches()
+    print(f'{len(diferencas)} aluno(s) corrigido(s).')
+
+@app.cli.command('limpar-auditoria')
+@click.option('--dias', default=30, show_default=True, help='Mantém os logs dos últimos N dias.')
+@click.option('--lote', default=5000, show_default=True, help='Linhas removidas por transação.')
+@click.option('--arquivar', 'pasta_arquivo', default=None,
+              help='Pasta onde guardar os meses removidos (auditoria_AAAA-MM.jsonl.gz).')
+def comando_limpar_auditoria(dias, lote, pasta_arquivo):
+    """Remove logs de auditoria antigos, em lotes, arquivando se pedido"""
+    try:
+        removidos = limpar_logs_antigos(dias, lote=lote, pasta_arquivo=pasta_arquivo, engine=db.engine)
+    except Exception as e:
+        raise click.ClickException(f'Erro ao limpar logs: {e}')
+    print(f'Logs de auditoria removidos: {removidos}.')
+
+@app.cli.command('backup')
+@click.option('--pasta', default=PASTA_BACKUPS, show_default=True)
+@click.option('--manter', default=7, show_default=True, help='Quantos backups guardar na pasta.')
+@click.option('--intervalo', default=0.0, help='Horas entre backups; sem ele, faz um só e sai.')
+def comando_backup(pasta, manter, intervalo):
+    """Backup do banco com a aplicação rodando (API de backup do SQLite)"""
+    if not eh_sqlite(URL_BANCO):
+        raise click.ClickException('Backup só para SQLite; no PostgreSQL use pg_dump.')
+    if intervalo > 0:
+        agendar_backups(intervalo, pasta, manter)
+        return
+    arquivo = fazer_backup(pasta)
+    if not arquivo:
+        raise SystemExit(1)
+    rotacionar_backups(pasta, manter)
+    print(f'Backup gravado em {arquivo}.')
 
-def verificar_bloqueio(aluno):
-    max_faltas = int(get_config('max_faltas') or 3)
-    if aluno.total_faltas >= max_faltas and not aluno.bloqueado:
-        aluno.bloqueado = True
-        log_auditoria(f'Aluno {aluno.nome} BLOQUEADO com {aluno.total_faltas} faltas', 'alerta')
-        return True
-    return False
+@app.cli.command('restaurar-backup')
+@click.argument('arquivo')
+def comando_restaurar_backup(arquivo):
+    """Restaura um backup (.db.gz) no banco em uso, conferindo o checksum antes"""
+    if not eh_sqlite(URL_BANCO):
+        raise click.ClickException('Restauração só para SQLite; no PostgreSQL use pg_restore.')
+    if ler_checksum(arquivo) is None:
+        print('Aviso: backup sem arquivo .sha256; só o integrity_check será conferido.')
+    if not restaurar_backup(arquivo):
+        raise SystemExit(1)
+    print('Banco restaurado.')
 
 # ROTAS PRINCIPAIS
 @app.route('/')
@@ -161,107 +1158,345 @@ def auditoria():
 def configuracoes():
     return render_template('configuracoes.html')
 
+# ==================== LISTAGEM PAGINADA ====================
+LIMITE_PAGINA_PADRAO = 50
+LIMITE_PAGINA_MAXIMO = 500
+
+# chave de ordenação -> (coluna, conversor do valor guardado no cursor)
+ORDENACOES_ALUNOS = {
+    'nome': (Aluno.nome, str),
+    'matricula': (Aluno.matricula, str),
+    'faltas': (Aluno.total_faltas, int),
+    'debito': (Aluno.debito, float),
+    'ultima_falta': (Aluno.ultima_falta_data, date.fromisoformat),
+}
+
+# Linhas buscadas por vez nas listagens em NDJSON (?formato=ndjson), que
+# devolvem o resultado inteiro sem paginação
+LOTE_NDJSON = 1000
+
+class ParametroInvalido(Exception):
+    pass
+
+def codificar_cursor(valor, ultimo_id):
+    if isinstance(valor, date):
+        valor = valor.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([valor, ultimo_id]).encode()).decode()
+
+def decodificar_cursor(cursor, conversor):
+    try:
+        valor, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (conversor(valor) if valor is not None else None), int(ultimo_id)
+    except (ValueError, TypeError):
+        raise ParametroInvalido('Cursor inválido!')
+
+def filtro_keyset(coluna, coluna_id, valor, ultimo_id, desc):
+    """Condição "depois do último item da página" para ORDER BY coluna, id
+    
+    Segue a ordem de ordenar_keyset: NULL primeiro no ASC e por último no DESC.
+    """
+    if desc:
+        if valor is None:
+            return db.and_(coluna.is_(None), coluna_id < ultimo_id)
+        return db.or_(
+            coluna < valor,
+            db.and_(coluna == valor, coluna_id < ultimo_id),
+            coluna.is_(None)
+        )
+    if valor is None:
+        return db.or_(coluna.isnot(None), db.and_(coluna.is_(None), coluna_id > ultimo_id))
+    return db.or_(coluna > valor, db.and_(coluna == valor, coluna_id > ultimo_id))
+
+def ordenar_keyset(coluna, coluna_id, desc):
+    if desc:
+        return [coluna.desc().nullslast(), coluna_id.desc()]
+    return [coluna.asc().nullsfirst(), coluna_id.asc()]
+
+def linhas_em_lotes(query):
+    """Resultado lido aos poucos (cursor do servidor no PostgreSQL), para o NDJSON"""
+    yield from db.session.execute(query.execution_options(yield_per=LOTE_NDJSON))
+
+def limite_pagina(valor):
+    try:
+        return max(1, min(int(valor or LIMITE_PAGINA_PADRAO), LIMITE_PAGINA_MAXIMO))
+    except ValueError:
+        raise ParametroInvalido('Limite inválido!')
+
+def data_parametro(valor):
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ParametroInvalido(f'Data inválida: {valor} (use AAAA-MM-DD)')
+
+def filtros_periodo(coluna, args):
+    """Condições de/ate (AAAA-MM-DD, dias inteiros) sobre uma coluna de data ou data/hora"""
+    condicoes = []
+    inicio = data_parametro(args.get('de'))
+    if inicio:
+        condicoes.append(coluna >= inicio)
+    fim = data_parametro(args.get('ate'))
+    if fim:
+        condicoes.append(coluna < fim + timedelta(days=1))
+    return condicoes
+
+def prefixo_seguinte(prefixo):
+    # 'abc' -> 'abd': o intervalo [prefixo, seguinte) usa o índice (LIKE não usa)
+    return prefixo[:-1] + chr(ord(prefixo[-1]) + 1)
+
+# Quem está em risco muda com importações, pagamentos e configurações (limpam o cache)
+cache_risco = CacheRespostas(ttl=10)
+
+def alunos_em_risco():
+    """Alunos ativos a uma falta de alguma regra de bloqueio
+    
+    Mesma avaliação da política de bloqueio, sobre os alunos não bloqueados
+    com falta pendente. Linhas de COLUNAS_ALUNO mais faltas_restantes.
+    """
+    hoje = date.today()
+    dados = cache_risco.get(hoje)
+    if dados is not None:
+        return dados
+    
+    politica = politica_bloqueio()
+    condicoes = (Aluno.bloqueado == False, Aluno.total_faltas > 0)
+    alunos = db.session.execute(db.select(*COLUNAS_ALUNO).where(*condicoes).order_by(Aluno.id)).all()
+    regras = regras_por_aluno(politica, hoje, [a.id for a in alunos], *condicoes)
+    restantes = faltas_restantes(
+        politica, [a.total_faltas for a in alunos], regras['consecutivas'], regras['faltas_janela']
+    )
+    dados = [(a, int(r)) for a, r in zip(alunos, restantes) if r <= 1]
+    cache_risco.set(hoje, dados)
+    return dados
+
+# Os alunos em risco vão para uma tabela temporária da conexão só quando o
+# filtro é status=risco (listagem e exportação), uma vez por requisição, e a
+# consulta parte dela: sem um parâmetro por aluno
+tabela_risco = db.table('aluno_risco', db.column('id', db.Integer), db.column('restantes', db.Integer))
+
+def preencher_tabela_risco():
+    """Grava alunos_em_risco() em aluno_risco, na transação atual da sessão"""
+    db.session.execute(db.text('CREATE TEMP TABLE IF NOT EXISTS aluno_risco (id INTEGER PRIMARY KEY, restantes INTEGER)'))
+    db.session.execute(db.text('DELETE FROM aluno_risco'))
+    linhas = [{'id': a.id, 'restantes': r} for a, r in alunos_em_risco()]
+    if linhas:
+        db.session.execute(db.insert(tabela_risco), linhas)
+
+def condicao_em_risco():
+    preencher_tabela_risco()
+    return Aluno.id.in_(db.select(tabela_risco.c.id))
+
+def filtros_alunos(args):
+    """Condições de busca/status/data da listagem de alunos (query string)"""
+    condicoes = []
+    
+    busca = (args.get('busca') or '').strip()
+    if busca:
+        seguinte = prefixo_seguinte(busca)
+        nome = db.func.lower(Aluno.nome)
+        condicoes.append(db.or_(
+            db.and_(Aluno.matricula >= busca, Aluno.matricula < seguinte),
+            db.and_(nome >= db.func.lower(busca), nome < db.func.lower(seguinte))
+        ))
+    
+    status = args.get('status') or 'todos'
+    if status == 'ativos':
+        condicoes.append(Aluno.bloqueado == False)
+    elif status == 'bloqueados':
+        condicoes.append(Aluno.bloqueado == True)
+    elif status == 'debito':
+        condicoes.append(Aluno.debito > 0)
+    elif status == 'risco':
+        condicoes.append(condicao_em_risco())
+    elif status != 'todos':
+        raise ParametroInvalido(f'Status inválido: {status}')
+    
+    inicio = data_parametro(args.get('ultima_falta_de'))
+    if inicio:
+        condicoes.append(Aluno.ultima_falta_data >= inicio)
+    fim = data_parametro(args.get('ultima_falta_ate'))
+    if fim:
+        condicoes.append(Aluno.ultima_falta_data <= fim)
+    
+    return condicoes
+
+def resumo_alunos(condicoes):
+    resumo = db.session.query(
+        db.func.count(Aluno.id).label('total'),
+        db.func.sum(db.case((Aluno.bloqueado == True, 1), else_=0)).label('bloqueados'),
+        db.func.sum(db.case((Aluno.debito > 0, 1), else_=0)).label('com_debito')
+    ).filter(*condicoes).one()
+    
+    # Em risco: a lista em cache cruzada com os alunos do filtro que podem estar nela
+    risco = {a.id for a, _ in alunos_em_risco()}
+    if risco and condicoes:
+        filtrados = db.session.scalars(
+            db.select(Aluno.id).where(*condicoes, Aluno.bloqueado == False, Aluno.total_faltas > 0)
+        )
+        em_risco = sum(1 for i in filtrados if i in risco)
+    else:
+        em_risco = len(risco)
+    
+    return {
+        'total': resumo.total or 0,
+        'bloqueados': resumo.bloqueados or 0,
+        'com_debito': resumo.com_debito or 0,
+        'em_risco': em_risco
+    }
+
+def aluno_para_dict(aluno):
+    return {
+        'id': aluno.id,
+        'matricula': aluno.matricula,
+        'nome': aluno.nome,
+        'curso': aluno.curso,
+        'total_faltas': aluno.total_faltas,
+        'debito': aluno.debito,
+        'ultima_falta': aluno.ultima_falta_br,
+        'ultima_refeicao': aluno.ultima_falta_refeicao,
+        'bloqueado': aluno.bloqueado,
+        'status': 'BLOQUEADO' if aluno.bloqueado else 'Ativo'
+    }
+
 # ==================== API - ALUNOS ====================
 @app.route('/api/alunos', methods=['GET'])
 def api_alunos():
-    alunos = Aluno.query.all()
-    result = []
-    for aluno in alunos:
-        result.append({
-            'id': aluno.id,
-            'matricula': aluno.matricula,
-            'nome': aluno.nome,
-            'curso': aluno.curso,
-            'total_faltas': aluno.total_faltas,
-            'debito': aluno.debito,
-            'ultima_falta': aluno.ultima_falta_data.strftime('%d/%m/%Y') if aluno.ultima_falta_data else None,
-            'ultima_refeicao': aluno.ultima_falta_refeicao,
-            'bloqueado': aluno.bloqueado,
-            'status': 'BLOQUEADO' if aluno.bloqueado else 'Ativo'
-        })
-    return jsonify(result)
+    """Lista paginada (keyset) de alunos
+    
+    Parâmetros: busca (prefixo de matrícula ou nome), status (todos, ativos,
+    bloqueados, debito, risco), ultima_falta_de/ultima_falta_ate (AAAA-MM-DD),
+    ordem (nome, matricula, faltas, debito, ultima_falta), direcao (asc, desc),
+    limite e cursor (o proximo_cursor da página anterior). Com formato=ndjson
+    vêm todos os alunos do filtro (a partir do cursor), um por linha.
+    """
+    try:
+        max_faltas = get_max_faltas()
+        condicoes = filtros_alunos(request.args)
+        
+        ordem = request.args.get('ordem') or 'nome'
+        if ordem not in ORDENACOES_ALUNOS:
+            raise ParametroInvalido(f'Ordenação inválida: {ordem}')
+        coluna, conversor = ORDENACOES_ALUNOS[ordem]
+        desc = request.args.get('direcao') == 'desc'
+        limite = limite_pagina(request.args.get('limite'))
+        
+        # Projeção: linhas (tuplas nomeadas), sem objetos ORM rastreados pela sessão
+        query = db.select(*COLUNAS_ALUNO).where(*condicoes)
+        cursor = request.args.get('cursor')
+        if cursor:
+            valor, ultimo_id = decodificar_cursor(cursor, conversor)
+            query = query.where(filtro_keyset(coluna, Aluno.id, valor, ultimo_id, desc))
+        query = query.order_by(*ordenar_keyset(coluna, Aluno.id, desc))
+        
+        if quer_ndjson(request.args):
+            return resposta_ndjson(map(aluno_para_dict, linhas_em_lotes(query)))
+        
+        # Um a mais para saber se existe próxima página
+        alunos = db.session.execute(query.limit(limite + 1)).all()
+    except ParametroInvalido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    proximo_cursor = None
+    if len(alunos) > limite:
+        alunos = alunos[:limite]
+        ultimo = alunos[-1]
+        proximo_cursor = codificar_cursor(getattr(ultimo, coluna.key), ultimo.id)
+    
+    return jsonify({
+        'alunos': [aluno_para_dict(a) for a in alunos],
+        'proximo_cursor': proximo_cursor,
+        'resumo': resumo_alunos(condicoes),
+        'max_faltas': max_faltas
+    })
+
+POR_PAGINA_DETALHE = 50
+
+def pagina_parametro(valor):
+    try:
+        return max(1, int(valor or 1))
+    except ValueError:
+        raise ParametroInvalido('Página inválida!')
+
+def pagina_historico(aluno_id, pagina, por_pagina=POR_PAGINA_DETALHE):
+    # Ordem do dia já gravada na linha: o banco devolve ordenado pelo índice
+    itens = db.session.execute(
+        db.select(*COLUNAS_HISTORICO).where(Historico.aluno_id == aluno_id).order_by(
+            Historico.data.desc(),
+            Historico.ordem_refeicao.desc(),
+            Historico.id.desc()
+        ).offset((pagina - 1) * por_pagina).limit(por_pagina)
+    ).all()
+    total = db.session.execute(
+        db.select(db.func.count()).select_from(Historico).where(Historico.aluno_id == aluno_id)
+    ).scalar()
+    return {
+        'itens': [{
+            'data': h.data_br,
+            'refeicao': nome_refeicao(h.refeicao_id),
+            'tipo': h.tipo,
+            'status': h.status,
+            'valor': h.valor
+        } for h in itens],
+        'pagina': pagina,
+        'total': total,
+        'tem_mais': pagina * por_pagina < total
+    }
+
+def pagina_pagamentos(aluno_id, pagina, por_pagina=POR_PAGINA_DETALHE):
+    itens = db.session.execute(
+        db.select(*COLUNAS_PAGAMENTO).where(Pagamento.aluno_id == aluno_id).order_by(
+            Pagamento.data.desc(),
+            Pagamento.id.desc()
+        ).offset((pagina - 1) * por_pagina).limit(por_pagina)
+    ).all()
+    total = db.session.execute(
+        db.select(db.func.count()).select_from(Pagamento).where(Pagamento.aluno_id == aluno_id)
+    ).scalar()
+    return {
+        'itens': [{
+            'data': p.data_br,
+            'valor': p.valor,
+            'motivo': p.motivo,
+            'faltas_quitadas': p.faltas_quitadas
+        } for p in itens],
+        'pagina': pagina,
+        'total': total,
+        'tem_mais': pagina * por_pagina < total
+    }
 
 @app.route('/api/alunos/<int:id>', methods=['GET'])
 def api_aluno(id):
-    aluno = Aluno.query.get_or_404(id)
+    """Detalhe do aluno com a primeira página do histórico e dos pagamentos
     
-    def normalizar_refeicao(refeicao):
-        ref = refeicao.lower().strip()
-        if 'manhã' in ref or 'manha' in ref:
-            return 'Lanche da Manhã'
-        elif 'almoço' in ref or 'almoco' in ref:
-            return 'Almoço'
-        elif 'tarde' in ref:
-            return 'Lanche da Tarde'
-        elif 'jantar' in ref:
-            return 'Jantar'
-        elif 'ceia' in ref:
-            return 'Ceia'
-        return refeicao
-    
-    def get_ordem_segura(refeicao):
-        ref = refeicao.lower()
-        if 'manhã' in ref or 'manha' in ref:
-            return 1
-        elif 'almoço' in ref or 'almoco' in ref:
-            return 2
-        elif 'tarde' in ref:
-            return 3
-        elif 'jantar' in ref:
-            return 4
-        elif 'ceia' in ref:
-            return 5
-        return 999
-    
-    faltas = Historico.query.filter_by(
-        aluno_id=aluno.id,
-        tipo='falta',
-        status='pendente'
-    ).all()
+    São sempre as mesmas 6 consultas, não importa o tamanho do histórico;
+    as páginas seguintes vêm de /historico e /pagamentos.
+    """
+    aluno = db.session.execute(db.select(*COLUNAS_ALUNO).where(Aluno.id == id)).first()
+    if aluno is None:
+        abort(404)
     
-    faltas_com_info = []
-    for falta in faltas:
-        ordem = get_ordem_segura(falta.refeicao)
-        ref_normalizada = normalizar_refeicao(falta.refeicao)
-        
-        faltas_com_info.append({
-            'data_obj': falta.data,
-            'data_str': falta.data.strftime('%d/%m/%Y'),
-            'refeicao_original': falta.refeicao,
-            'refeicao': ref_normalizada,
-            'ordem': ordem,
-            'valor': falta.valor
-        })
-    
-    faltas_com_info.sort(key=lambda x: (x['data_obj'], x['ordem']), reverse=True)
-    
-    ultima_falta = None
-    if faltas_com_info:
-        ultima_falta = {
-            'data': faltas_com_info[0]['data_str'],
-            'refeicao': faltas_com_info[0]['refeicao'],
-            'valor': faltas_com_info[0]['valor']
-        }
+    faltas = db.session.execute(
+        db.select(*COLUNAS_HISTORICO).where(
+            Historico.aluno_id == aluno.id,
+            Historico.tipo == 'falta',
+            Historico.status == 'pendente'
+        ).order_by(Historico.data.desc(), Historico.ordem_refeicao.desc())
+    ).all()
     
     faltas_pendentes = []
-    for f in faltas_com_info:
+    for falta in faltas:
         faltas_pendentes.append({
-            'data': f['data_str'],
-            'refeicao': f['refeicao'],
-            'valor': f['valor']
+            'data': falta.data_br,
+            'refeicao': nome_refeicao(falta.refeicao_id),
+            'valor': falta.valor
         })
     
-    historico = []
-    for h in aluno.historico:
-        historico.append({
-            'data': h.data.strftime('%d/%m/%Y'),
-            'refeicao': h.refeicao,
-            'tipo': h.tipo,
-            'status': h.status,
-            'valor': h.valor
-        })
+    ultima_falta = faltas_pendentes[0] if faltas_pendentes else None
     
-    max_faltas = int(get_config('max_faltas') or 3)
+    historico = pagina_historico(aluno.id, 1)
+    pagamentos = pagina_pagamentos(aluno.id, 1)
+    max_faltas = get_max_faltas()
     
     return jsonify({
         'id': aluno.id,
@@ -273,17 +1508,77 @@ def api_aluno(id):
         'ultima_falta': ultima_falta,
         'faltas_pendentes': faltas_pendentes,
         'bloqueado': aluno.bloqueado,
+        # Só no bloqueio temporário em vigor (no bloqueio até o pagamento fica vazio)
+        'bloqueado_ate': (
+            aluno.bloqueado_ate_br if aluno.bloqueado and aluno.bloqueado_ate
+            and aluno.bloqueado_ate >= date.today() else None
+        ),
+        'faltas_consecutivas': aluno.faltas_consecutivas,
         'max_faltas': max_faltas,
         'faltas_restantes': max(0, max_faltas - len(faltas_pendentes)),
-        'historico': historico,
-        'pagamentos': [{
-            'data': p.data.strftime('%d/%m/%Y'),
-            'valor': p.valor,
-            'motivo': p.motivo,
-            'faltas_quitadas': p.faltas_quitadas
-        } for p in aluno.pagamentos]
+        'historico': historico['itens'],
+        'historico_total': historico['total'],
+        'historico_tem_mais': historico['tem_mais'],
+        'pagamentos': pagamentos['itens'],
+        'pagamentos_total': pagamentos['total'],
+        'pagamentos_tem_mais': pagamentos['tem_mais']
     })
 
+@app.route('/api/alunos/<int:id>/historico', methods=['GET'])
+def api_aluno_historico(id):
+    try:
+        pagina = pagina_parametro(request.args.get('pagina'))
+    except ParametroInvalido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(pagina_historico(id, pagina))
+
+@app.route('/api/alunos/<int:id>/pagamentos', methods=['GET'])
+def api_aluno_pagamentos(id):
+    try:
+        pagina = pagina_parametro(request.args.get('pagina'))
+    except ParametroInvalido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(pagina_pagamentos(id, pagina))
+
+# ==================== QUITAÇÃO ====================
+def quitar_faltas(aluno_ids):
+    """Quita as faltas pendentes dos alunos e zera débito, contadores e bloqueio
+    
+    Um UPDATE ... RETURNING por lote de alunos marca as faltas como pagas e
+    devolve o que o resumo diário precisa; não carrega nada na sessão. Roda na
+    transação de quem chama. Devolve {aluno_id: faltas quitadas}.
+    """
+    quitadas = {}
+    resumo = {}
+    for lote in em_lotes(aluno_ids, LOTE_CONSULTA):
+        pagas = db.session.execute(
+            db.update(Historico).where(
+                Historico.aluno_id.in_(lote),
+                Historico.tipo == 'falta',
+                Historico.status == 'pendente'
+            ).values(status='paga').returning(
+                Historico.aluno_id, Historico.data, Historico.refeicao_id, Historico.valor
+            ).execution_options(synchronize_session=False)
+        )
+        for falta in pagas:
+            quitadas[falta.aluno_id] = quitadas.get(falta.aluno_id, 0) + 1
+            delta = resumo.setdefault((falta.data, nome_refeicao(falta.refeicao_id), 'falta'), [0, 0.0, 0, 0.0])
+            delta[2] += 1
+            delta[3] += falta.valor or 0
+        
+        db.session.execute(db.update(Aluno).where(Aluno.id.in_(lote)).values(
+            bloqueado=False,
+            debito=0,
+            ultima_falta_data=None,
+            ultima_falta_refeicao=None,
+            ultima_falta_valor=0,
+            total_faltas=0,
+            faltas_consecutivas=0,
+            bloqueado_ate=None
+        ))
+    atualizar_resumo(resumo)
+    return quitadas
+
 @app.route('/api/alunos/<int:id>/pagamento', methods=['POST'])
 def api_pagamento(id):
     aluno = Aluno.query.get_or_404(id)
@@ -303,13 +1598,7 @@ def api_pagamento(id):
             'message': f'O valor a pagar é R$ {aluno.debito:.2f}'
         }), 400
     
-    faltas_pendentes = Historico.query.filter_by(
-        aluno_id=aluno.id,
-        tipo='falta',
-        status='pendente'
-    ).all()
-    
-    total_faltas = len(faltas_pendentes)
+    total_faltas = quitar_faltas([aluno.id]).get(aluno.id, 0)
     
     pagamento = Pagamento(
         aluno_id=aluno.id,
@@ -320,16 +1609,6 @@ def api_pagamento(id):
     )
     db.session.add(pagamento)
     
-    for falta in faltas_pendentes:
-        falta.status = 'paga'
-    
-    aluno.bloqueado = False
-    aluno.debito = 0
-    aluno.ultima_falta_data = None
-    aluno.ultima_falta_refeicao = None
-    aluno.ultima_falta_valor = 0
-    aluno.total_faltas = 0
-    
     log_auditoria(
         f'Aluno {aluno.nome} pagou R$ {valor:.2f} e quitou {total_faltas} faltas',
         'pagamento',
@@ -337,6 +1616,7 @@ def api_pagamento(id):
     )
     
     db.session.commit()
+    invalidar_caches()
     
     return jsonify({
         'success': True,
@@ -346,6 +1626,254 @@ def api_pagamento(id):
         'bloqueado': False
     })
 
+# ==================== API - PAGAMENTOS EM LOTE ====================
+def conciliar_pagamentos(lote):
+    """Confere o arquivo do banco com os débitos, em conjunto
+    
+    Devolve (a_quitar, divergencias): as matrículas cujo valor bate com o
+    débito (id, nome, valor) e as que não batem, com o motivo.
+    """
+    alunos = []
+    for matriculas in em_lotes(lote['matricula'], LOTE_CONSULTA):
+        alunos.extend(db.session.execute(
+            db.select(Aluno.id, Aluno.matricula, Aluno.nome, Aluno.debito).where(Aluno.matricula.in_(matriculas))
+        ).all())
+    alunos = pd.DataFrame(alunos, columns=['id', 'matricula', 'nome', 'debito'])
+    conferido = lote.merge(alunos, on='matricula', how='left')
+    
+    motivo = pd.Series(None, index=conferido.index, dtype=object)
+    motivo = motivo.mask((conferido['valor'] - conferido['debito']).abs() > 0.01, 'Valor diferente do débito')
+    motivo = motivo.mask(conferido['debito'].fillna(0) <= 0, 'Aluno não possui débito')
+    motivo = motivo.mask(conferido['id'].isna(), 'Matrícula não encontrada')
+    
+    divergentes = conferido[motivo.notna()]
+    divergencias = [{
+        'linha': int(d.linha),
+        'matricula': d.matricula,
+        'valor': float(d.valor),
+        'debito': None if pd.isna(d.debito) else float(d.debito),
+        'linhas': int(d.linhas),
+        'motivo': m
+    } for d, m in zip(divergentes.itertuples(), motivo[motivo.notna()])]
+    
+    a_quitar = conferido[motivo.isna()].astype({'id': int})
+    return a_quitar[['id', 'matricula', 'nome', 'valor']], divergencias
+
+@app.route('/api/pagamentos/lote', methods=['POST'])
+def api_pagamentos_lote():
+    """Quita os débitos de uma planilha do banco com as colunas matricula e valor
+    
+    Cada matrícula só é quitada se o valor (somado, se repetida) bate com o
+    débito; o resto volta como divergência. Tudo numa transação; com
+    simular=1 nada é gravado.
+    """
+    if 'file' not in request.files:
+        return jsonify({'success': False, 'message': 'Nenhum arquivo!'}), 400
+    file = request.files['file']
+    filename = secure_filename(file.filename or '')
+    if os.path.splitext(filename)[1].lower() not in EXTENSOES_PLANILHA:
+        return jsonify({'success': False, 'message': MENSAGEM_FORMATO_INVALIDO}), 400
+    motivo = request.form.get('motivo') or 'Pagamento em lote'
+    simular = request.form.get('simular') in ('1', 'true', 'sim')
+    
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'{uuid.uuid4().hex}_{filename}')
+    file.save(filepath)
+    try:
+        lote, rejeitadas = preparar_pagamentos(ler_planilha_pagamentos(filepath))
+    except PlanilhaInvalida as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        os.remove(filepath)
+    
+    a_quitar, divergencias = conciliar_pagamentos(lote)
+    divergencias = sorted(rejeitadas + divergencias, key=lambda d: d['linha'])
+    
+    quitadas = quitar_faltas(a_quitar['id'].tolist())
+    hoje = date.today()
+    pagamentos = [{
+        'aluno_id': p.id,
+        'data': hoje,
+        'valor': p.valor,
+        'motivo': motivo,
+        'faltas_quitadas': quitadas.get(p.id, 0)
+    } for p in a_quitar.itertuples()]
+    if pagamentos:
+        db.session.execute(db.insert(Pagamento), pagamentos)
+    
+    total_valor = round(float(a_quitar['valor'].sum()), 2)
+    total_faltas = sum(quitadas.values())
+    log_auditoria_lote([
+        (f'Aluno {p.nome} pagou R$ {p.valor:.2f} e quitou {quitadas.get(p.id, 0)} faltas', 'pagamento', motivo)
+        for p in a_quitar.itertuples()
+    ] + [(
+        f'Pagamentos em lote ({filename}): {len(pagamentos)} aluno(s), R$ {total_valor:.2f}, '
+        f'{len(divergencias)} divergência(s)',
+        'alerta' if divergencias else 'sucesso',
+        None
+    )])
+    
+    if simular:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        invalidar_caches()
+    
+    return jsonify({
+        'success': True,
+        'simulacao': simular,
+        'message': f'{len(pagamentos)} aluno(s) quitado(s), {total_faltas} falta(s), R$ {total_valor:.2f}. '
+                   f'{len(divergencias)} divergência(s).',
+        'alunos_quitados': len(pagamentos),
+        'faltas_quitadas': total_faltas,
+        'valor_total': total_valor,
+        'total_divergencias': len(divergencias),
+        'divergencias': divergencias[:MAX_REJEITADAS_RELATORIO]
+    })
+
+# ==================== CHECK-IN (CATRACA/QUIOSQUE) ====================
+# A porta do refeitório consulta um índice em memória (matrícula -> id, nome
+# e bloqueio) e guarda a presença num buffer; uma thread grava o buffer no
+# histórico em lote, pelo mesmo caminho da importação (chave única
+# aluno_id, data, refeicao_id). Cada alteração (pagamento, importação,
+# configuração, deste ou de outro worker) marca o índice para recarga.
+# Uma queda do processo perde no máximo INTERVALO_CHECKIN segundos de
+# presenças ainda no buffer.
+INTERVALO_CHECKIN = 1.0
+# Recarga do índice mesmo sem evento (ex.: comando rodado sem a pasta de eventos)
+IDADE_MAXIMA_INDICE = 300
+
+indice_checkin = IndiceAlunos()
+buffer_checkin = BufferPresencas()
+_checkin = {'thread': None, 'lock': threading.Lock(), 'gravando': threading.Lock()}
+
+def ao_alterar_checkin(dados):
+    if not dados or dados.get('origem') != 'checkin':
+        indice_checkin.marcar()
+
+barramento.ao_receber('alteracao', ao_alterar_checkin)
+
+def ler_alunos_checkin():
+    return db.session.execute(
+        db.select(Aluno.matricula, Aluno.id, Aluno.nome, Aluno.bloqueado, Aluno.bloqueado_ate)
+    ).all()
+
+def gravar_presencas(linhas):
+    """Grava um lote de presenças como a importação grava as da planilha
+    
+    O que já estava no histórico (outro worker, planilha) é descartado pelo
+    índice único; o resumo diário e os alunos só contam o que entrou.
+    """
+    inseridos = inserir_historico(linhas)
+    resumo = {}
+    tocados = set()
+    for linha in linhas:
+        if (linha['aluno_id'], linha['data'], linha['refeicao_id']) not in inseridos:
+            continue
+        tocados.add(linha['aluno_id'])
+        delta = resumo.setdefault((linha['data'], nome_refeicao(linha['refeicao_id']), 'presenca'), [0, 0.0, 0, 0.0])
+        delta[0] += 1
+    atualizar_resumo(resumo)
+    # A presença interrompe as faltas seguidas
+    recalcular_alunos(tocados)
+    db.session.commit()
+    return len(inseridos)
+
+def gravar_buffer_checkin():
+    linhas = buffer_checkin.retirar()
+    if not linhas:
+        return 0
+    with _checkin['gravando'], app.app_context():
+        try:
+            inseridos = gravar_presencas(linhas)
+        except Exception:
+            db.session.rollback()
+            buffer_checkin.devolver(linhas)
+            raise
+    if inseridos:
+        invalidar_caches('checkin')
+    return inseridos
+
+def processar_checkins():
+    """Thread: grava o buffer a cada INTERVALO_CHECKIN (ou quando enche) e recarrega o índice"""
+    while True:
+        buffer_checkin.cheio.wait(INTERVALO_CHECKIN)
+        try:
+            if indice_checkin.precisa_recarregar(IDADE_MAXIMA_INDICE):
+                with app.app_context():
+                    indice_checkin.carregar(ler_alunos_checkin)
+            gravar_buffer_checkin()
+        except Exception as e:
+            print(f'Erro ao gravar presenças do check-in: {e}')
+            time.sleep(INTERVALO_CHECKIN)
+
+def iniciar_checkin():
+    """Na primeira chamada: carrega o índice e sobe a thread de gravação"""
+    if _checkin['thread'] is not None:
+        return
+    with _checkin['lock']:
+        if _checkin['thread'] is None:
+            indice_checkin.carregar(ler_alunos_checkin)
+            atexit.register(gravar_buffer_checkin)
+            _checkin['thread'] = threading.Thread(target=processar_checkins, name='checkin', daemon=True)
+            _checkin['thread'].start()
+
+def refeicao_checkin(valor):
+    """Id do catálogo ou nome/apelido da refeição -> refeicao_id (None se não existir)"""
+    catalogo = catalogo_refeicoes()
+    if isinstance(valor, int) or (isinstance(valor, str) and valor.strip().isdigit()):
+        return int(valor) if int(valor) in catalogo.itens else None
+    if isinstance(valor, str) and valor.strip():
+        return catalogo.identificar(valor)
+    return None
+
+@app.route('/api/checkin', methods=['POST'])
+def api_checkin():
+    """Libera (ou não) o aluno na porta e registra a presença
+    
+    Corpo: {"matricula", "refeicao"} (id ou nome da refeição). A resposta
+    sai do índice em memória; a presença entra no histórico no próximo lote.
+    """
+    data = request.get_json(silent=True) or {}
+    matricula = str(data.get('matricula') or '').strip()
+    refeicao_id = refeicao_checkin(data.get('refeicao'))
+    if not matricula or refeicao_id is None:
+        return jsonify({'success': False, 'message': 'Informe a matrícula e uma refeição válida!'}), 400
+    
+    iniciar_checkin()
+    aluno = indice_checkin.buscar(matricula)
+    if aluno is None:
+        return jsonify({'success': False, 'liberado': False, 'message': 'Matrícula não encontrada!'}), 404
+    
+    # Mesma regra da importação: sem bloqueado_ate, o bloqueio vale até o pagamento
+    hoje = date.today()
+    if bloqueio_vale(aluno.bloqueado, aluno.bloqueado_ate, hoje):
+        return jsonify({
+            'success': False,
+            'liberado': False,
+            'nome': aluno.nome,
+            'bloqueado_ate': aluno.bloqueado_ate.strftime('%d/%m/%Y') if aluno.bloqueado_ate else None,
+            'message': f'Aluno {aluno.nome} está BLOQUEADO! Procure a administração.'
+        }), 403
+    
+    novo = buffer_checkin.adicionar((aluno.id, hoje, refeicao_id), {
+        'aluno_id': aluno.id,
+        'data': hoje,
+        'refeicao_id': refeicao_id,
+        'ordem_refeicao': catalogo_refeicoes().ordem(refeicao_id),
+        'tipo': 'presenca',
+        'status': 'presente',
+        'valor': 0
+    })
+    
+    return jsonify({
+        'success': True,
+        'liberado': True,
+        'nome': aluno.nome,
+        'refeicao': nome_refeicao(refeicao_id),
+        'repetido': not novo,
+        'message': f'{aluno.nome}: presença registrada.' if novo else f'{aluno.nome}: presença já registrada.'
+    })
+
 # ==================== API - IMPORTAÇÃO ====================
 @app.route('/api/importar/agendamentos', methods=['POST'])
 def api_importar_agendamentos():
@@ -357,156 +1885,36 @@ def api_importar_agendamentos():
         return jsonify({'success': False, 'message': 'Selecione um arquivo!'}), 400
     
     filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if os.path.splitext(filename)[1].lower() not in EXTENSOES_PLANILHA:
+        return jsonify({'success': False, 'message': MENSAGEM_FORMATO_INVALIDO}), 400
+    
+    job_id = uuid.uuid4().hex
+    # Nome único: o arquivo fica em disco até o worker terminar (inclusive após reinício)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'{job_id}_{filename}')
     file.save(filepath)
     
-    try:
-        df = pd.read_excel(filepath)
-        
-        colunas = ['Dia', 'Identificação', 'Usuário', 'Curso/Departamento', 'Refeição', 'Comparecimento']
-        for col in colunas:
-            if col not in df.columns:
-                return jsonify({'success': False, 'message': f'Coluna "{col}" não encontrada!'}), 400
-        
-        def normalizar_refeicao(refeicao):
-            ref = refeicao.lower().strip()
-            if 'manhã' in ref or 'manha' in ref:
-                return 'Lanche da Manhã'
-            elif 'almoço' in ref or 'almoco' in ref:
-                return 'Almoço'
-            elif 'tarde' in ref:
-                return 'Lanche da Tarde'
-            elif 'jantar' in ref:
-                return 'Jantar'
-            elif 'ceia' in ref:
-                return 'Ceia'
-            return refeicao
-        
-        def get_ordem_segura(refeicao):
-            ref = refeicao.lower()
-            if 'manhã' in ref or 'manha' in ref:
-                return 1
-            elif 'almoço' in ref or 'almoco' in ref:
-                return 2
-            elif 'tarde' in ref:
-                return 3
-            elif 'jantar' in ref:
-                return 4
-            elif 'ceia' in ref:
-                return 5
-            return 999
-        
-        registros = []
-        for _, row in df.iterrows():
-            try:
-                matricula = str(row['Identificação']).strip()
-                nome = str(row['Usuário']).strip()
-                curso = str(row['Curso/Departamento']).strip()
-                refeicao_original = str(row['Refeição']).strip()
-                comparecimento = str(row['Comparecimento']).strip()
-                
-                refeicao_normalizada = normalizar_refeicao(refeicao_original)
-                ordem = get_ordem_segura(refeicao_original)
-                
-                data_str = str(row['Dia']).strip()
-                if '/' in data_str:
-                    data_registro = datetime.strptime(data_str, '%d/%m/%Y').date()
-                else:
-                    data_registro = date.today()
-                
-                registros.append({
-                    'matricula': matricula,
-                    'nome': nome,
-                    'curso': curso,
-                    'refeicao_original': refeicao_original,
-                    'refeicao': refeicao_normalizada,
-                    'comparecimento': comparecimento,
-                    'data': data_registro,
-                    'ordem': ordem
-                })
-            except Exception as e:
-                print(f"Erro na linha: {e}")
-                continue
-        
-        registros.sort(key=lambda x: (x['data'], x['ordem']))
-        
-        novos = 0
-        faltas = 0
-        bloqueados = []
-        
-        for reg in registros:
-            aluno = Aluno.query.filter_by(matricula=reg['matricula']).first()
-            
-            if not aluno:
-                aluno = Aluno(
-                    matricula=reg['matricula'],
-                    nome=reg['nome'],
-                    curso=reg['curso']
-                )
-                db.session.add(aluno)
-                db.session.flush()
-                novos += 1
-            
-            if aluno.bloqueado:
-                continue
-            
-            existe = Historico.query.filter_by(
-                aluno_id=aluno.id,
-                data=reg['data'],
-                refeicao=reg['refeicao_original']
-            ).first()
-            
-            if existe:
-                continue
-            
-            if reg['comparecimento'].lower() == 'sim':
-                historico = Historico(
-                    aluno_id=aluno.id,
-                    data=reg['data'],
-                    refeicao=reg['refeicao_original'],
-                    tipo='presenca',
-                    status='presente',
-                    valor=0
-                )
-                db.session.add(historico)
-            else:
-                valor = get_valor_refeicao(reg['refeicao_original'])
-                
-                historico = Historico(
-                    aluno_id=aluno.id,
-                    data=reg['data'],
-                    refeicao=reg['refeicao_original'],
-                    tipo='falta',
-                    status='pendente',
-                    valor=valor
-                )
-                db.session.add(historico)
-                
-                aluno.total_faltas += 1
-                aluno.ultima_falta_data = reg['data']
-                aluno.ultima_falta_refeicao = reg['refeicao']
-                aluno.ultima_falta_valor = valor
-                aluno.debito = valor
-                
-                faltas += 1
-                
-                if verificar_bloqueio(aluno):
-                    bloqueados.append(aluno.nome)
-        
-        db.session.commit()
-        
-        msg = f'Importação OK! {novos} novos alunos, {faltas} faltas.'
-        if bloqueados:
-            msg += f' {len(bloqueados)} bloqueados.'
-        
-        return jsonify({'success': True, 'message': msg})
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'message': f'Erro: {str(e)}'}), 500
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
+    job = ImportacaoJob(id=job_id, arquivo=filename, caminho=filepath, status='pendente')
+    db.session.add(job)
+    db.session.commit()
+    
+    enfileirar_importacao(job_id)
+    
+    return jsonify({
+        'success': True,
+        'message': 'Importação iniciada! Acompanhe o progresso.',
+        'job_id': job_id,
+        'url': f'/api/importar/jobs/{job_id}'
+    }), 202
+
+@app.route('/api/importar/jobs/<job_id>', methods=['GET'])
+def api_importar_job(job_id):
+    job = ImportacaoJob.query.get_or_404(job_id)
+    return jsonify(job_para_dict(job))
+
+@app.errorhandler(413)
+def arquivo_muito_grande(e):
+    limite = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'success': False, 'message': f'Arquivo maior que o limite de {limite} MB!'}), 413
 
 # ==================== API - RELATÓRIOS ====================
 @app.route('/api/relatorios/diario', methods=['GET'])
@@ -521,26 +1929,28 @@ def api_relatorio_diario():
         else:
             data_atual = date.today()
         
-        registros = Historico.query.filter_by(data=data_atual).all()
+        resumo = ResumoDiario.query.filter_by(data=data_atual).all()
         
-        presentes = sum(1 for r in registros if r.tipo == 'presenca')
-        faltas = sum(1 for r in registros if r.tipo == 'falta')
+        presentes = 0
+        faltas = 0
         
         # Estatísticas por refeição
         refeicoes = {}
         valor_total_faltas = 0
         
-        for r in registros:
+        for r in resumo:
             if r.tipo == 'falta':
-                valor_total_faltas += r.valor
+                faltas += r.quantidade
+                valor_total_faltas += r.valor_total
                 if r.refeicao not in refeicoes:
                     refeicoes[r.refeicao] = {'presentes': 0, 'faltas': 0, 'valor': 0}
-                refeicoes[r.refeicao]['faltas'] += 1
-                refeicoes[r.refeicao]['valor'] += r.valor
+                refeicoes[r.refeicao]['faltas'] += r.quantidade
+                refeicoes[r.refeicao]['valor'] += r.valor_total
             elif r.tipo == 'presenca':
+                presentes += r.quantidade
                 if r.refeicao not in refeicoes:
                     refeicoes[r.refeicao] = {'presentes': 0, 'faltas': 0, 'valor': 0}
-                refeicoes[r.refeicao]['presentes'] += 1
+                refeicoes[r.refeicao]['presentes'] += r.quantidade
         
         total_alunos = Aluno.query.count()
         bloqueados = Aluno.query.filter_by(bloqueado=True).count()
@@ -581,7 +1991,9 @@ def api_relatorio_geral():
         bloqueados = Aluno.query.filter_by(bloqueado=True).count()
         
         # Top 10 com mais faltas
-        top_faltas_query = Aluno.query.order_by(Aluno.total_faltas.desc()).limit(10).all()
+        top_faltas_query = db.session.execute(
+            db.select(*COLUNAS_ALUNO).order_by(Aluno.total_faltas.desc()).limit(10)
+        ).all()
         top_faltas = []
         for a in top_faltas_query:
             top_faltas.append({
@@ -594,10 +2006,10 @@ def api_relatorio_geral():
         
         # Totais por tipo de refeição
         refeicoes_stats = db.session.query(
-            Historico.refeicao,
-            db.func.count(Historico.id).label('total'),
-            db.func.sum(Historico.valor).label('total_valor')
-        ).filter(Historico.tipo == 'falta').group_by(Historico.refeicao).all()
+            ResumoDiario.refeicao,
+            db.func.sum(ResumoDiario.quantidade).label('total'),
+            db.func.sum(ResumoDiario.valor_total).label('total_valor')
+        ).filter(ResumoDiario.tipo == 'falta').group_by(ResumoDiario.refeicao).all()
         
         refeicoes = {}
         for r in refeicoes_stats:
@@ -606,14 +2018,10 @@ def api_relatorio_geral():
                 'valor_total': r.total_valor or 0
             }
         
-        max_faltas = int(get_config('max_faltas') or 3)
+        max_faltas = get_max_faltas()
         
-        # Alunos em risco (próximos do bloqueio)
-        em_risco = Aluno.query.filter(
-            Aluno.total_faltas >= (max_faltas - 1),
-            Aluno.total_faltas < max_faltas,
-            Aluno.bloqueado == False
-        ).count()
+        # Alunos em risco (a uma falta de alguma regra), como no dashboard
+        em_risco = len(alunos_em_risco())
         
         return jsonify({
             'total_alunos': total_alunos,
@@ -644,22 +2052,24 @@ def api_relatorio_geral():
             'refeicoes': {}
         })
 
+def bloqueado_para_dict(a):
+    return {
+        'id': a.id,
+        'nome': a.nome,
+        'matricula': a.matricula,
+        'curso': a.curso,
+        'total_faltas': a.total_faltas,
+        'debito': a.debito,
+        'ultima_falta': a.ultima_falta_br
+    }
+
 @app.route('/api/relatorios/bloqueados', methods=['GET'])
 def api_relatorio_bloqueados():
     try:
-        bloqueados = Aluno.query.filter_by(bloqueado=True).all()
-        result = []
-        for a in bloqueados:
-            result.append({
-                'id': a.id,
-                'nome': a.nome,
-                'matricula': a.matricula,
-                'curso': a.curso,
-                'total_faltas': a.total_faltas,
-                'debito': a.debito,
-                'ultima_falta': a.ultima_falta_data.strftime('%d/%m/%Y') if a.ultima_falta_data else None
-            })
-        return jsonify(result)
+        query = db.select(*COLUNAS_ALUNO).where(Aluno.bloqueado == True).order_by(Aluno.id)
+        if quer_ndjson(request.args):
+            return resposta_ndjson(map(bloqueado_para_dict, linhas_em_lotes(query)))
+        return jsonify([bloqueado_para_dict(a) for a in db.session.execute(query)])
     except Exception as e:
         print(f"Erro ao carregar bloqueados: {e}")
         return jsonify([])
@@ -676,10 +2086,10 @@ def api_relatorio_valores():
         
         # Estatísticas de uso
         stats = db.session.query(
-            Historico.refeicao,
-            db.func.count(Historico.id).label('total_faltas'),
-            db.func.sum(Historico.valor).label('total_arrecadado')
-        ).filter(Historico.tipo == 'falta').group_by(Historico.refeicao).all()
+            ResumoDiario.refeicao,
+            db.func.sum(ResumoDiario.quantidade).label('total_faltas'),
+            db.func.sum(ResumoDiario.valor_total).label('total_arrecadado')
+        ).filter(ResumoDiario.tipo == 'falta').group_by(ResumoDiario.refeicao).all()
         
         uso = {}
         for s in stats:
@@ -699,35 +2109,75 @@ def api_relatorio_valores():
 @app.route('/api/relatorios/risco', methods=['GET'])
 def api_relatorio_risco():
     try:
-        max_faltas = int(get_config('max_faltas') or 3)
-        limite_alerta = max_faltas - 1
-        
-        alunos_risco = Aluno.query.filter(
-            Aluno.total_faltas >= limite_alerta,
-            Aluno.total_faltas < max_faltas,
-            Aluno.bloqueado == False
-        ).all()
-        
-        result = []
-        for aluno in alunos_risco:
-            result.append({
+        def risco_para_dict(item):
+            aluno, restantes = item
+            return {
                 'id': aluno.id,
                 'nome': aluno.nome,
                 'matricula': aluno.matricula,
                 'total_faltas': aluno.total_faltas,
-                'faltas_restantes': max_faltas - aluno.total_faltas,
+                'faltas_restantes': restantes,
                 'debito': aluno.debito
-            })
+            }
         
-        return jsonify(result)
+        em_risco = alunos_em_risco()
+        if quer_ndjson(request.args):
+            return resposta_ndjson(map(risco_para_dict, em_risco))
+        return jsonify([risco_para_dict(item) for item in em_risco])
     except Exception as e:
         print(f"Erro no relatório de risco: {e}")
         return jsonify([])
 
+# Só muda com importações e pagamentos, que limpam o cache
+cache_periodo = CacheRespostas(ttl=300)
+PERIODO_PADRAO_DIAS = 30
+
+def calcular_relatorio_periodo(inicio, fim, granularidade):
+    conn = db.session.connection()
+    no_periodo = Historico.data.between(inicio, fim)
+    # Uma consulta colunar com só o necessário; cursos vêm da tabela de alunos
+    historico = pd.read_sql_query(db.select(
+        Historico.data, Historico.refeicao_id, Historico.aluno_id,
+        db.case((Historico.tipo == 'falta', 1), else_=0).label('falta'),
+        db.case((Historico.tipo == 'presenca', 1), else_=0).label('presenca'),
+        db.case((Historico.status == 'paga', 1), else_=0).label('paga'),
+        Historico.valor
+    ).where(no_periodo), conn)
+    cursos = pd.read_sql_query(
+        db.select(Aluno.id, Aluno.curso).where(Aluno.id.in_(db.select(Historico.aluno_id).where(no_periodo))),
+        conn, index_col='id'
+    )['curso']
+    return agregar_periodo(historico, cursos, nome_refeicao, inicio, fim, granularidade)
+
+@app.route('/api/relatorios/periodo', methods=['GET'])
+def api_relatorio_periodo():
+    """Séries por período, refeição e curso, com percentis
+    
+    Parâmetros: de/ate (AAAA-MM-DD; padrão, os últimos 30 dias) e
+    granularidade (dia, semana ou mes).
+    """
+    try:
+        fim = data_parametro(request.args.get('ate')) or date.today()
+        inicio = data_parametro(request.args.get('de')) or fim - timedelta(days=PERIODO_PADRAO_DIAS - 1)
+        if inicio > fim:
+            raise ParametroInvalido('A data inicial é depois da final!')
+        granularidade = request.args.get('granularidade') or 'dia'
+        if granularidade not in GRANULARIDADES:
+            raise ParametroInvalido(f'Granularidade inválida: {granularidade}')
+    except ParametroInvalido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    chave = (inicio, fim, granularidade)
+    dados = cache_periodo.get(chave)
+    if dados is None:
+        dados = calcular_relatorio_periodo(inicio, fim, granularidade)
+        cache_periodo.set(chave, dados)
+    return resposta_com_etag(dados)
+
 # ==================== API - CONFIGURAÇÕES ====================
 @app.route('/api/configuracoes', methods=['GET'])
 def api_configuracoes_get():
-    configs = Configuracao.query.all()
+    configs = Configuracao.query.filter(Configuracao.tipo != 'sistema').all()
     result = {}
     for c in configs:
         result[c.chave] = c.valor
@@ -736,49 +2186,59 @@ def api_configuracoes_get():
 @app.route('/api/configuracoes', methods=['POST'])
 def api_configuracoes_post():
     data = request.json
+    configs = {c.chave: c for c in Configuracao.query.filter(Configuracao.tipo != 'sistema')}
+    alteradas = set()
     for chave, valor in data.items():
-        config = Configuracao.query.filter_by(chave=chave).first()
-        if config:
+        config = configs.get(chave)
+        if config and config.valor != str(valor):
             config.valor = str(valor)
-    db.session.commit()
+            alteradas.add(chave)
+    invalidar_config()
     log_auditoria('Configurações atualizadas', 'sucesso')
+    if alteradas & set(CHAVES_POLITICA):
+        # Regras novas valem para todos já: bloqueia e desbloqueia em lote
+        auditar_bloqueios(recalcular_alunos(), 'Política de bloqueio alterada')
+    db.session.commit()
+    invalidar_caches()
     return jsonify({'success': True, 'message': 'Configurações salvas!'})
 
 # ==================== API - ESTATÍSTICAS (DASHBOARD) ====================
+# O dashboard consulta a cada 30s em cada aba aberta; os dados mudam pouco
+cache_estatisticas = CacheRespostas(ttl=10)
+
+def calcular_estatisticas():
+    alunos = db.session.query(
+        db.func.count(Aluno.id).label('total_alunos'),
+        db.func.sum(db.case((Aluno.bloqueado == True, 1), else_=0)).label('bloqueados'),
+        db.func.sum(Aluno.debito).label('total_debitos'),
+        db.func.sum(Aluno.total_faltas).label('total_faltas')
+    ).one()
+    
+    hoje = db.session.query(
+        db.func.sum(db.case((ResumoDiario.tipo == 'presenca', ResumoDiario.quantidade), else_=0)).label('refeicoes'),
+        db.func.sum(db.case((ResumoDiario.tipo == 'falta', ResumoDiario.quantidade), else_=0)).label('faltas'),
+        db.func.sum(db.case((ResumoDiario.tipo == 'falta', ResumoDiario.valor_total), else_=0)).label('valor_faltas')
+    ).filter(ResumoDiario.data == date.today()).one()
+    
+    return {
+        'total_alunos': alunos.total_alunos or 0,
+        'bloqueados': alunos.bloqueados or 0,
+        'total_debitos': alunos.total_debitos or 0,
+        'total_faltas': alunos.total_faltas or 0,
+        'em_risco': len(alunos_em_risco()),
+        'refeicoes_hoje': hoje.refeicoes or 0,
+        'faltas_hoje': hoje.faltas or 0,
+        'valor_faltas_hoje': hoje.valor_faltas or 0
+    }
+
 @app.route('/api/estatisticas', methods=['GET'])
 def api_estatisticas():
     try:
-        total_alunos = Aluno.query.count()
-        bloqueados = Aluno.query.filter_by(bloqueado=True).count()
-        total_debitos = db.session.query(db.func.sum(Aluno.debito)).scalar() or 0
-        total_faltas = db.session.query(db.func.sum(Aluno.total_faltas)).scalar() or 0
-        
-        max_faltas = int(get_config('max_faltas') or 3)
-        em_risco = Aluno.query.filter(
-            Aluno.total_faltas >= (max_faltas - 1),
-            Aluno.total_faltas < max_faltas,
-            Aluno.bloqueado == False
-        ).count()
-        
-        data_atual = date.today()
-        refeicoes_hoje = Historico.query.filter_by(data=data_atual, tipo='presenca').count()
-        faltas_hoje = Historico.query.filter_by(data=data_atual, tipo='falta').count()
-        
-        valor_faltas_hoje = db.session.query(db.func.sum(Historico.valor)).filter(
-            Historico.data == data_atual,
-            Historico.tipo == 'falta'
-        ).scalar() or 0
-        
-        return jsonify({
-            'total_alunos': total_alunos,
-            'bloqueados': bloqueados,
-            'total_debitos': total_debitos,
-            'total_faltas': total_faltas,
-            'em_risco': em_risco,
-            'refeicoes_hoje': refeicoes_hoje,
-            'faltas_hoje': faltas_hoje,
-            'valor_faltas_hoje': valor_faltas_hoje
-        })
+        dados = cache_estatisticas.get(date.today())
+        if dados is None:
+            dados = calcular_estatisticas()
+            cache_estatisticas.set(date.today(), dados)
+        return resposta_com_etag(dados)
     except Exception as e:
         print(f"Erro ao carregar estatísticas: {e}")
         return jsonify({
@@ -792,18 +2252,240 @@ def api_estatisticas():
             'valor_faltas_hoje': 0
         })
 
+# ==================== API - EVENTOS (SSE) ====================
+@app.route('/api/eventos', methods=['GET'])
+def api_eventos():
+    """Stream text/event-stream para os painéis
+    
+    Eventos: 'estatisticas' (a primeira vez completas, depois só os campos
+    que mudaram), 'auditoria' (lista de logs novos) e 'recarregar' (o
+    painel ficou para trás e deve buscar tudo de novo). Cada conexão ocupa
+    uma thread do servidor enquanto está aberta: em worker síncrono ou
+    acima de SSE_MAX_CONEXOES a resposta é 204, e o EventSource desiste e
+    o painel passa a consultar de tempos em tempos.
+    """
+    if not (request.environ.get('wsgi.multithread') or app.config['SSE_ASSINCRONO']):
+        return Response(status=204)
+    fila = barramento.assinar(limite=app.config['SSE_MAX_CONEXOES'])
+    if fila is None:
+        return Response(status=204)
+    iniciar_publicador_estatisticas()
+    try:
+        inicial = estatisticas_painel()
+    except Exception:
+        barramento.cancelar(fila)
+        raise
+    # A conexão com o banco não fica presa enquanto o stream estiver aberto
+    db.session.close()
+    
+    def gerar():
+        yield formatar_sse('estatisticas', inicial)
+        while True:
+            try:
+                tipo, dados = fila.get(timeout=INTERVALO_PING)
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+            if tipo in EVENTOS_PAINEL:
+                yield formatar_sse(tipo, dados)
+    
+    resposta = Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Também quando o cliente sai antes do primeiro evento (o gerador nem começou)
+    resposta.call_on_close(lambda: barramento.cancelar(fila))
+    return resposta
+
 # ==================== API - AUDITORIA ====================
+# Lote de linhas lidas por consulta na exportação (sem OFFSET, pelo cursor)
+LOTE_EXPORTACAO_AUDITORIA = 1000
+
+def filtros_auditoria(args):
+    condicoes = []
+    tipo = args.get('tipo') or 'todos'
+    if tipo != 'todos':
+        condicoes.append(Auditoria.tipo == tipo)
+    return condicoes + filtros_periodo(Auditoria.timestamp, args)
+
+def pagina_auditoria(condicoes, limite, valor=None, ultimo_id=None):
+    """Até `limite` logs, do mais recente para o mais antigo, depois do cursor"""
+    query = db.select(*COLUNAS_AUDITORIA).where(*condicoes)
+    if ultimo_id is not None:
+        query = query.where(filtro_keyset(Auditoria.timestamp, Auditoria.id, valor, ultimo_id, True))
+    return db.session.execute(
+        query.order_by(*ordenar_keyset(Auditoria.timestamp, Auditoria.id, True)).limit(limite)
+    ).all()
+
+def auditoria_para_dict(log):
+    return {
+        'id': log.id,
+        'timestamp': log.timestamp_br,
+        'usuario': log.usuario,
+        'acao': log.acao,
+        'tipo': log.tipo,
+        'detalhes': log.detalhes
+    }
+
 @app.route('/api/auditoria', methods=['GET'])
 def api_auditoria():
-    logs = Auditoria.query.order_by(Auditoria.timestamp.desc()).limit(100).all()
-    result = []
-    for l in logs:
-        result.append({
-            'timestamp': l.timestamp.strftime('%d/%m/%Y %H:%M:%S'),
-            'acao': l.acao,
-            'tipo': l.tipo
-        })
-    return jsonify(result)
+    """Logs paginados (keyset), mais recentes primeiro
+    
+    Parâmetros: tipo (ou 'todos'), de/ate (AAAA-MM-DD), limite e cursor
+    (o proximo_cursor da página anterior). Com formato=ndjson vêm todos os
+    logs do filtro, um por linha.
+    """
+    try:
+        condicoes = filtros_auditoria(request.args)
+        if quer_ndjson(request.args):
+            query = db.select(*COLUNAS_AUDITORIA).where(*condicoes).order_by(
+                *ordenar_keyset(Auditoria.timestamp, Auditoria.id, True)
+            )
+            return resposta_ndjson(map(auditoria_para_dict, linhas_em_lotes(query)))
+        limite = limite_pagina(request.args.get('limite'))
+        valor = ultimo_id = None
+        if request.args.get('cursor'):
+            valor, ultimo_id = decodificar_cursor(request.args['cursor'], datetime.fromisoformat)
+        logs = pagina_auditoria(condicoes, limite + 1, valor, ultimo_id)
+    except ParametroInvalido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    proximo_cursor = None
+    if len(logs) > limite:
+        logs = logs[:limite]
+        proximo_cursor = codificar_cursor(logs[-1].timestamp, logs[-1].id)
+    
+    return jsonify({
+        'logs': [auditoria_para_dict(l) for l in logs],
+        'proximo_cursor': proximo_cursor
+    })
+
+@app.route('/api/auditoria/exportar', methods=['GET'])
+def api_auditoria_exportar():
+    """Exporta os logs filtrados em texto, gerado aos poucos (mesmos filtros da listagem)"""
+    try:
+        condicoes = filtros_auditoria(request.args)
+        limite = int(request.args['limite']) if request.args.get('limite') else None
+    except (ParametroInvalido, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e) or 'Limite inválido!'}), 400
+    
+    def gerar():
+        yield 'SISTEMA DE AUDITORIA - REFEITÓRIO UNIVERSITÁRIO\n'
+        yield '=' * 80 + '\n\n'
+        restantes = limite
+        valor = ultimo_id = None
+        while restantes is None or restantes > 0:
+            tamanho = LOTE_EXPORTACAO_AUDITORIA if restantes is None else min(restantes, LOTE_EXPORTACAO_AUDITORIA)
+            logs = pagina_auditoria(condicoes, tamanho, valor, ultimo_id)
+            if not logs:
+                break
+            partes = []
+            for log in logs:
+                d = auditoria_para_dict(log)
+                partes.append(f'[{d["timestamp"]}] {d["usuario"]} - {d["acao"]}\n')
+                if d['detalhes']:
+                    partes.append(f'  Detalhes: {d["detalhes"]}\n')
+                partes.append('-' * 80 + '\n')
+            yield ''.join(partes)
+            valor, ultimo_id = logs[-1].timestamp, logs[-1].id
+            if restantes is not None:
+                restantes -= len(logs)
+    
+    nome = f'auditoria_{date.today().isoformat()}.txt'
+    return Response(
+        stream_with_context(gerar()),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename={nome}'}
+    )
+
+# ==================== API - EXPORTAÇÃO ====================
+# Cada exportação devolve (cabeçalho, select) com as colunas já na ordem e no
+# formato do arquivo; as linhas saem do banco em lotes direto para o CSV/.xlsx.
+CABECALHO_ALUNOS = ['Matrícula', 'Nome', 'Curso', 'Faltas', 'Débito', 'Última falta', 'Última refeição', 'Status']
+
+def colunas_exportacao_alunos():
+    return (
+        Aluno.matricula, Aluno.nome, Aluno.curso, Aluno.total_faltas, Aluno.debito,
+        data_br(Aluno.ultima_falta_data), Aluno.ultima_falta_refeicao,
+        db.case((Aluno.bloqueado == True, 'BLOQUEADO'), else_='Ativo')
+    )
+
+def exportacao_alunos(args, status=None):
+    """Mesmos filtros da listagem (busca, status, ultima_falta_de/ultima_falta_ate)"""
+    if status:
+        args = {**args.to_dict(), 'status': status}
+    condicoes = filtros_alunos(args)
+    query = db.select(*colunas_exportacao_alunos()).where(*condicoes).order_by(Aluno.nome, Aluno.id)
+    return CABECALHO_ALUNOS, query
+
+def exportacao_risco(args):
+    # filtros_alunos com status=risco preenche aluno_risco (faltas restantes)
+    condicoes = filtros_alunos({**args.to_dict(), 'status': 'risco'})
+    query = db.select(
+        *colunas_exportacao_alunos(), tabela_risco.c.restantes
+    ).join(tabela_risco, tabela_risco.c.id == Aluno.id).where(*condicoes).order_by(Aluno.nome, Aluno.id)
+    return CABECALHO_ALUNOS + ['Faltas restantes'], query
+
+def exportacao_faltas(args):
+    """Faltas do histórico: de/ate (data da refeição) e status (pendente, paga ou todos)"""
+    condicoes = [Historico.tipo == 'falta'] + filtros_periodo(Historico.data, args)
+    status = args.get('status') or 'todos'
+    if status in ('pendente', 'paga'):
+        condicoes.append(Historico.status == status)
+    elif status != 'todos':
+        raise ParametroInvalido(f'Status inválido: {status}')
+    query = db.select(
+        data_br(Historico.data), Refeicao.nome, Aluno.matricula, Aluno.nome, Aluno.curso,
+        Historico.valor, Historico.status
+    ).join(Aluno, Aluno.id == Historico.aluno_id).outerjoin(
+        Refeicao, Refeicao.id == Historico.refeicao_id
+    ).where(*condicoes).order_by(Historico.data, Historico.ordem_refeicao, Historico.id)
+    return ['Data', 'Refeição', 'Matrícula', 'Nome', 'Curso', 'Valor', 'Status'], query
+
+def exportacao_pagamentos(args):
+    query = db.select(
+        data_br(Pagamento.data), Aluno.matricula, Aluno.nome, Aluno.curso,
+        Pagamento.valor, Pagamento.faltas_quitadas, Pagamento.motivo
+    ).join(Aluno, Aluno.id == Pagamento.aluno_id).where(
+        *filtros_periodo(Pagamento.data, args)
+    ).order_by(Pagamento.data, Pagamento.id)
+    return ['Data', 'Matrícula', 'Nome', 'Curso', 'Valor', 'Faltas quitadas', 'Motivo'], query
+
+def exportacao_auditoria(args):
+    query = db.select(
+        data_hora_br(Auditoria.timestamp), Auditoria.usuario, Auditoria.acao, Auditoria.tipo, Auditoria.detalhes
+    ).where(*filtros_auditoria(args)).order_by(*ordenar_keyset(Auditoria.timestamp, Auditoria.id, True))
+    return ['Data/hora', 'Usuário', 'Ação', 'Tipo', 'Detalhes'], query
+
+EXPORTACOES = {
+    'alunos': exportacao_alunos,
+    'bloqueados': lambda args: exportacao_alunos(args, status='bloqueados'),
+    'risco': exportacao_risco,
+    'faltas': exportacao_faltas,
+    'pagamentos': exportacao_pagamentos,
+    'auditoria': exportacao_auditoria,
+}
+
+@app.route('/api/export/<recurso>', methods=['GET'])
+def api_exportar(recurso):
+    """Download em CSV (padrão) ou .xlsx (formato=xlsx), gerado aos poucos
+    
+    Recursos: alunos, bloqueados, risco, faltas, pagamentos e auditoria, com
+    os filtros da listagem correspondente (de/ate nas faltas, pagamentos e
+    auditoria).
+    """
+    if recurso not in EXPORTACOES:
+        return jsonify({'success': False, 'message': f'Exportação desconhecida: {recurso}'}), 404
+    formato = request.args.get('formato') or 'csv'
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({'success': False, 'message': f'Formato inválido: {formato}'}), 400
+    try:
+        cabecalho, query = EXPORTACOES[recurso](request.args)
+    except ParametroInvalido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    nome = f'{recurso}_{date.today().isoformat()}'
+    return resposta_planilha(formato, cabecalho, linhas_em_lotes(query), nome, recurso.capitalize())
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,172 @@
+from datetime import timedelta
+
+import numpy as np
+
+# Regras de bloqueio (configurações do tipo 'geral'); 0 desliga a regra.
+# - max_faltas: faltas pendentes no total; o bloqueio só sai com o pagamento
+# - max_faltas_janela: faltas pendentes nos últimos janela_dias dias; sai
+#   sozinho quando a falta mais antiga que conta deixa a janela
+# - max_faltas_consecutivas: faltas pendentes seguidas (presença ou falta
+#   paga interrompem); dura dias_bloqueio dias a partir da última falta, ou
+#   até o pagamento com dias_bloqueio = 0
+# bloqueado_ate é só o fim do bloqueio temporário em vigor (vazio no bloqueio
+# até o pagamento). Quando ele vence, a data passa para fim_ultimo_bloqueio:
+# as faltas até lá não contam de novo para a janela nem para as seguidas.
+CHAVES_POLITICA = ('max_faltas', 'max_faltas_janela', 'janela_dias', 'max_faltas_consecutivas', 'dias_bloqueio')
+
+SEM_DATA = np.datetime64('NaT', 'D')
+
+class PoliticaBloqueio:
+    def __init__(self, max_faltas=3, max_faltas_janela=0, janela_dias=30, max_faltas_consecutivas=0, dias_bloqueio=0):
+        self.max_faltas = max_faltas
+        self.max_faltas_janela = max_faltas_janela
+        self.janela_dias = max(janela_dias, 1)
+        self.max_faltas_consecutivas = max_faltas_consecutivas
+        self.dias_bloqueio = dias_bloqueio
+
+    @classmethod
+    def da_config(cls, config):
+        """A partir das configurações já convertidas (valores ausentes ficam no padrão)"""
+        return cls(**{c: int(config[c]) for c in CHAVES_POLITICA if config.get(c) not in (None, '')})
+
+def como_datas(valores):
+    """datetime.date/None -> datetime64[D]/NaT"""
+    return np.array(valores, dtype='datetime64[D]')
+
+def bloqueio_vale(bloqueado, bloqueado_ate, dia):
+    """O bloqueio gravado vale no dia? Sem bloqueado_ate, vale até o pagamento"""
+    return bool(bloqueado) and (bloqueado_ate is None or dia <= bloqueado_ate)
+
+def avaliar_bloqueios(politica, hoje, faltas, consecutivas, ultima_consecutiva, faltas_janela, limite_janela,
+                      ate_atual, fim_anterior):
+    """Decide o bloqueio de todos os alunos de uma vez
+
+    Recebe sequências alinhadas (um item por aluno): faltas pendentes, faltas
+    seguidas e a data da última delas, faltas na janela, data da
+    max_faltas_janela-ésima falta mais recente, e o bloqueado_ate e o
+    fim_ultimo_bloqueio gravados. Devolve arrays 'bloqueado', 'bloqueado_ate'
+    (fim do bloqueio temporário; NaT se não houver ou se o bloqueio for até o
+    pagamento), 'fim_ultimo_bloqueio' e um por regra ('por_total',
+    'por_janela', 'por_consecutivas').
+    """
+    hoje = np.datetime64(hoje, 'D')
+    faltas = np.asarray(faltas, dtype=np.int64)
+    consecutivas = np.asarray(consecutivas, dtype=np.int64)
+    faltas_janela = np.asarray(faltas_janela, dtype=np.int64)
+    ultima_consecutiva, limite_janela, ate_atual, fim_anterior = map(
+        como_datas, (ultima_consecutiva, limite_janela, ate_atual, fim_anterior)
+    )
+
+    por_total = faltas >= politica.max_faltas
+
+    if politica.max_faltas_janela > 0:
+        por_janela = faltas_janela >= politica.max_faltas_janela
+        ate_janela = np.where(por_janela, limite_janela + np.timedelta64(politica.janela_dias - 1, 'D'), SEM_DATA)
+    else:
+        por_janela = np.zeros(len(faltas), dtype=bool)
+        ate_janela = np.full(len(faltas), SEM_DATA)
+
+    if politica.max_faltas_consecutivas > 0:
+        por_consecutivas = consecutivas >= politica.max_faltas_consecutivas
+    else:
+        por_consecutivas = np.zeros(len(faltas), dtype=bool)
+    if politica.dias_bloqueio > 0:
+        ate_consecutivas = np.where(
+            por_consecutivas, ultima_consecutiva + np.timedelta64(politica.dias_bloqueio, 'D'), SEM_DATA
+        )
+        indefinido = por_total
+    else:
+        ate_consecutivas = np.full(len(faltas), SEM_DATA)
+        indefinido = por_total | por_consecutivas
+
+    # Comparações com NaT são sempre falsas: regra temporária vencida não bloqueia
+    temporario = np.fmax(ate_janela, ate_consecutivas)
+    bloqueado = indefinido | (temporario >= hoje)
+
+    # O bloqueio até o pagamento passa por cima do temporário: quem lê
+    # bloqueado_ate não pode achar que ele acaba numa data
+    vencido = temporario < hoje
+    bloqueado_ate = np.where(indefinido | vencido, SEM_DATA, temporario)
+    # O bloqueio temporário que venceu (o gravado ou o de agora) vira a marca
+    # de onde as faltas voltam a contar
+    fim_ultimo_bloqueio = np.fmax(
+        fim_anterior,
+        np.fmax(np.where(ate_atual < hoje, ate_atual, SEM_DATA), np.where(vencido, temporario, SEM_DATA))
+    )
+
+    return {
+        'bloqueado': bloqueado,
+        'bloqueado_ate': bloqueado_ate,
+        'fim_ultimo_bloqueio': fim_ultimo_bloqueio,
+        'por_total': por_total,
+        'por_janela': por_janela & (ate_janela >= hoje),
+        'por_consecutivas': por_consecutivas & ~(ate_consecutivas < hoje),
+    }
+
+def faltas_restantes(politica, faltas, consecutivas, faltas_janela):
+    """Quantas faltas faltam para a regra mais próxima de bloquear cada aluno"""
+    faltas = np.asarray(faltas, dtype=np.int64)
+    restantes = politica.max_faltas - faltas
+    if politica.max_faltas_janela > 0:
+        restantes = np.minimum(restantes, politica.max_faltas_janela - np.asarray(faltas_janela, dtype=np.int64))
+    if politica.max_faltas_consecutivas > 0:
+        restantes = np.minimum(restantes, politica.max_faltas_consecutivas - np.asarray(consecutivas, dtype=np.int64))
+    return np.maximum(restantes, 0)
+
+class EstadoNoLote:
+    """Regras de bloqueio de um aluno ao longo das linhas de uma importação
+
+    As linhas chegam na ordem (data, ordem). Cada falta passa por
+    avaliar_bloqueios com o dia dela no lugar de hoje; a linha que cai dentro
+    do bloqueio resultante (bloqueio_vale) não vale. Quando um bloqueio
+    temporário vence, as faltas até o fim dele deixam de contar para a janela
+    e para as seguidas, como no recálculo. `datas_faltas` são as faltas
+    pendentes mais recentes que já contam para a janela.
+    """
+
+    def __init__(self, politica, faltas=0, consecutivas=0, ultima_consecutiva=None, datas_faltas=(),
+                 bloqueado=False, bloqueado_ate=None, fim_ultimo_bloqueio=None):
+        self.politica = politica
+        self.faltas = faltas
+        self.consecutivas = consecutivas
+        self.ultima_consecutiva = ultima_consecutiva
+        self.datas_faltas = sorted(datas_faltas)
+        self.bloqueado = bloqueado
+        self.bloqueado_ate = bloqueado_ate
+        self.fim_ultimo_bloqueio = fim_ultimo_bloqueio
+
+    def aceitar(self, dia, falta):
+        """Registra a linha do dia; False se ela cai dentro de um bloqueio"""
+        if bloqueio_vale(self.bloqueado, self.bloqueado_ate, dia):
+            return False
+        if self.bloqueado_ate is not None and self.bloqueado_ate < dia:
+            self._vencer(self.bloqueado_ate)
+
+        if not falta:
+            self.consecutivas, self.ultima_consecutiva = 0, None
+            return True
+
+        self.faltas += 1
+        self.consecutivas += 1
+        self.ultima_consecutiva = dia
+        janela = self.politica.max_faltas_janela
+        if janela > 0:
+            self.datas_faltas = sorted(self.datas_faltas + [dia])[-janela:]
+        inicio = dia - timedelta(days=self.politica.janela_dias)
+        na_janela = [d for d in self.datas_faltas if inicio < d <= dia]
+
+        decisao = avaliar_bloqueios(
+            self.politica, dia, [self.faltas], [self.consecutivas], [self.ultima_consecutiva],
+            [len(na_janela)], [na_janela[0] if janela > 0 and len(na_janela) >= janela else None],
+            [None], [self.fim_ultimo_bloqueio]
+        )
+        self.bloqueado = bool(decisao['bloqueado'][0])
+        self.bloqueado_ate = decisao['bloqueado_ate'].astype(object)[0]
+        return True
+
+    def _vencer(self, fim):
+        self.fim_ultimo_bloqueio = max(fim, self.fim_ultimo_bloqueio or fim)
+        self.datas_faltas = [d for d in self.datas_faltas if d > fim]
+        if self.ultima_consecutiva is not None and self.ultima_consecutiva <= fim:
+            self.consecutivas, self.ultima_consecutiva = 0, None
+        self.bloqueado, self.bloqueado_ate = False, None
@@ -0,0 +1,77 @@
+import threading
+import time
+
+# Presenças guardadas que disparam a gravação antes do intervalo
+TAMANHO_LOTE_CHECKIN = 200
+
+class IndiceAlunos:
+    """matrícula -> aluno (id, nome, bloqueado, bloqueado_ate) para o check-in
+
+    O dicionário é trocado inteiro a cada recarga, então a consulta não
+    precisa de lock. `marcar` pede uma recarga (pagamento, importação,
+    mudança de regra); quem recarrega limpa a marca antes de ler o banco, e
+    uma alteração no meio da leitura pede outra.
+    """
+
+    def __init__(self):
+        self.alunos = None
+        self.carregado_em = 0
+        self.desatualizado = threading.Event()
+        self.lock = threading.Lock()
+
+    def marcar(self, dados=None):
+        self.desatualizado.set()
+
+    def carregar(self, ler_alunos):
+        """ler_alunos() devolve linhas com matricula, id, nome, bloqueado e bloqueado_ate"""
+        with self.lock:
+            self.desatualizado.clear()
+            self.alunos = {a.matricula: a for a in ler_alunos()}
+            self.carregado_em = time.monotonic()
+
+    def precisa_recarregar(self, idade_maxima):
+        return self.desatualizado.is_set() or time.monotonic() - self.carregado_em > idade_maxima
+
+    def buscar(self, matricula):
+        return self.alunos.get(matricula)
+
+class BufferPresencas:
+    """Presenças do check-in esperando a gravação em lote no histórico
+
+    A chave é a mesma da importação, (aluno_id, data, refeicao_id): o que já
+    passou por este processo no dia é respondido na hora como repetido; o
+    que veio de outro worker ou da planilha o índice único do banco descarta.
+    """
+
+    def __init__(self, tamanho_lote=TAMANHO_LOTE_CHECKIN):
+        self.tamanho_lote = tamanho_lote
+        self.linhas = []
+        self.vistos = set()
+        self.dia = None
+        self.cheio = threading.Event()
+        self.lock = threading.Lock()
+
+    def adicionar(self, chave, linha):
+        """Guarda a linha; False se a chave já passou por aqui hoje"""
+        with self.lock:
+            if self.dia != chave[1]:
+                self.dia = chave[1]
+                self.vistos = set()
+            if chave in self.vistos:
+                return False
+            self.vistos.add(chave)
+            self.linhas.append(linha)
+            if len(self.linhas) >= self.tamanho_lote:
+                self.cheio.set()
+            return True
+
+    def retirar(self):
+        with self.lock:
+            linhas, self.linhas = self.linhas, []
+            self.cheio.clear()
+            return linhas
+
+    def devolver(self, linhas):
+        """Gravação que falhou: as linhas voltam para a próxima tentativa"""
+        with self.lock:
+            self.linhas[:0] = linhas
@@ -1,66 +1,410 @@
 import sqlite3
 import os
 from datetime import datetime, timedelta
-import shutil
+import gzip
+import hashlib
+import json
+import time
+import weakref
 
-def fazer_backup():
-    """Faz backup do banco de dados"""
+from sqlalchemy import create_engine, event, select, text
+
+# ==================== CONEXÃO ====================
+# Mesmo arquivo que o Flask-SQLAlchemy usava com 'sqlite:///refeitorio.db'
+# (pasta instance ao lado do app), agora sem depender do diretório atual.
+# REFEITORIO_DATABASE_URL troca o banco (ex.: postgresql+psycopg://...).
+CAMINHO_BANCO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'refeitorio.db')
+URL_BANCO = os.environ.get('REFEITORIO_DATABASE_URL') or f'sqlite:///{CAMINHO_BANCO}'
+
+# WAL deixa as leituras do dashboard rodarem durante uma importação; com ele,
+# synchronous=NORMAL só perde (sem corromper) as últimas transações numa queda
+# de energia. busy_timeout cobre o commit de um lote inteiro da importação.
+PRAGMAS_SQLITE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('REFEITORIO_BUSY_TIMEOUT_MS', 30000)),
+    'cache_size': -int(os.environ.get('REFEITORIO_CACHE_KB', 65536)),  # negativo = KiB
+    'mmap_size': int(os.environ.get('REFEITORIO_MMAP_MB', 256)) * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Conexões por processo (cada worker do gunicorn tem o seu pool)
+POOL_TAMANHO = int(os.environ.get('REFEITORIO_POOL', 5))
+POOL_EXTRA = int(os.environ.get('REFEITORIO_POOL_EXTRA', 10))
+
+def eh_sqlite(url=URL_BANCO):
+    return url.startswith('sqlite')
+
+def aplicar_pragmas(conn):
+    cursor = conn.cursor()
+    try:
+        for pragma, valor in PRAGMAS_SQLITE.items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
+    finally:
+        cursor.close()
+
+def opcoes_engine(url=URL_BANCO):
+    """Argumentos do create_engine (também vão para SQLALCHEMY_ENGINE_OPTIONS)"""
+    opcoes = {'pool_size': POOL_TAMANHO, 'max_overflow': POOL_EXTRA}
+    if eh_sqlite(url):
+        # Arquivo local: conexão não cai, e o pool pode passar entre threads
+        opcoes['connect_args'] = {'check_same_thread': False}
+    else:
+        opcoes['pool_pre_ping'] = True
+        opcoes['pool_recycle'] = 1800
+    return opcoes
+
+# Worker criado por fork (gunicorn --preload) não reaproveita as conexões do
+# pai: um único hook descarta o pool das engines ainda vivas no processo
+_engines = weakref.WeakSet()
+
+def descartar_pools_herdados():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):  # não existe no Windows (lá não há fork)
+    os.register_at_fork(after_in_child=descartar_pools_herdados)
+
+def configurar_engine(engine):
+    """Pragmas em cada conexão nova do SQLite e pool novo nos processos filhos"""
+    if engine in _engines:
+        return engine
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', lambda conn, registro: aplicar_pragmas(conn))
+    _engines.add(engine)
+    return engine
+
+def criar_engine(url=URL_BANCO):
+    if eh_sqlite(url):
+        os.makedirs(os.path.dirname(CAMINHO_BANCO), exist_ok=True)
+    return configurar_engine(create_engine(url, **opcoes_engine(url)))
+
+def conectar_sqlite(caminho=CAMINHO_BANCO):
+    """Conexão sqlite3 crua (API de backup) com os mesmos pragmas da aplicação"""
+    conn = sqlite3.connect(caminho)
+    aplicar_pragmas(conn)
+    return conn
+
+# ==================== CÓPIA ENTRE BANCOS ====================
+def ajustar_sequencias(conn, tabelas):
+    """No PostgreSQL, ids gravados explicitamente não avançam a sequência do serial"""
+    if conn.dialect.name != 'postgresql':
+        return
+    for tabela in tabelas:
+        pk = list(tabela.primary_key.columns)
+        if len(pk) == 1 and pk[0].autoincrement is not False and pk[0].type.python_type is int:
+            conn.execute(text(f"""
+                SELECT setval(pg_get_serial_sequence('{tabela.name}', '{pk[0].name}'),
+                              COALESCE(MAX({pk[0].name}), 1), MAX({pk[0].name}) IS NOT NULL)
+                FROM {tabela.name}
+            """))
+
+def copiar_dados(engine_origem, engine_destino, tabelas, lote=5000):
+    """Copia as tabelas (em ordem de dependência) de um banco para outro
+    
+    Lê a origem em blocos de `lote` linhas e grava cada bloco num INSERT em
+    lote, tudo numa transação só no destino. O destino não pode ter alunos
+    nem histórico; o que as migrações semearam lá é substituído.
+    """
+    with engine_destino.begin() as destino:
+        for nome in ('aluno', 'historico'):
+            if destino.execute(text(f'SELECT COUNT(*) FROM {nome}')).scalar():
+                raise ValueError(f'O banco de destino já tem dados em "{nome}".')
+        for tabela in reversed(tabelas):
+            destino.execute(tabela.delete())
+        
+        copiados = {}
+        with engine_origem.connect() as origem:
+            for tabela in tabelas:
+                copiados[tabela.name] = 0
+                resultado = origem.execution_options(yield_per=lote).execute(select(tabela))
+                for bloco in resultado.mappings().partitions():
+                    destino.execute(tabela.insert(), [dict(linha) for linha in bloco])
+                    copiados[tabela.name] += len(bloco)
+        ajustar_sequencias(destino, tabelas)
+    return copiados
+
+# ==================== BACKUP ====================
+
+PASTA_BACKUPS = 'backups'
+PREFIXO_BACKUP = 'backup_refeitorio_'
+
+# Cópia pela API de backup do SQLite em passos de PAGINAS_POR_PASSO páginas,
+# com uma pausa entre eles: a cada passo o banco fica livre para os outros
+# leitores e escritores (se alguém escrever, o SQLite recomeça a cópia)
+PAGINAS_POR_PASSO = 1024
+PAUSA_ENTRE_PASSOS = 0.01
+
+# Bancos até esse tamanho são copiados para a memória e compactados direto de
+# lá; acima dele a cópia passa por um arquivo temporário no disco
+LIMITE_BACKUP_MEMORIA = int(os.environ.get('REFEITORIO_BACKUP_MEMORIA_MB', 256)) * 1024 * 1024
+BYTES_POR_BLOCO = 1024 * 1024
+
+def copiar_banco(conn_origem, conn_destino, paginas=PAGINAS_POR_PASSO, pausa=PAUSA_ENTRE_PASSOS):
+    """Cópia consistente de um banco SQLite, mesmo com a aplicação rodando"""
+    try:
+        conn_origem.backup(conn_destino, pages=paginas, sleep=pausa)
+    finally:
+        conn_destino.close()
+        conn_origem.close()
+
+def checar_integridade(conn, nome):
+    resultado = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    if resultado != 'ok':
+        raise ValueError(f'Banco corrompido ({nome}): {resultado}')
+
+def verificar_integridade(caminho):
+    """integrity_check de uma cópia avulsa, que também sai do WAL (vira um arquivo só)"""
+    conn = sqlite3.connect(caminho)
     try:
-        # Nome do arquivo de backup
+        conn.execute('PRAGMA journal_mode = DELETE')
+        checar_integridade(conn, caminho)
+    finally:
+        conn.close()
+
+def copia_em_memoria():
+    """Cópia do banco (API de backup) num banco em memória, conferida; devolve o conteúdo do arquivo"""
+    conn = sqlite3.connect(':memory:')
+    try:
+        origem = conectar_sqlite()
+        try:
+            origem.backup(conn, pages=PAGINAS_POR_PASSO, sleep=PAUSA_ENTRE_PASSOS)
+        finally:
+            origem.close()
+        checar_integridade(conn, 'cópia em memória')
+        conteudo = bytearray(conn.serialize())
+        # Bytes 18-19 do cabeçalho: a cópia herda o modo WAL do banco; como
+        # no temporário (journal_mode = DELETE), o arquivo sai sem ele
+        conteudo[18:20] = b'\x01\x01'
+        return conteudo
+    finally:
+        conn.close()
+
+def blocos_arquivo(caminho):
+    with open(caminho, 'rb') as f:
+        yield from iter(lambda: f.read(BYTES_POR_BLOCO), b'')
+
+def compactar(blocos, destino):
+    """Grava os blocos em gzip no destino e devolve o sha256 do conteúdo original"""
+    h = hashlib.sha256()
+    with gzip.open(destino, 'wb') as f_out:
+        for bloco in blocos:
+            h.update(bloco)
+            f_out.write(bloco)
+    return h.hexdigest()
+
+def caminho_checksum(arquivo):
+    return arquivo + '.sha256'
+
+def ler_checksum(arquivo):
+    try:
+        with open(caminho_checksum(arquivo), encoding='utf-8') as f:
+            return f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+def descompactar(arquivo, destino):
+    """Descompacta (se for .gz) para destino e devolve o sha256 do conteúdo"""
+    h = hashlib.sha256()
+    abrir = gzip.open if arquivo.endswith('.gz') else open
+    with abrir(arquivo, 'rb') as f_in, open(destino, 'wb') as f_out:
+        for bloco in iter(lambda: f_in.read(1024 * 1024), b''):
+            h.update(bloco)
+            f_out.write(bloco)
+    return h.hexdigest()
+
+def listar_backups(pasta=PASTA_BACKUPS):
+    """Backups da pasta, do mais antigo para o mais recente"""
+    if not os.path.isdir(pasta):
+        return []
+    return sorted(
+        os.path.join(pasta, nome) for nome in os.listdir(pasta)
+        if nome.startswith(PREFIXO_BACKUP) and nome.endswith('.db.gz')
+    )
+
+def fazer_backup(pasta=PASTA_BACKUPS, pular_se_igual=False):
+    """Faz backup do banco de dados
+    
+    A cópia sai da API de backup do SQLite (sem ler um arquivo pela metade
+    durante uma escrita) e é conferida com integrity_check. Até
+    LIMITE_BACKUP_MEMORIA ela fica na memória e é compactada direto no
+    destino; num banco maior ela passa por um arquivo temporário, que é lido
+    duas vezes (integrity_check e compactação). O sha256 do banco sai junto
+    com a compactação e fica em <arquivo>.sha256. Com pular_se_igual, não
+    grava nada se o banco não mudou desde o último backup da pasta (devolve o
+    último).
+    """
+    temporario = parcial = None
+    try:
+        os.makedirs(pasta, exist_ok=True)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = f'backup_refeitorio_{timestamp}.db'
+        backup_file = os.path.join(pasta, f'{PREFIXO_BACKUP}{timestamp}.db.gz')
+        temporario = backup_file + '.tmp'
+        parcial = backup_file + '.parcial'
         
-        # Copiar arquivo
-        shutil.copy2('instance/refeitorio.db', backup_file)
+        if os.path.getsize(CAMINHO_BANCO) <= LIMITE_BACKUP_MEMORIA:
+            conteudo = memoryview(copia_em_memoria())
+            blocos = (conteudo[i:i + BYTES_POR_BLOCO] for i in range(0, len(conteudo), BYTES_POR_BLOCO))
+        else:
+            copiar_banco(conectar_sqlite(), sqlite3.connect(temporario))
+            verificar_integridade(temporario)
+            blocos = blocos_arquivo(temporario)
+        checksum = compactar(blocos, parcial)
         
-        # Comprimir (opcional)
-        import gzip
-        with open(backup_file, 'rb') as f_in:
-            with gzip.open(f'{backup_file}.gz', 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        anteriores = listar_backups(pasta)
+        if pular_se_igual and anteriores and ler_checksum(anteriores[-1]) == checksum:
+            os.remove(parcial)
+            return anteriores[-1]
         
-        os.remove(backup_file)
+        os.replace(parcial, backup_file)
+        with open(caminho_checksum(backup_file), 'w', encoding='utf-8') as f:
+            f.write(f'{checksum}  {os.path.basename(backup_file)}\n')
         
-        return f'{backup_file}.gz'
+        return backup_file
     except Exception as e:
         print(f"Erro no backup: {e}")
         return None
+    finally:
+        for sobra in (temporario, parcial):
+            if sobra and os.path.exists(sobra):
+                os.remove(sobra)
 
 def restaurar_backup(arquivo):
-    """Restaura backup do banco de dados"""
+    """Restaura backup do banco de dados
+    
+    O backup é descompactado num arquivo temporário ao lado do banco e
+    conferido (checksum, quando existe, e integrity_check) antes de tocar no
+    banco atual. Sem banco atual, o temporário é só renomeado. Com banco, o
+    temporário não é renomeado por cima dele: as conexões abertas do app
+    continuariam no arquivo antigo, com os -wal/-shm dele. O conteúdo entra
+    pela API de backup num passo só (paginas=-1), sob o lock de escrita: é
+    atômico para quem está conectado, que passa a ver o banco restaurado.
+    """
+    temporario = CAMINHO_BANCO + '.restaurando'
     try:
-        # Se for gzip, descomprimir
-        if arquivo.endswith('.gz'):
-            import gzip
-            with gzip.open(arquivo, 'rb') as f_in:
-                with open('instance/refeitorio.db', 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
+        checksum = descompactar(arquivo, temporario)
+        esperado = ler_checksum(arquivo)
+        if esperado and checksum != esperado:
+            raise ValueError('Checksum do backup não confere!')
+        verificar_integridade(temporario)
+        
+        if os.path.exists(CAMINHO_BANCO):
+            copiar_banco(sqlite3.connect(temporario), conectar_sqlite(), paginas=-1)
         else:
-            shutil.copy2(arquivo, 'instance/refeitorio.db')
+            os.replace(temporario, CAMINHO_BANCO)
         
         return True
     except Exception as e:
         print(f"Erro na restauração: {e}")
         return False
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+def rotacionar_backups(pasta=PASTA_BACKUPS, manter=7):
+    """Apaga os backups mais antigos, deixando os `manter` mais recentes"""
+    removidos = []
+    for arquivo in listar_backups(pasta)[:-manter] if manter > 0 else []:
+        os.remove(arquivo)
+        if os.path.exists(caminho_checksum(arquivo)):
+            os.remove(caminho_checksum(arquivo))
+        removidos.append(arquivo)
+    return removidos
+
+def agendar_backups(intervalo_horas, pasta=PASTA_BACKUPS, manter=7):
+    """Backup a cada intervalo_horas, com rotação (roda até ser interrompido)
+    
+    O incremental é só isto: quando o sha256 do banco é o mesmo do último
+    backup, nenhum arquivo novo é criado. Cada backup gravado é uma cópia
+    inteira; não há snapshots por página nem pelo WAL.
+    """
+    while True:
+        arquivo = fazer_backup(pasta, pular_se_igual=True)
+        if arquivo:
+            rotacionar_backups(pasta, manter)
+            print(f"{datetime.now():%d/%m/%Y %H:%M:%S} backup: {arquivo}")
+        time.sleep(intervalo_horas * 3600)
 
-def limpar_logs_antigos(dias=30):
-    """Remove logs de auditoria mais antigos que X dias"""
+def ids_arquivados(caminho):
+    """ids de auditoria já gravados num arquivo mensal"""
+    ids = set()
+    if not os.path.exists(caminho):
+        return ids
+    try:
+        with gzip.open(caminho, 'rt', encoding='utf-8') as f:
+            for linha in f:
+                ids.add(json.loads(linha)['id'])
+    except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+        pass  # final cortado por uma gravação interrompida: vale o que foi lido
+    return ids
+
+def arquivar_logs(pasta, linhas, arquivados):
+    """Acrescenta as linhas em auditoria_AAAA-MM.jsonl.gz, um arquivo por mês
+    
+    `arquivados` (mês -> ids já no arquivo, lido na primeira vez) faz pular
+    as linhas que uma limpeza interrompida gravou e não chegou a apagar.
+    """
+    os.makedirs(pasta, exist_ok=True)
+    por_mes = {}
+    for linha in linhas:
+        por_mes.setdefault(linha['timestamp'][:7], []).append(linha)
+    for mes, registros in por_mes.items():
+        caminho = os.path.join(pasta, f'auditoria_{mes}.jsonl.gz')
+        if mes not in arquivados:
+            arquivados[mes] = ids_arquivados(caminho)
+        novos = [r for r in registros if r['id'] not in arquivados[mes]]
+        if not novos:
+            continue
+        with gzip.open(caminho, 'at', encoding='utf-8') as f:
+            for registro in novos:
+                f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        arquivados[mes].update(r['id'] for r in novos)
+
+def limpar_logs_antigos(dias=30, lote=5000, pasta_arquivo=None, engine=None):
+    """Remove logs de auditoria mais antigos que X dias
+    
+    Apaga em lotes de `lote` linhas, cada um na sua transação e num único
+    DELETE por intervalo de (timestamp, id), pelo índice de timestamp, para
+    não travar o banco num DELETE só. Com pasta_arquivo, as linhas são
+    gravadas nos arquivos mensais compactados antes do DELETE do lote: se ele
+    não chegar ao commit, a próxima limpeza não as grava de novo. Erros sobem
+    para quem chamou.
+    """
+    criada = engine is None
+    engine = engine or criar_engine()
+    arquivados = {}
     try:
-        conn = sqlite3.connect('instance/refeitorio.db')
-        cursor = conn.cursor()
-        
-        data_limite = datetime.now().date() - timedelta(days=dias)
         
-        cursor.execute("""
-            DELETE FROM auditoria 
-            WHERE date(timestamp) < ?
-        """, (data_limite,))
+        # Texto 'AAAA-MM-DD' é menor que qualquer horário desse dia: mesma
+        # regra do antigo date(timestamp) < ?, mas usando o índice
+        data_limite = (datetime.now().date() - timedelta(days=dias)).isoformat()
         
-        conn.commit()
-        registros_removidos = cursor.rowcount
-        conn.close()
+        registros_removidos = 0
+        while True:
+            with engine.begin() as conn:
+                linhas = conn.execute(text("""
+                    SELECT id, timestamp, usuario, acao, tipo, detalhes
+                    FROM auditoria
+                    WHERE timestamp < :limite
+                    ORDER BY timestamp, id
+                    LIMIT :lote
+                """), {'limite': data_limite, 'lote': lote}).mappings().all()
+                if not linhas:
+                    break
+                
+                if pasta_arquivo:
+                    arquivar_logs(pasta_arquivo, [{**l, 'timestamp': str(l['timestamp'])} for l in linhas], arquivados)
+                
+                # Exatamente as linhas lidas: até a última na ordem (timestamp, id)
+                ultima = linhas[-1]
+                conn.execute(text("""
+                    DELETE FROM auditoria
+                    WHERE timestamp < :limite
+                      AND (timestamp < :ultimo_timestamp OR (timestamp = :ultimo_timestamp AND id <= :ultimo_id))
+                """), {'limite': data_limite, 'ultimo_timestamp': ultima['timestamp'], 'ultimo_id': ultima['id']})
+            registros_removidos += len(linhas)
         
         return registros_removidos
-    except Exception as e:
-        print(f"Erro ao limpar logs: {e}")
-        return 0
\ No newline at end of file
+    finally:
+        if criada:
+            engine.dispose()
@@ -0,0 +1,139 @@
+import atexit
+import json
+import os
+import queue
+import socket
+import threading
+
+# Eventos guardados por conexão SSE; um cliente que não acompanha perde a
+# fila e recebe 'recarregar' (busca tudo de novo uma vez)
+TAMANHO_FILA_CLIENTE = 100
+
+# Maior datagrama aceito entre os workers
+TAMANHO_MAXIMO_DATAGRAMA = 65000
+
+class BarramentoEventos:
+    """Eventos do processo para as conexões SSE (/api/eventos)
+
+    `publicar` entrega para as funções registradas com `ao_receber` e para
+    as filas das conexões abertas. Com `pasta`, cada processo (worker) abre
+    um socket UDP em 127.0.0.1 e anota a porta em pasta/<pid>.porta; o que é
+    publicado num processo também é entregue nos outros, sem passar pelo
+    banco.
+    """
+
+    def __init__(self, pasta=None):
+        self.filas = set()
+        self.funcoes = {}
+        self.lock = threading.Lock()
+        self.pasta = pasta
+        self.socket = None
+        self.arquivo_porta = None
+
+    # ---------- assinantes ----------
+    def assinar(self, limite=None):
+        """Fila de uma conexão nova, ou None se já houver `limite` conexões"""
+        fila = queue.Queue(maxsize=TAMANHO_FILA_CLIENTE)
+        with self.lock:
+            if limite is not None and len(self.filas) >= limite:
+                return None
+            self.filas.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        with self.lock:
+            self.filas.discard(fila)
+
+    def assinantes(self):
+        return len(self.filas)
+
+    def ao_receber(self, tipo, funcao):
+        """funcao(dados) é chamada a cada evento `tipo`, deste ou de outro processo"""
+        self.funcoes.setdefault(tipo, []).append(funcao)
+
+    # ---------- publicação ----------
+    def publicar(self, tipo, dados=None):
+        self.entregar(tipo, dados)
+        if self.pasta:
+            self.repassar(tipo, dados)
+
+    def entregar(self, tipo, dados):
+        for funcao in self.funcoes.get(tipo, ()):
+            funcao(dados)
+        with self.lock:
+            filas = list(self.filas)
+        for fila in filas:
+            try:
+                fila.put_nowait((tipo, dados))
+            except queue.Full:
+                esvaziar(fila)
+                try:
+                    fila.put_nowait(('recarregar', None))
+                except queue.Full:
+                    pass
+
+    # ---------- repasse entre workers ----------
+    def iniciar_repasse(self):
+        """Abre o socket deste processo e a thread que recebe dos outros"""
+        if not self.pasta or self.socket:
+            return
+        os.makedirs(self.pasta, exist_ok=True)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.arquivo_porta = os.path.join(self.pasta, f'{os.getpid()}.porta')
+        with open(self.arquivo_porta, 'w') as f:
+            f.write(str(self.socket.getsockname()[1]))
+        atexit.register(self.encerrar_repasse)
+        threading.Thread(target=self.receber, name='eventos', daemon=True).start()
+
+    def encerrar_repasse(self):
+        if self.arquivo_porta and os.path.exists(self.arquivo_porta):
+            os.remove(self.arquivo_porta)
+
+    def portas_vizinhas(self):
+        if not os.path.isdir(self.pasta):
+            return []
+        portas = []
+        for nome in os.listdir(self.pasta):
+            caminho = os.path.join(self.pasta, nome)
+            if not nome.endswith('.porta') or caminho == self.arquivo_porta:
+                continue
+            try:
+                with open(caminho) as f:
+                    portas.append(int(f.read()))
+            except (OSError, ValueError):
+                continue  # arquivo sendo escrito ou removido agora
+        return portas
+
+    def repassar(self, tipo, dados):
+        mensagem = json.dumps({'tipo': tipo, 'dados': dados}, default=str).encode()
+        if len(mensagem) > TAMANHO_MAXIMO_DATAGRAMA:
+            mensagem = json.dumps({'tipo': 'recarregar', 'dados': None}).encode()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as envio:
+            for porta in self.portas_vizinhas():
+                try:
+                    envio.sendto(mensagem, ('127.0.0.1', porta))
+                except OSError:
+                    continue  # porta de um processo que já terminou
+
+    def receber(self):
+        while True:
+            try:
+                mensagem = json.loads(self.socket.recv(TAMANHO_MAXIMO_DATAGRAMA))
+            except (OSError, ValueError):
+                continue
+            try:
+                self.entregar(mensagem['tipo'], mensagem['dados'])
+            except Exception as e:
+                print(f'Erro ao entregar evento de outro processo: {e}')
+
+def esvaziar(fila):
+    try:
+        while True:
+            fila.get_nowait()
+    except queue.Empty:
+        pass
+
+def formatar_sse(tipo, dados):
+    """Um evento no formato text/event-stream"""
+    return f'event: {tipo}\ndata: {json.dumps(dados, default=str, ensure_ascii=False)}\n\n'
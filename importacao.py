@@ -0,0 +1,340 @@
+import csv
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+from datetime import date, datetime
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+COLUNAS_AGENDAMENTO = ['Dia', 'Identificação', 'Usuário', 'Curso/Departamento', 'Refeição', 'Comparecimento']
+
+EXTENSOES_PLANILHA = ('.xlsx', '.xlsm', '.xls', '.csv', '.txt')
+
+# Limite de linhas rejeitadas devolvidas na resposta da importação
+MAX_REJEITADAS_RELATORIO = 100
+
+MENSAGEM_FORMATO_INVALIDO = 'Formato de arquivo não suportado! Use .xlsx, .xls ou .csv'
+
+class PlanilhaInvalida(Exception):
+    pass
+
+# Catálogo padrão (migração 5): (id, nome, ordem no dia, chave do valor, apelidos).
+# Os apelidos são trechos em minúsculas, separados por '|', procurados no texto
+# da planilha; quem não casa com nenhum entra no catálogo com o próprio nome.
+REFEICOES_PADRAO = [
+    (1, 'Lanche da Manhã', 1, 'valor_lanche_manha', 'manhã|manha'),
+    (2, 'Almoço', 2, 'valor_almoco', 'almoço|almoco'),
+    (3, 'Lanche da Tarde', 3, 'valor_lanche_tarde', 'tarde'),
+    (4, 'Jantar', 4, 'valor_janta', 'jantar'),
+    (5, 'Ceia', 5, 'valor_ceia', 'ceia'),
+]
+
+ORDEM_REFEICAO_DESCONHECIDA = 999
+CHAVE_VALOR_PADRAO = 'valor_almoco'
+
+ItemCatalogo = namedtuple('ItemCatalogo', 'id nome ordem chave_valor apelidos')
+
+class CatalogoRefeicoes:
+    """Identifica a refeição de um texto da planilha pelos apelidos do catálogo
+
+    Os apelidos de cada refeição viram uma expressão regular compilada, testada
+    na ordem do dia; o resultado de cada texto distinto fica guardado.
+    """
+
+    def __init__(self, itens):
+        self.itens = {}
+        self.padroes = []
+        self.identificados = {}
+        for item in sorted((ItemCatalogo(*i) for i in itens), key=lambda i: (i.ordem, i.id)):
+            self.itens[item.id] = item
+            apelidos = [a.strip() for a in (item.apelidos or '').split('|') if a.strip()]
+            if apelidos:
+                self.padroes.append((re.compile('|'.join(map(re.escape, apelidos))), item.id))
+
+    def identificar(self, texto):
+        """Id da refeição, ou None se o texto não casa com nenhum apelido"""
+        chave = texto.strip().lower()
+        if chave not in self.identificados:
+            self.identificados[chave] = next(
+                (refeicao_id for padrao, refeicao_id in self.padroes if padrao.search(chave)), None
+            )
+        return self.identificados[chave]
+
+    def nome(self, refeicao_id):
+        item = self.itens.get(refeicao_id)
+        return item.nome if item else None
+
+    def ordem(self, refeicao_id):
+        item = self.itens.get(refeicao_id)
+        return item.ordem if item else ORDEM_REFEICAO_DESCONHECIDA
+
+    def chave_valor(self, refeicao_id):
+        item = self.itens.get(refeicao_id)
+        return item.chave_valor if item else CHAVE_VALOR_PADRAO
+
+def limpar_texto(coluna):
+    """Converte a coluna inteira para texto sem espaços nas pontas (vazio vira NA)"""
+    if pd.api.types.is_float_dtype(coluna):
+        # Matrículas lidas como float por causa de células vazias (1048.0)
+        preenchidos = coluna.dropna()
+        if (preenchidos == preenchidos.round()).all():
+            coluna = coluna.astype('Int64')
+    texto = coluna.astype('string').str.strip()
+    return texto.mask(texto == '')
+
+def converter_datas(coluna):
+    """Converte a coluna 'Dia' (dd/mm/aaaa ou data do Excel) de uma vez"""
+    if pd.api.types.is_datetime64_any_dtype(coluna):
+        return coluna.dt.normalize()
+
+    datas = pd.to_datetime(limpar_texto(coluna), format='%d/%m/%Y', errors='coerce')
+
+    if coluna.dtype == object:
+        # Planilhas com células de data misturadas com texto
+        nativas = coluna.map(lambda v: v if isinstance(v, (datetime, date)) else None)
+        datas = datas.fillna(pd.to_datetime(nativas, errors='coerce'))
+
+    return datas.dt.normalize()
+
+def preparar_agendamentos(df, catalogo, linha_inicial=2):
+    """Etapa vetorizada da importação: limpa, identifica a refeição e ordena as linhas
+
+    Retorna (lote, rejeitadas). O lote tem uma linha por registro válido,
+    ordenado por (data, ordem), e rejeitadas é a lista das linhas descartadas
+    com o número da linha na planilha e o motivo. Refeições fora do catálogo
+    (`CatalogoRefeicoes`) ficam com refeicao_id 0.
+    """
+    lote = pd.DataFrame({
+        'linha': np.arange(linha_inicial, linha_inicial + len(df)),
+        'matricula': limpar_texto(df['Identificação']).to_numpy(),
+        'nome': limpar_texto(df['Usuário']).to_numpy(),
+        'curso': limpar_texto(df['Curso/Departamento']).to_numpy(),
+        'refeicao_original': limpar_texto(df['Refeição']).to_numpy(),
+        'comparecimento': limpar_texto(df['Comparecimento']).to_numpy(),
+        'data': converter_datas(df['Dia']).to_numpy(),
+    })
+
+    motivo = pd.Series(None, index=lote.index, dtype=object)
+    motivo = motivo.mask(lote['data'].isna(), 'Data inválida')
+    motivo = motivo.mask(lote['refeicao_original'].isna(), 'Refeição vazia')
+    motivo = motivo.mask(lote['matricula'].isna(), 'Identificação vazia')
+
+    invalidas = motivo.notna()
+    rejeitadas = []
+    if invalidas.any():
+        dias = limpar_texto(df['Dia'].astype('string')).to_numpy()
+        for i in np.flatnonzero(invalidas.to_numpy()):
+            rejeitadas.append({
+                'linha': int(lote['linha'].iat[i]),
+                'motivo': motivo.iat[i],
+                'identificacao': None if pd.isna(lote['matricula'].iat[i]) else lote['matricula'].iat[i],
+                'dia': None if pd.isna(dias[i]) else dias[i]
+            })
+        lote = lote[~invalidas]
+
+    # Identificação por categoria: o catálogo é consultado uma vez por nome distinto
+    refeicoes = lote['refeicao_original'].astype('category')
+    codigos = refeicoes.cat.codes.to_numpy()
+    ids = np.array([catalogo.identificar(c) or 0 for c in refeicoes.cat.categories], dtype='int16')
+    lote['refeicao_original'] = refeicoes
+    lote['refeicao_id'] = ids[codigos]
+    lote['ordem'] = np.array([catalogo.ordem(i) for i in ids], dtype='int16')[codigos]
+
+    lote['presente'] = lote['comparecimento'].str.lower().eq('sim').fillna(False).astype(bool)
+    lote['nome'] = lote['nome'].fillna(lote['matricula'])
+    lote['curso'] = lote['curso'].astype(object).where(lote['curso'].notna(), None)
+
+    lote = lote.sort_values(['data', 'ordem'], kind='stable')
+    lote['data'] = lote['data'].dt.date
+
+    colunas = ['linha', 'matricula', 'nome', 'curso', 'data', 'refeicao_original', 'refeicao_id', 'ordem', 'presente']
+    return lote[colunas].reset_index(drop=True), rejeitadas
+
+# ==================== PAGAMENTOS EM LOTE ====================
+# Cabeçalhos aceitos na planilha do banco (comparados em minúsculas)
+COLUNAS_PAGAMENTO_LOTE = {
+    'matricula': ('matricula', 'matrícula', 'identificação', 'identificacao'),
+    'valor': ('valor', 'valor pago'),
+}
+
+def separador_csv(filepath):
+    with open(filepath, encoding='utf-8-sig', newline='') as f:
+        amostra = f.read(4096)
+    try:
+        return csv.Sniffer().sniff(amostra, delimiters=';,\t').delimiter
+    except csv.Error:
+        return ';'
+
+def ler_planilha_pagamentos(filepath):
+    """Planilha (matricula, valor) inteira, com as colunas renomeadas para esses nomes"""
+    extensao = os.path.splitext(filepath)[1].lower()
+    if extensao in ('.csv', '.txt'):
+        df = pd.read_csv(filepath, sep=separador_csv(filepath), dtype=str, encoding='utf-8-sig')
+    elif extensao in EXTENSOES_PLANILHA:
+        df = pd.read_excel(filepath, dtype=str)
+    else:
+        raise PlanilhaInvalida(MENSAGEM_FORMATO_INVALIDO)
+
+    cabecalho = {str(c).strip().lower(): c for c in df.columns}
+    colunas = {}
+    for nome, aceitos in COLUNAS_PAGAMENTO_LOTE.items():
+        original = next((cabecalho[a] for a in aceitos if a in cabecalho), None)
+        if original is None:
+            raise PlanilhaInvalida(f'Coluna "{nome}" não encontrada!')
+        colunas[original] = nome
+    return df[list(colunas)].rename(columns=colunas)
+
+def converter_valores(coluna):
+    """Valores em reais: número do Excel ou texto como 'R$ 1.234,56' / '12.50'"""
+    if pd.api.types.is_numeric_dtype(coluna):
+        return coluna.astype(float)
+    texto = limpar_texto(coluna).str.replace('R$', '', regex=False).str.strip()
+    # Com vírgula decimal, os pontos são separadores de milhar
+    com_virgula = texto.str.contains(',', regex=False).fillna(False)
+    texto = texto.where(~com_virgula, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(texto, errors='coerce').astype(float)
+
+def preparar_pagamentos(df, linha_inicial=2):
+    """Limpa a planilha de pagamentos e junta as linhas da mesma matrícula
+
+    Retorna (lote, rejeitadas): o lote tem uma linha por matrícula (linha da
+    primeira ocorrência, quantas linhas e o valor somado); rejeitadas lista as
+    linhas sem matrícula ou com valor inválido.
+    """
+    lote = pd.DataFrame({
+        'linha': np.arange(linha_inicial, linha_inicial + len(df)),
+        'matricula': limpar_texto(df['matricula']).to_numpy(),
+        'valor': converter_valores(df['valor']).to_numpy(),
+    })
+
+    motivo = pd.Series(None, index=lote.index, dtype=object)
+    motivo = motivo.mask(~(lote['valor'] > 0), 'Valor inválido')
+    motivo = motivo.mask(lote['matricula'].isna(), 'Matrícula vazia')
+    invalidas = motivo.notna()
+    rejeitadas = [{
+        'linha': int(linha),
+        'matricula': None if pd.isna(matricula) else matricula,
+        'valor': None if pd.isna(valor) else float(valor),
+        'motivo': m
+    } for linha, matricula, valor, m in zip(
+        lote['linha'][invalidas], lote['matricula'][invalidas], lote['valor'][invalidas], motivo[invalidas]
+    )]
+
+    lote = lote[~invalidas].groupby('matricula', sort=False).agg(
+        linha=('linha', 'min'), linhas=('linha', 'size'), valor=('valor', 'sum')
+    ).reset_index()
+    lote['valor'] = lote['valor'].round(2)
+    return lote, rejeitadas
+
+# ==================== LEITURA EM LOTES ====================
+def _lotes_de_linhas(cabecalho, linhas, tamanho_lote, pular):
+    linha_inicial = 2 + pular
+    linhas = islice(linhas, pular, None)
+    while True:
+        bloco = list(islice(linhas, tamanho_lote))
+        if not bloco:
+            return
+        yield linha_inicial, pd.DataFrame(bloco, columns=cabecalho)
+        linha_inicial += len(bloco)
+
+def _ler_xlsx(filepath, tamanho_lote, pular):
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        linhas = wb.active.iter_rows(values_only=True)
+        cabecalho = [str(c).strip() if c is not None else '' for c in next(linhas, ())]
+        verificar_colunas(cabecalho)
+        # Linhas totalmente vazias (formatação no fim da planilha) não contam
+        linhas = (l[:len(cabecalho)] for l in linhas if any(v is not None for v in l))
+        yield from _lotes_de_linhas(cabecalho, linhas, tamanho_lote, pular)
+    finally:
+        wb.close()
+
+def _ler_csv(filepath, tamanho_lote, pular):
+    leitor = pd.read_csv(
+        filepath, sep=separador_csv(filepath), dtype=str, encoding='utf-8-sig', chunksize=tamanho_lote
+    )
+    with leitor:
+        linha_inicial = 2
+        primeiro = True
+        for df in leitor:
+            if primeiro:
+                verificar_colunas(df.columns)
+                primeiro = False
+            df.columns = [str(c).strip() for c in df.columns]
+            # A retomada pula registros já lidos, não linhas do arquivo (linhas
+            # em branco e campos com quebra de linha mudariam a conta)
+            if pular:
+                descartar = min(pular, len(df))
+                df = df.iloc[descartar:]
+                pular -= descartar
+                linha_inicial += descartar
+                if df.empty:
+                    continue
+            yield linha_inicial, df
+            linha_inicial += len(df)
+
+def _ler_xls(filepath, tamanho_lote, pular):
+    # Formato antigo não tem leitura em streaming, fica o read_excel
+    df = pd.read_excel(filepath)
+    verificar_colunas(df.columns)
+    for inicio in range(pular, len(df), tamanho_lote):
+        yield 2 + inicio, df.iloc[inicio:inicio + tamanho_lote]
+
+def verificar_colunas(colunas):
+    colunas = [str(c).strip() for c in colunas]
+    for col in COLUNAS_AGENDAMENTO:
+        if col not in colunas:
+            raise PlanilhaInvalida(f'Coluna "{col}" não encontrada!')
+
+def ler_planilha_em_lotes(filepath, tamanho_lote, pular=0):
+    """Lê a planilha em blocos de até tamanho_lote linhas, sem carregar o arquivo inteiro
+
+    Gera (linha_inicial, DataFrame), onde linha_inicial é a linha da planilha
+    do primeiro registro do bloco. As primeiras `pular` linhas de dados são
+    descartadas (retomada a partir de um checkpoint).
+    """
+    extensao = os.path.splitext(filepath)[1].lower()
+    if extensao in ('.xlsx', '.xlsm'):
+        return _ler_xlsx(filepath, tamanho_lote, pular)
+    if extensao in ('.csv', '.txt'):
+        return _ler_csv(filepath, tamanho_lote, pular)
+    if extensao == '.xls':
+        return _ler_xls(filepath, tamanho_lote, pular)
+    raise PlanilhaInvalida(MENSAGEM_FORMATO_INVALIDO)
+
+# ==================== CHECKPOINT ====================
+def calcular_hash(filepath):
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def caminho_checkpoint(pasta, hash_arquivo):
+    return os.path.join(pasta, f'{hash_arquivo}.checkpoint.json')
+
+def ler_checkpoint(pasta, hash_arquivo):
+    """Progresso salvo de uma importação interrompida do mesmo arquivo (ou None)"""
+    try:
+        with open(caminho_checkpoint(pasta, hash_arquivo), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def salvar_checkpoint(pasta, hash_arquivo, checkpoint):
+    destino = caminho_checkpoint(pasta, hash_arquivo)
+    temporario = destino + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(temporario, destino)
+
+def remover_checkpoint(pasta, hash_arquivo):
+    try:
+        os.remove(caminho_checkpoint(pasta, hash_arquivo))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,260 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from importacao import (
+    REFEICOES_PADRAO, ORDEM_REFEICAO_DESCONHECIDA, CHAVE_VALOR_PADRAO, CatalogoRefeicoes
+)
+
+# Cada migração roda uma única vez por banco, em ordem de versão, dentro de
+# uma transação. Os comandos são idempotentes (IF NOT EXISTS) porque um banco
+# novo já nasce com o esquema atual pelo db.create_all(); as que dependem da
+# antiga coluna historico.refeicao (texto) não fazem nada nesse caso.
+
+def coluna_existe(conn, tabela, coluna):
+    return any(c['name'] == coluna for c in inspect(conn).get_columns(tabela))
+
+def historico_antigo(conn):
+    return coluna_existe(conn, 'historico', 'refeicao')
+
+def m001_indices_historico(conn):
+    if not historico_antigo(conn):
+        return
+    # A chave única não pode ser criada com duplicatas: fica a primeira gravada
+    conn.execute(text("""
+        DELETE FROM historico
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM historico GROUP BY aluno_id, data, refeicao
+        )
+    """))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_historico_aluno_data_refeicao
+        ON historico (aluno_id, data, refeicao)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_historico_data_tipo
+        ON historico (data, tipo, refeicao, valor)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_historico_aluno_tipo_status
+        ON historico (aluno_id, tipo, status)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_historico_tipo_refeicao
+        ON historico (tipo, refeicao, valor)
+    """))
+
+def reconstruir_resumo_diario(conn):
+    """Recalcula a tabela resumo_diario inteira a partir do histórico"""
+    conn.execute(text('DELETE FROM resumo_diario'))
+    resultado = conn.execute(text("""
+        INSERT INTO resumo_diario (data, refeicao, tipo, quantidade, valor_total, quantidade_paga, valor_pago)
+        SELECT h.data,
+               COALESCE(r.nome, ''),
+               h.tipo,
+               COUNT(*),
+               COALESCE(SUM(h.valor), 0),
+               SUM(CASE WHEN h.status = 'paga' THEN 1 ELSE 0 END),
+               COALESCE(SUM(CASE WHEN h.status = 'paga' THEN h.valor ELSE 0 END), 0)
+        FROM historico h
+        LEFT JOIN refeicao r ON r.id = h.refeicao_id
+        GROUP BY h.data, COALESCE(r.nome, ''), h.tipo
+    """))
+    return resultado.rowcount
+
+def m002_resumo_diario(conn):
+    # A tabela vem do create_all; o preenchimento agrupa pelo catálogo de
+    # refeições, então em banco antigo ele fica para a migração 5
+    if not historico_antigo(conn):
+        reconstruir_resumo_diario(conn)
+
+def m003_indices_aluno(conn):
+    # Contadores nulos atrapalham a paginação por cursor; na prática valem 0
+    conn.execute(text('UPDATE aluno SET total_faltas = 0 WHERE total_faltas IS NULL'))
+    conn.execute(text('UPDATE aluno SET debito = 0 WHERE debito IS NULL'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_aluno_nome_lower ON aluno (lower(nome))'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_aluno_bloqueado_faltas ON aluno (bloqueado, total_faltas)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_aluno_total_faltas ON aluno (total_faltas)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_aluno_debito ON aluno (debito)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_aluno_ultima_falta ON aluno (ultima_falta_data)'))
+
+# Ordem do catálogo padrão (importacao.REFEICOES_PADRAO) pelo texto, em SQL
+ORDEM_REFEICAO_SQL = """
+    CASE
+        WHEN lower(refeicao) LIKE '%manh%' THEN 1
+        WHEN lower(refeicao) LIKE '%almo%' THEN 2
+        WHEN lower(refeicao) LIKE '%tarde%' THEN 3
+        WHEN lower(refeicao) LIKE '%jantar%' THEN 4
+        WHEN lower(refeicao) LIKE '%ceia%' THEN 5
+        ELSE 999
+    END
+"""
+
+def m004_ordem_refeicao(conn):
+    if not coluna_existe(conn, 'historico', 'ordem_refeicao'):
+        conn.execute(text('ALTER TABLE historico ADD COLUMN ordem_refeicao SMALLINT'))
+    if historico_antigo(conn):
+        conn.execute(text(f'UPDATE historico SET ordem_refeicao = {ORDEM_REFEICAO_SQL} WHERE ordem_refeicao IS NULL'))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_historico_aluno_data_ordem
+        ON historico (aluno_id, data, ordem_refeicao)
+    """))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_pagamento_aluno_data ON pagamento (aluno_id, data)'))
+
+def semear_refeicoes(conn):
+    existentes = {r[0] for r in conn.execute(text('SELECT id FROM refeicao'))}
+    novas = [
+        {'id': i, 'nome': nome, 'ordem': ordem, 'chave_valor': chave, 'apelidos': apelidos}
+        for i, nome, ordem, chave, apelidos in REFEICOES_PADRAO if i not in existentes
+    ]
+    if novas:
+        conn.execute(text("""
+            INSERT INTO refeicao (id, nome, ordem, chave_valor, apelidos)
+            VALUES (:id, :nome, :ordem, :chave_valor, :apelidos)
+        """), novas)
+        if conn.dialect.name == 'postgresql':
+            # ids explícitos não avançam o serial; as próximas refeições vêm depois deles
+            conn.execute(text("SELECT setval(pg_get_serial_sequence('refeicao', 'id'), (SELECT MAX(id) FROM refeicao))"))
+
+def carregar_catalogo(conn):
+    return CatalogoRefeicoes(conn.execute(text('SELECT id, nome, ordem, chave_valor, apelidos FROM refeicao')).all())
+
+def m005_catalogo_refeicoes(conn):
+    semear_refeicoes(conn)
+    if not historico_antigo(conn):
+        return
+    if not coluna_existe(conn, 'historico', 'refeicao_id'):
+        conn.execute(text('ALTER TABLE historico ADD COLUMN refeicao_id SMALLINT REFERENCES refeicao (id)'))
+    
+    # Cada texto distinto passa uma vez pelo mesmo catálogo da importação;
+    # o que não casa com nenhum apelido entra no catálogo com o próprio nome
+    nomes = [r[0] for r in conn.execute(text('SELECT DISTINCT refeicao FROM historico WHERE refeicao IS NOT NULL'))]
+    catalogo = carregar_catalogo(conn)
+    desconhecidas = {}
+    for nome in nomes:
+        if nome.strip() and catalogo.identificar(nome) is None:
+            desconhecidas.setdefault(nome.strip().lower(), nome.strip())
+    if desconhecidas:
+        conn.execute(text("""
+            INSERT INTO refeicao (nome, ordem, chave_valor, apelidos)
+            VALUES (:nome, :ordem, :chave_valor, :apelidos)
+        """), [{
+            'nome': nome,
+            'ordem': ORDEM_REFEICAO_DESCONHECIDA,
+            'chave_valor': CHAVE_VALOR_PADRAO,
+            'apelidos': apelido
+        } for apelido, nome in desconhecidas.items()])
+        catalogo = carregar_catalogo(conn)
+    
+    atualizacoes = []
+    for nome in nomes:
+        refeicao_id = catalogo.identificar(nome) if nome.strip() else None
+        if refeicao_id is not None:
+            atualizacoes.append({'nome': nome, 'id': refeicao_id, 'ordem': catalogo.ordem(refeicao_id)})
+    if atualizacoes:
+        conn.execute(text("""
+            UPDATE historico SET refeicao_id = :id, ordem_refeicao = :ordem
+            WHERE refeicao = :nome
+        """), atualizacoes)
+    
+    # Grafias diferentes da mesma refeição no mesmo dia viram duplicatas: fica
+    # a primeira gravada (os contadores do aluno não são recalculados aqui)
+    conn.execute(text("""
+        DELETE FROM historico
+        WHERE refeicao_id IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM historico WHERE refeicao_id IS NOT NULL
+            GROUP BY aluno_id, data, refeicao_id
+        )
+    """))
+    
+    # Índices sobre o texto saem para a coluna poder ser removida
+    conn.execute(text('DROP INDEX IF EXISTS uq_historico_aluno_data_refeicao'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_historico_data_tipo'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_historico_tipo_refeicao'))
+    conn.execute(text('ALTER TABLE historico DROP COLUMN refeicao'))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_historico_aluno_data_refeicao
+        ON historico (aluno_id, data, refeicao_id)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_historico_data_tipo
+        ON historico (data, tipo, refeicao_id, valor)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_historico_tipo_refeicao
+        ON historico (tipo, refeicao_id, valor)
+    """))
+    reconstruir_resumo_diario(conn)
+
+def m006_indices_auditoria(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_auditoria_timestamp ON auditoria (timestamp)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_auditoria_tipo_timestamp ON auditoria (tipo, timestamp)'))
+
+def m007_regras_bloqueio(conn):
+    # Colunas das regras de faltas seguidas e bloqueio temporário; os valores
+    # vêm do próximo recálculo (flask recalcular-alunos)
+    if not coluna_existe(conn, 'aluno', 'faltas_consecutivas'):
+        conn.execute(text('ALTER TABLE aluno ADD COLUMN faltas_consecutivas INTEGER DEFAULT 0'))
+    if not coluna_existe(conn, 'aluno', 'bloqueado_ate'):
+        conn.execute(text('ALTER TABLE aluno ADD COLUMN bloqueado_ate DATE'))
+    conn.execute(text('UPDATE aluno SET faltas_consecutivas = 0 WHERE faltas_consecutivas IS NULL'))
+
+def m008_fim_ultimo_bloqueio(conn):
+    # bloqueado_ate deixa de guardar também o fim do último bloqueio vencido;
+    # essa marca vai para a coluna nova (o recálculo limpa o resto)
+    if not coluna_existe(conn, 'aluno', 'fim_ultimo_bloqueio'):
+        conn.execute(text('ALTER TABLE aluno ADD COLUMN fim_ultimo_bloqueio DATE'))
+    conn.execute(text('UPDATE aluno SET fim_ultimo_bloqueio = bloqueado_ate WHERE bloqueado_ate < CURRENT_DATE'))
+
+def m009_dono_job_importacao(conn):
+    # Token da reserva do job: o worker que perdeu a reserva não grava mais
+    if not coluna_existe(conn, 'importacao_job', 'dono'):
+        conn.execute(text('ALTER TABLE importacao_job ADD COLUMN dono VARCHAR(32)'))
+
+MIGRACOES = [
+    (1, 'Índices do histórico e chave única (aluno_id, data, refeicao)', m001_indices_historico),
+    (2, 'Preenche o resumo diário (data, refeição, tipo)', m002_resumo_diario),
+    (3, 'Índices de busca e ordenação da listagem de alunos', m003_indices_aluno),
+    (4, 'Ordem da refeição gravada no histórico e índices do detalhe do aluno', m004_ordem_refeicao),
+    (5, 'Catálogo de refeições; histórico passa a guardar refeicao_id', m005_catalogo_refeicoes),
+    (6, 'Índices de data (e tipo) da auditoria', m006_indices_auditoria),
+    (7, 'Faltas seguidas e fim do bloqueio temporário do aluno', m007_regras_bloqueio),
+    (8, 'Fim do último bloqueio temporário vencido do aluno', m008_fim_ultimo_bloqueio),
+    (9, 'Dono da reserva do job de importação', m009_dono_job_importacao),
+]
+
+def criar_tabela_controle(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migracao (
+            versao INTEGER PRIMARY KEY,
+            descricao VARCHAR(200),
+            aplicada_em TIMESTAMP
+        )
+    """))
+
+def versoes_aplicadas(conn):
+    return {r[0] for r in conn.execute(text('SELECT versao FROM schema_migracao'))}
+
+def aplicar_migracoes(engine):
+    """Atualiza o banco no lugar, aplicando as migrações pendentes em ordem"""
+    with engine.begin() as conn:
+        criar_tabela_controle(conn)
+        feitas = versoes_aplicadas(conn)
+
+    aplicadas = []
+    for versao, descricao, migracao in MIGRACOES:
+        if versao in feitas:
+            continue
+        try:
+            with engine.begin() as conn:
+                migracao(conn)
+                conn.execute(
+                    text('INSERT INTO schema_migracao (versao, descricao, aplicada_em) VALUES (:v, :d, :t)'),
+                    {'v': versao, 'd': descricao, 't': datetime.utcnow()}
+                )
+        except IntegrityError:
+            # Outro processo (worker) aplicou a mesma versão ao mesmo tempo
+            continue
+        aplicadas.append(versao)
+    return aplicadas
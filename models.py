@@ -1,81 +1,107 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from importacao import ORDEM_REFEICAO_DESCONHECIDA, CHAVE_VALOR_PADRAO
+
 db = SQLAlchemy()
 
 class Aluno(db.Model):
-    __tablename__ = 'aluno'
-    
     id = db.Column(db.Integer, primary_key=True)
     matricula = db.Column(db.String(20), unique=True, nullable=False)
     nome = db.Column(db.String(100), nullable=False)
+    curso = db.Column(db.String(100))
     email = db.Column(db.String(100))
-    faltas_consecutivas = db.Column(db.Integer, default=0)
     total_faltas = db.Column(db.Integer, default=0)
     debito = db.Column(db.Float, default=0.0)
-    bloqueado_ate = db.Column(db.Date, nullable=True)
+    ultima_falta_data = db.Column(db.Date, nullable=True)
+    ultima_falta_refeicao = db.Column(db.String(50), nullable=True)
+    ultima_falta_valor = db.Column(db.Float, default=0.0)
+    faltas_consecutivas = db.Column(db.Integer, default=0)
+    bloqueado = db.Column(db.Boolean, default=False)
+    bloqueado_ate = db.Column(db.Date, nullable=True)  # fim do bloqueio temporário em vigor (migração 7)
+    fim_ultimo_bloqueio = db.Column(db.Date, nullable=True)  # faltas até aqui não contam de novo (migração 8)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    # Relacionamentos
     historico = db.relationship('Historico', backref='aluno', lazy=True, cascade='all, delete-orphan')
     pagamentos = db.relationship('Pagamento', backref='aluno', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'matricula': self.matricula,
-            'nome': self.nome,
-            'email': self.email,
-            'faltas_consecutivas': self.faltas_consecutivas,
-            'total_faltas': self.total_faltas,
-            'debito': self.debito,
-            'bloqueado_ate': self.bloqueado_ate.strftime('%Y-%m-%d') if self.bloqueado_ate else None
-        }
-    
     def __repr__(self):
         return f'<Aluno {self.matricula} - {self.nome}>'
 
+# Índices de busca/ordenação da listagem (migração 3)
+db.Index('ix_aluno_nome_lower', db.func.lower(Aluno.nome))
+db.Index('ix_aluno_bloqueado_faltas', Aluno.bloqueado, Aluno.total_faltas)
+db.Index('ix_aluno_total_faltas', Aluno.total_faltas)
+db.Index('ix_aluno_debito', Aluno.debito)
+db.Index('ix_aluno_ultima_falta', Aluno.ultima_falta_data)
+
+class Refeicao(db.Model):
+    # Catálogo das refeições (migração 5); o histórico guarda só o id
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(50), unique=True, nullable=False)
+    ordem = db.Column(db.SmallInteger, nullable=False, default=ORDEM_REFEICAO_DESCONHECIDA)
+    chave_valor = db.Column(db.String(50), nullable=False, default=CHAVE_VALOR_PADRAO)
+    apelidos = db.Column(db.String(200))  # trechos em minúsculas separados por '|'
+
 class Historico(db.Model):
-    __tablename__ = 'historico'
+    # Mesmos nomes das migrações 1 e 5 (migracoes.py), para banco novo e banco migrado
+    __table_args__ = (
+        db.Index('uq_historico_aluno_data_refeicao', 'aluno_id', 'data', 'refeicao_id', unique=True),
+        db.Index('ix_historico_data_tipo', 'data', 'tipo', 'refeicao_id', 'valor'),
+        db.Index('ix_historico_aluno_tipo_status', 'aluno_id', 'tipo', 'status'),
+        db.Index('ix_historico_tipo_refeicao', 'tipo', 'refeicao_id', 'valor'),
+        db.Index('ix_historico_aluno_data_ordem', 'aluno_id', 'data', 'ordem_refeicao'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id'), nullable=False)
     data = db.Column(db.Date, nullable=False)
-    tipo = db.Column(db.String(20), nullable=False)  # agendamento, presenca, falta
+    refeicao_id = db.Column(db.SmallInteger, db.ForeignKey('refeicao.id'), nullable=False)
+    ordem_refeicao = db.Column(db.SmallInteger, default=999)  # ordem no dia (1 = lanche da manhã)
+    tipo = db.Column(db.String(20), nullable=False)
     status = db.Column(db.String(20), nullable=False)
+    valor = db.Column(db.Float, default=0.0)
+    registro_data = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<Historico {self.aluno_id} - {self.data} - {self.tipo}>'
 
 class Pagamento(db.Model):
-    __tablename__ = 'pagamento'
+    __table_args__ = (
+        db.Index('ix_pagamento_aluno_data', 'aluno_id', 'data'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id'), nullable=False)
     data = db.Column(db.Date, nullable=False)
     valor = db.Column(db.Float, nullable=False)
     motivo = db.Column(db.String(200))
+    faltas_quitadas = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<Pagamento {self.aluno_id} - R$ {self.valor}>'
 
 class Configuracao(db.Model):
-    __tablename__ = 'configuracao'
-    
     id = db.Column(db.Integer, primary_key=True)
     chave = db.Column(db.String(50), unique=True, nullable=False)
     valor = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.String(200))
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    tipo = db.Column(db.String(20), default='geral')
     
     def __repr__(self):
         return f'<Config {self.chave} = {self.valor}>'
 
 class Auditoria(db.Model):
-    __tablename__ = 'auditoria'
+    # Mesmos nomes da migração 6; listagem e retenção andam pelo timestamp
+    __table_args__ = (
+        db.Index('ix_auditoria_timestamp', 'timestamp'),
+        db.Index('ix_auditoria_tipo_timestamp', 'tipo', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -85,4 +111,85 @@ class Auditoria(db.Model):
     detalhes = db.Column(db.Text)
     
     def __repr__(self):
-        return f'<Auditoria {self.timestamp} - {self.acao}>'
\ No newline at end of file
+        return f'<Auditoria {self.timestamp} - {self.acao}>'
+
+class ResumoDiario(db.Model):
+    # Agregado mantido junto com importações e pagamentos (mesma transação);
+    # os relatórios leem daqui em vez de varrer o histórico
+    data = db.Column(db.Date, primary_key=True)
+    refeicao = db.Column(db.String(50), primary_key=True)  # nome do catálogo (Refeicao.nome)
+    tipo = db.Column(db.String(20), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor_total = db.Column(db.Float, nullable=False, default=0.0)
+    quantidade_paga = db.Column(db.Integer, nullable=False, default=0)
+    valor_pago = db.Column(db.Float, nullable=False, default=0.0)
+
+class ImportacaoJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    arquivo = db.Column(db.String(200), nullable=False)
+    caminho = db.Column(db.String(300), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, processando, concluida, erro
+    linhas_lidas = db.Column(db.Integer, default=0)
+    linhas_inseridas = db.Column(db.Integer, default=0)
+    novos_alunos = db.Column(db.Integer, default=0)
+    faltas = db.Column(db.Integer, default=0)
+    bloqueados = db.Column(db.Integer, default=0)
+    rejeitadas = db.Column(db.Integer, default=0)
+    rejeitadas_detalhes = db.Column(db.Text)
+    mensagem = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciado_em = db.Column(db.DateTime)
+    atualizado_em = db.Column(db.DateTime)
+    concluido_em = db.Column(db.DateTime)
+    dono = db.Column(db.String(32))  # token de quem reservou; só ele grava o progresso
+
+# ==================== DATAS FORMATADAS NO BANCO ====================
+# O texto dd/mm/aaaa das listagens sai pronto da consulta, sem strftime por linha
+class data_br(FunctionElement):
+    type = db.String()
+    name = 'data_br'
+    inherit_cache = True
+
+class data_hora_br(FunctionElement):
+    type = db.String()
+    name = 'data_hora_br'
+    inherit_cache = True
+
+@compiles(data_br)
+def _data_br(elemento, compilador, **kw):
+    return compilador.process(db.func.strftime('%d/%m/%Y', *elemento.clauses), **kw)
+
+@compiles(data_br, 'postgresql')
+def _data_br_pg(elemento, compilador, **kw):
+    return compilador.process(db.func.to_char(*elemento.clauses, 'DD/MM/YYYY'), **kw)
+
+@compiles(data_hora_br)
+def _data_hora_br(elemento, compilador, **kw):
+    return compilador.process(db.func.strftime('%d/%m/%Y %H:%M:%S', *elemento.clauses), **kw)
+
+@compiles(data_hora_br, 'postgresql')
+def _data_hora_br_pg(elemento, compilador, **kw):
+    return compilador.process(db.func.to_char(*elemento.clauses, 'DD/MM/YYYY HH24:MI:SS'), **kw)
+
+# ==================== PROJEÇÕES ====================
+# Colunas das leituras só de exibição (listagens e relatórios):
+# db.session.execute(db.select(*COLUNAS_...)) devolve Row, uma tupla nomeada
+# com os mesmos nomes de atributo, sem instância ORM nem identity map.
+COLUNAS_ALUNO = (
+    Aluno.id, Aluno.matricula, Aluno.nome, Aluno.curso, Aluno.total_faltas, Aluno.debito,
+    Aluno.ultima_falta_data, Aluno.ultima_falta_refeicao, Aluno.faltas_consecutivas, Aluno.bloqueado,
+    Aluno.bloqueado_ate, data_br(Aluno.ultima_falta_data).label('ultima_falta_br'),
+    data_br(Aluno.bloqueado_ate).label('bloqueado_ate_br')
+)
+COLUNAS_HISTORICO = (
+    Historico.id, Historico.data, Historico.refeicao_id, Historico.tipo, Historico.status, Historico.valor,
+    data_br(Historico.data).label('data_br')
+)
+COLUNAS_PAGAMENTO = (
+    Pagamento.id, Pagamento.data, Pagamento.valor, Pagamento.motivo, Pagamento.faltas_quitadas,
+    data_br(Pagamento.data).label('data_br')
+)
+COLUNAS_AUDITORIA = (
+    Auditoria.id, Auditoria.timestamp, Auditoria.usuario, Auditoria.acao, Auditoria.tipo, Auditoria.detalhes,
+    data_hora_br(Auditoria.timestamp).label('timestamp_br')
+)
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+# Granularidade do relatório por período -> frequência do pandas (início do período)
+GRANULARIDADES = {'dia': 'D', 'semana': 'W-MON', 'mes': 'MS'}
+FORMATO_PERIODO = {'dia': '%d/%m/%Y', 'semana': '%d/%m/%Y', 'mes': '%m/%Y'}
+
+PERCENTIS = (50, 75, 90, 95, 99)
+
+SEM_CURSO = 'Sem curso'
+
+COLUNAS_SOMA = ['presencas', 'faltas', 'valor_faltas', 'valor_pago']
+
+def inicio_periodo(datas, granularidade):
+    """Data inicial do período (dia, segunda-feira da semana ou dia 1 do mês) de cada data"""
+    if granularidade == 'semana':
+        return datas - pd.to_timedelta(datas.dt.weekday, unit='D')
+    if granularidade == 'mes':
+        return datas.dt.to_period('M').dt.to_timestamp()
+    return datas
+
+def percentis(valores):
+    if len(valores) == 0:
+        return {f'p{p}': 0 for p in PERCENTIS}
+    return {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTIS, np.percentile(valores, PERCENTIS))}
+
+def taxa(faltas, presencas):
+    total = faltas + presencas
+    return np.round(np.divide(faltas, total, out=np.zeros(len(total)), where=total > 0), 4)
+
+def agregar_periodo(historico, cursos, nomes_refeicao, inicio, fim, granularidade):
+    """Séries e percentis do relatório por período a partir das linhas do histórico
+
+    `historico` tem uma linha por registro (data, refeicao_id, aluno_id, falta,
+    presenca, paga, valor); `cursos` é uma Series aluno_id -> curso. Tudo sai de
+    um único groupby por (período, refeição, curso); os percentis são da
+    distribuição por aluno e por período.
+    """
+    freq = GRANULARIDADES[granularidade]
+    primeiro = inicio_periodo(pd.Series([pd.Timestamp(inicio)]), granularidade).iat[0]
+    periodos = pd.date_range(primeiro, pd.Timestamp(fim), freq=freq)
+
+    df = pd.DataFrame({
+        'periodo': inicio_periodo(pd.to_datetime(historico['data']), granularidade),
+        'refeicao_id': historico['refeicao_id'].astype('int32'),
+        'curso': historico['aluno_id'].map(cursos).fillna(SEM_CURSO).astype('category'),
+        'aluno_id': historico['aluno_id'],
+        'presencas': historico['presenca'].astype('int32'),
+        'faltas': historico['falta'].astype('int32'),
+        'valor_faltas': historico['valor'].fillna(0).to_numpy() * historico['falta'].to_numpy(),
+        'valor_pago': historico['valor'].fillna(0).to_numpy() * historico['paga'].to_numpy(),
+    })
+
+    base = df.groupby(['periodo', 'refeicao_id', 'curso'], observed=True)[COLUNAS_SOMA].sum()
+
+    serie = base.groupby(level='periodo').sum().reindex(periodos, fill_value=0)
+    por_refeicao = base.groupby(level=['periodo', 'refeicao_id'])[['presencas', 'faltas']].sum()
+    por_refeicao = por_refeicao.unstack('refeicao_id', fill_value=0).reindex(periodos, fill_value=0)
+    por_curso = base.groupby(level='curso', observed=True).sum()
+    faltas_curso = base['faltas'].groupby(level=['periodo', 'curso'], observed=True).sum()
+    faltas_curso = faltas_curso.unstack('curso', fill_value=0).reindex(periodos, fill_value=0)
+    alunos_curso = df.groupby('curso', observed=True)['aluno_id'].nunique()
+    por_aluno = df.groupby('aluno_id')[['faltas', 'valor_faltas']].sum()
+
+    refeicoes = {}
+    for refeicao_id in por_refeicao.columns.get_level_values('refeicao_id').unique():
+        refeicoes[nomes_refeicao(refeicao_id) or 'Outra'] = {
+            'presencas': por_refeicao[('presencas', refeicao_id)].tolist(),
+            'faltas': por_refeicao[('faltas', refeicao_id)].tolist(),
+        }
+
+    cursos_lista = [{
+        'curso': curso,
+        'alunos': int(alunos_curso.get(curso, 0)),
+        'presencas': int(linha.presencas),
+        'faltas': int(linha.faltas),
+        'taxa_faltas': float(t),
+        'valor_faltas': round(float(linha.valor_faltas), 2),
+        'faltas_serie': faltas_curso[curso].tolist() if curso in faltas_curso.columns else [],
+    } for curso, linha, t in zip(por_curso.index, por_curso.itertuples(), taxa(por_curso['faltas'], por_curso['presencas']))]
+    cursos_lista.sort(key=lambda c: (-c['taxa_faltas'], c['curso']))
+
+    return {
+        'de': pd.Timestamp(inicio).strftime('%d/%m/%Y'),
+        'ate': pd.Timestamp(fim).strftime('%d/%m/%Y'),
+        'granularidade': granularidade,
+        'periodos': periodos.strftime(FORMATO_PERIODO[granularidade]).tolist(),
+        'series': {
+            'presencas': serie['presencas'].tolist(),
+            'faltas': serie['faltas'].tolist(),
+            'taxa_faltas': taxa(serie['faltas'], serie['presencas']).tolist(),
+            'valor_faltas': serie['valor_faltas'].round(2).tolist(),
+            'valor_pago': serie['valor_pago'].round(2).tolist(),
+        },
+        'refeicoes': refeicoes,
+        'cursos': cursos_lista,
+        'percentis': {
+            'faltas_por_aluno': percentis(por_aluno['faltas'].to_numpy()),
+            'valor_por_aluno': percentis(por_aluno['valor_faltas'].to_numpy()),
+            'faltas_por_periodo': percentis(serie['faltas'].to_numpy()),
+        },
+        'totais': {
+            'registros': len(df),
+            'alunos': int(df['aluno_id'].nunique()),
+            'presencas': int(serie['presencas'].sum()),
+            'faltas': int(serie['faltas'].sum()),
+            'valor_faltas': round(float(serie['valor_faltas'].sum()), 2),
+            'valor_pago': round(float(serie['valor_pago'].sum()), 2),
+        },
+    }
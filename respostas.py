@@ -0,0 +1,202 @@
+import csv
+import gzip
+import io
+import json
+import tempfile
+import zlib
+
+from flask import Response, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from openpyxl import Workbook
+
+try:
+    import orjson
+except ImportError:  # sem orjson fica o provedor padrão do Flask
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # sem brotli as respostas saem só em gzip
+    brotli = None
+
+# Respostas menores que isso não compensam a compressão
+TAMANHO_MINIMO_COMPRESSAO = 1024
+NIVEL_GZIP = 6
+QUALIDADE_BROTLI = 4
+
+TIPOS_COMPRIMIVEIS = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'text/html', 'text/plain', 'text/css', 'text/csv',
+}
+
+MIMETYPE_NDJSON = 'application/x-ndjson'
+
+# Linhas do NDJSON juntadas em cada pedaço enviado
+LINHAS_POR_PEDACO_NDJSON = 500
+
+# ==================== JSON ====================
+if orjson:
+    # Datas passam pelo default do Flask (mesmo formato do jsonify padrão)
+    OPCOES_ORJSON = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+
+    class ProvedorJSON(DefaultJSONProvider):
+        """JSON do app pelo orjson: serializa direto para bytes, sem ordenar as chaves"""
+        sort_keys = False
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=OPCOES_ORJSON).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            opcoes = OPCOES_ORJSON
+            if self.compact is False or (self.compact is None and self._app.debug):
+                opcoes |= orjson.OPT_INDENT_2
+            return self._app.response_class(
+                orjson.dumps(obj, default=self.default, option=opcoes) + b'\n',
+                mimetype=self.mimetype
+            )
+
+    def linha_json(obj):
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=OPCOES_ORJSON) + b'\n'
+else:
+    ProvedorJSON = DefaultJSONProvider
+
+    def linha_json(obj):
+        return json.dumps(obj, default=DefaultJSONProvider.default, ensure_ascii=False).encode() + b'\n'
+
+# ==================== NDJSON ====================
+def quer_ndjson(args):
+    """formato=ndjson na URL ou Accept: application/x-ndjson"""
+    if args.get('formato') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == MIMETYPE_NDJSON
+
+def resposta_ndjson(itens):
+    """Um objeto JSON por linha, gerado aos poucos a partir de um iterável de dicts"""
+    def gerar():
+        pedaco = []
+        for item in itens:
+            pedaco.append(linha_json(item))
+            if len(pedaco) >= LINHAS_POR_PEDACO_NDJSON:
+                yield b''.join(pedaco)
+                pedaco = []
+        if pedaco:
+            yield b''.join(pedaco)
+
+    return Response(stream_with_context(gerar()), mimetype=MIMETYPE_NDJSON)
+
+# ==================== PLANILHAS ====================
+FORMATOS_EXPORTACAO = ('csv', 'xlsx')
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Linhas do CSV por pedaço enviado e bytes por pedaço do .xlsx
+LINHAS_POR_PEDACO_CSV = 1000
+BYTES_POR_PEDACO_XLSX = 64 * 1024
+
+def gerar_csv(cabecalho, linhas):
+    """CSV com ; e BOM (abre direto no Excel), em pedaços de texto"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    escritor.writerow(cabecalho)
+    for i, linha in enumerate(linhas, 1):
+        escritor.writerow(linha)
+        if i % LINHAS_POR_PEDACO_CSV == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gerar_xlsx(cabecalho, linhas, titulo):
+    """Planilha pelo modo write-only do openpyxl, em pedaços de bytes
+
+    As linhas vão direto para o XML temporário da aba (memória constante); o
+    .xlsx é um zip, que só fica pronto no fim, e então sai de um arquivo
+    temporário.
+    """
+    wb = Workbook(write_only=True)
+    aba = wb.create_sheet(titulo[:31])
+    aba.append(cabecalho)
+    for linha in linhas:
+        aba.append(list(linha))
+    with tempfile.TemporaryFile() as arquivo:
+        wb.save(arquivo)
+        arquivo.seek(0)
+        yield from iter(lambda: arquivo.read(BYTES_POR_PEDACO_XLSX), b'')
+
+def resposta_planilha(formato, cabecalho, linhas, nome, titulo):
+    """Download de `linhas` (iterável de tuplas) em CSV ou .xlsx, gerado aos poucos"""
+    headers = {'Content-Disposition': f'attachment; filename={nome}.{formato}'}
+    if formato == 'xlsx':
+        gerador, mimetype = gerar_xlsx(cabecalho, linhas, titulo), MIMETYPE_XLSX
+    else:
+        gerador, mimetype = gerar_csv(cabecalho, linhas), 'text/csv'
+    return Response(stream_with_context(gerador), mimetype=mimetype, headers=headers)
+
+# ==================== COMPRESSÃO ====================
+def escolher_codificacao():
+    """br ou gzip, o que o cliente aceitar (br primeiro), ou None"""
+    aceitas = request.accept_encodings
+    if brotli and aceitas['br']:
+        return 'br'
+    if aceitas['gzip']:
+        return 'gzip'
+    return None
+
+def comprimir(dados, codificacao):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=QUALIDADE_BROTLI)
+    return gzip.compress(dados, compresslevel=NIVEL_GZIP)
+
+def comprimir_em_partes(partes, codificacao):
+    """Comprime uma resposta em streaming pedaço a pedaço, sem esperar o fim"""
+    if codificacao == 'br':
+        compressor = brotli.Compressor(quality=QUALIDADE_BROTLI)
+        for parte in partes:
+            if isinstance(parte, str):
+                parte = parte.encode()
+            saida = compressor.process(parte) + compressor.flush()
+            if saida:
+                yield saida
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)  # 31 = cabeçalho gzip
+        for parte in partes:
+            if isinstance(parte, str):
+                parte = parte.encode()
+            # SYNC_FLUSH: o cliente recebe cada pedaço assim que ele é gerado
+            saida = compressor.compress(parte) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if saida:
+                yield saida
+        yield compressor.flush()
+
+def comprimir_resposta(resposta):
+    """after_request: comprime JSON, NDJSON e texto quando o cliente aceita"""
+    if (resposta.status_code < 200 or resposta.status_code in (204, 304)
+            or resposta.direct_passthrough
+            or 'Content-Encoding' in resposta.headers
+            or resposta.mimetype not in TIPOS_COMPRIMIVEIS):
+        return resposta
+    codificacao = escolher_codificacao()
+    if not codificacao:
+        return resposta
+
+    if resposta.is_streamed:
+        resposta.response = comprimir_em_partes(resposta.response, codificacao)
+        resposta.headers.pop('Content-Length', None)
+    else:
+        dados = resposta.get_data()
+        if len(dados) < TAMANHO_MINIMO_COMPRESSAO:
+            return resposta
+        resposta.set_data(comprimir(dados, codificacao))
+    resposta.headers['Content-Encoding'] = codificacao
+    resposta.vary.add('Accept-Encoding')
+    return resposta
+
+def configurar_respostas(app):
+    """JSON rápido (orjson, se instalado) e compressão das respostas"""
+    app.json = ProvedorJSON(app)
+    app.after_request(comprimir_resposta)
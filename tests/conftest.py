@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+import pytest
+
+# O app abre o banco no import: os testes de integração usam um SQLite
+# temporário, definido antes de qualquer `import app`
+PASTA_TESTES = tempfile.mkdtemp(prefix='refeitorio-testes-')
+os.environ['REFEITORIO_DATABASE_URL'] = 'sqlite:///' + os.path.join(PASTA_TESTES, 'refeitorio.db')
+
+POLITICA_PADRAO = {
+    'max_faltas': '3', 'max_faltas_janela': '0', 'janela_dias': '30',
+    'max_faltas_consecutivas': '0', 'dias_bloqueio': '0'
+}
+# Tabelas que o app preenche na subida e os testes não apagam
+TABELAS_FIXAS = ('configuracao', 'refeicao', 'schema_migracao')
+
+@pytest.fixture
+def app(tmp_path):
+    from app import app as aplicacao, db, invalidar_caches
+    aplicacao.config.update(TESTING=True, UPLOAD_FOLDER=str(tmp_path))
+    with aplicacao.app_context():
+        yield aplicacao
+        db.session.rollback()
+        for tabela in reversed(db.metadata.sorted_tables):
+            if tabela.name not in TABELAS_FIXAS:
+                db.session.execute(tabela.delete())
+        db.session.commit()
+        aplicacao.test_client().post('/api/configuracoes', json=POLITICA_PADRAO)
+        invalidar_caches()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def planilha(tmp_path):
+    """planilha(linhas) -> caminho de um CSV de agendamentos
+    
+    Cada linha é (dia, matrícula, refeição, presente); o nome do aluno é
+    'Aluno <matrícula>'.
+    """
+    def criar(linhas, nome='agendamentos.csv'):
+        caminho = tmp_path / nome
+        with open(caminho, 'w', encoding='utf-8-sig') as f:
+            f.write('Dia;Identificação;Usuário;Curso/Departamento;Refeição;Comparecimento\n')
+            for dia, matricula, refeicao, presente in linhas:
+                f.write(f'{dia};{matricula};Aluno {matricula};Info;{refeicao};{"Sim" if presente else "Não"}\n')
+        return str(caminho)
+    return criar
@@ -0,0 +1,93 @@
+from datetime import date
+
+import numpy as np
+
+from bloqueio import EstadoNoLote, PoliticaBloqueio, avaliar_bloqueios, bloqueio_vale
+
+# max_faltas=3, 2 faltas seguidas bloqueiam por 2 dias
+POLITICA = PoliticaBloqueio(max_faltas=3, max_faltas_consecutivas=2, dias_bloqueio=2)
+HOJE = date(2026, 10, 18)
+
+def avaliar(politica=POLITICA, hoje=HOJE, faltas=0, consecutivas=0, ultima=None, ate_atual=None, fim_anterior=None):
+    decisao = avaliar_bloqueios(politica, hoje, [faltas], [consecutivas], [ultima], [0], [None], [ate_atual], [fim_anterior])
+    return {chave: valor[0] for chave, valor in decisao.items()}
+
+def data(valor):
+    return None if np.isnat(valor) else valor.astype(object)
+
+def test_bloqueio_temporario_em_vigor():
+    decisao = avaliar(hoje=date(2026, 10, 2), faltas=2, consecutivas=2, ultima=date(2026, 10, 1))
+    assert decisao['bloqueado']
+    assert data(decisao['bloqueado_ate']) == date(2026, 10, 3)
+    assert data(decisao['fim_ultimo_bloqueio']) is None
+
+def test_bloqueio_temporario_vencido_vira_marca():
+    decisao = avaliar(faltas=2, consecutivas=2, ultima=date(2026, 10, 1))
+    assert not decisao['bloqueado']
+    assert data(decisao['bloqueado_ate']) is None
+    assert data(decisao['fim_ultimo_bloqueio']) == date(2026, 10, 3)
+
+def test_bloqueio_ate_pagamento_nao_guarda_data_vencida():
+    # Duas faltas seguidas em 01/10 (bloqueio até 03/10, já vencido) e a
+    # terceira em 05/10: as de 01/10 não contam mais como seguidas, mas o
+    # total bloqueia até o pagamento
+    decisao = avaliar(
+        faltas=3, consecutivas=1, ultima=date(2026, 10, 5),
+        ate_atual=date(2026, 10, 3), fim_anterior=date(2026, 10, 3)
+    )
+    assert decisao['bloqueado']
+    assert decisao['por_total']
+    assert data(decisao['bloqueado_ate']) is None
+    assert data(decisao['fim_ultimo_bloqueio']) == date(2026, 10, 3)
+    # A importação de 10/10 tem que ser descartada
+    assert bloqueio_vale(decisao['bloqueado'], data(decisao['bloqueado_ate']), date(2026, 10, 10))
+
+def test_bloqueio_ate_pagamento_por_cima_do_temporario():
+    decisao = avaliar(hoje=date(2026, 10, 2), faltas=3, consecutivas=2, ultima=date(2026, 10, 1))
+    assert decisao['bloqueado']
+    assert data(decisao['bloqueado_ate']) is None
+
+def test_recalculo_idempotente():
+    primeira = avaliar(faltas=3, consecutivas=1, ultima=date(2026, 10, 5), ate_atual=date(2026, 10, 3))
+    segunda = avaliar(
+        faltas=3, consecutivas=1, ultima=date(2026, 10, 5),
+        ate_atual=data(primeira['bloqueado_ate']), fim_anterior=data(primeira['fim_ultimo_bloqueio'])
+    )
+    assert data(segunda['bloqueado_ate']) == data(primeira['bloqueado_ate']) is None
+    assert data(segunda['fim_ultimo_bloqueio']) == data(primeira['fim_ultimo_bloqueio']) == date(2026, 10, 3)
+
+def test_bloqueio_vale():
+    assert bloqueio_vale(True, None, date(2026, 10, 10))
+    assert bloqueio_vale(True, date(2026, 10, 3), date(2026, 10, 3))
+    assert not bloqueio_vale(True, date(2026, 10, 3), date(2026, 10, 4))
+    assert not bloqueio_vale(False, None, date(2026, 10, 10))
+
+def aceitas(estado, linhas):
+    return [estado.aceitar(date(2026, 10, dia), falta) for dia, falta in linhas]
+
+def test_lote_corta_depois_das_seguidas():
+    # 01 e 02/10 seguidas bloqueiam até 04/10; a falta de 06/10 é a terceira
+    # no total e bloqueia até o pagamento
+    estado = EstadoNoLote(POLITICA)
+    linhas = [(1, True), (2, True), (3, False), (4, True), (5, False), (6, True), (7, False)]
+    assert aceitas(estado, linhas) == [True, True, False, False, True, True, False]
+    assert estado.fim_ultimo_bloqueio == date(2026, 10, 4)
+    assert estado.bloqueado and estado.bloqueado_ate is None
+
+def test_lote_corta_depois_da_janela():
+    # 3 faltas em 5 dias bloqueiam até a mais antiga sair da janela
+    politica = PoliticaBloqueio(max_faltas=10, max_faltas_janela=3, janela_dias=5)
+    estado = EstadoNoLote(politica)
+    linhas = [(1, True), (3, True), (5, True), (5, False), (6, True), (7, True), (8, True), (9, False), (11, True)]
+    assert aceitas(estado, linhas) == [True, True, True, False, True, True, True, False, True]
+    assert estado.fim_ultimo_bloqueio == date(2026, 10, 10)
+    assert estado.datas_faltas == [date(2026, 10, 11)]
+    assert not estado.bloqueado
+
+def test_lote_parte_do_estado_gravado():
+    # Uma falta seguida e outra na janela vindas do banco
+    politica = PoliticaBloqueio(max_faltas=10, max_faltas_janela=2, janela_dias=5, max_faltas_consecutivas=3, dias_bloqueio=1)
+    estado = EstadoNoLote(politica, faltas=1, consecutivas=1, ultima_consecutiva=date(2026, 10, 1),
+                          datas_faltas=[date(2026, 10, 1)])
+    assert aceitas(estado, [(2, True), (3, False), (4, True)]) == [True, False, False]
+    assert estado.bloqueado_ate == date(2026, 10, 5)
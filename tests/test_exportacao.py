@@ -0,0 +1,34 @@
+import io
+
+from openpyxl import load_workbook
+
+from app import importar_arquivo
+
+CABECALHO = 'Matrícula;Nome;Curso;Faltas;Débito;Última falta;Última refeição;Status'
+
+def test_exportacao_csv(client, planilha):
+    importar_arquivo(planilha([
+        ('01/10/2026', 'A1', 'Almoço', False), ('02/10/2026', 'A1', 'Almoço', False),
+        ('03/10/2026', 'A1', 'Almoço', False), ('01/10/2026', 'A2', 'Jantar', True),
+    ]), 'agendamentos.csv')
+    resposta = client.get('/api/export/alunos')
+    assert resposta.is_streamed
+    assert resposta.mimetype == 'text/csv'
+    linhas = resposta.get_data().decode('utf-8-sig').splitlines()
+    assert linhas[0] == CABECALHO
+    assert linhas[1:] == ['A1;Aluno A1;Info;3;24.0;03/10/2026;Almoço;BLOQUEADO', 'A2;Aluno A2;Info;0;0.0;;;Ativo']
+
+    bloqueados = client.get('/api/export/bloqueados').get_data().decode('utf-8-sig').splitlines()
+    assert [l.split(';')[0] for l in bloqueados[1:]] == ['A1']
+
+def test_exportacao_xlsx(client, planilha):
+    importar_arquivo(planilha([('01/10/2026', f'A{i}', 'Almoço', False) for i in range(5)]), 'agendamentos.csv')
+    resposta = client.get('/api/export/alunos', query_string={'formato': 'xlsx'})
+    assert resposta.is_streamed
+    planilha_gerada = load_workbook(io.BytesIO(resposta.get_data()), read_only=True)
+    linhas = list(planilha_gerada.active.iter_rows(values_only=True))
+    assert list(linhas[0]) == CABECALHO.split(';')
+    assert [l[0] for l in linhas[1:]] == [f'A{i}' for i in range(5)]
+
+def test_exportacao_formato_invalido(client):
+    assert client.get('/api/export/alunos', query_string={'formato': 'pdf'}).status_code == 400
@@ -0,0 +1,76 @@
+from app import Aluno, Historico, ResumoDiario, db, importar_arquivo
+from importacao import ler_planilha_em_lotes
+
+def historico(matricula):
+    linhas = db.session.execute(
+        db.select(Historico.data, Historico.tipo).join(Aluno, Aluno.id == Historico.aluno_id)
+        .where(Aluno.matricula == matricula).order_by(Historico.data, Historico.ordem_refeicao)
+    ).all()
+    return [(d.day, tipo) for d, tipo in linhas]
+
+def test_duplicadas_no_arquivo_e_reimportacao(app, planilha):
+    caminho = planilha([
+        ('01/10/2026', 'A1', 'Almoço', True),
+        ('01/10/2026', 'A1', 'Almoço', True),
+        ('02/10/2026', 'A1', 'Almoço', False),
+        ('02/10/2026', 'A2', 'Jantar', False),
+    ])
+    primeira = importar_arquivo(caminho, 'agendamentos.csv')
+    assert (primeira['inseridos'], primeira['novos'], primeira['faltas']) == (3, 2, 2)
+
+    segunda = importar_arquivo(caminho, 'agendamentos.csv')
+    assert (segunda['inseridos'], segunda['novos'], segunda['faltas']) == (0, 0, 0)
+    assert Historico.query.count() == 3
+    aluno = Aluno.query.filter_by(matricula='A1').one()
+    assert (aluno.total_faltas, aluno.debito) == (1, 8.0)
+
+def test_corte_pelo_total_de_faltas(app, planilha):
+    caminho = planilha([(f'0{dia}/10/2026', 'A1', 'Almoço', False) for dia in range(1, 6)])
+    resultado = importar_arquivo(caminho, 'agendamentos.csv')
+    assert resultado['faltas'] == 3
+    assert historico('A1') == [(1, 'falta'), (2, 'falta'), (3, 'falta')]
+    aluno = Aluno.query.filter_by(matricula='A1').one()
+    assert aluno.bloqueado and aluno.bloqueado_ate is None
+
+def test_corte_pelas_seguidas_e_pela_janela_no_mesmo_lote(app, client, planilha):
+    client.post('/api/configuracoes', json={
+        'max_faltas': '10', 'max_faltas_janela': '3', 'janela_dias': '5',
+        'max_faltas_consecutivas': '2', 'dias_bloqueio': '1'
+    })
+    # 3 faltas em 5 dias (01, 03, 05) bloqueiam até 05/10: o jantar do dia
+    # não vale. 07 e 08 seguidas bloqueiam até 09/10: a falta do dia não vale
+    caminho = planilha([
+        ('01/10/2026', 'A1', 'Almoço', False), ('02/10/2026', 'A1', 'Almoço', True),
+        ('03/10/2026', 'A1', 'Almoço', False), ('04/10/2026', 'A1', 'Almoço', True),
+        ('05/10/2026', 'A1', 'Almoço', False), ('05/10/2026', 'A1', 'Jantar', True),
+        ('07/10/2026', 'A1', 'Almoço', False), ('08/10/2026', 'A1', 'Almoço', False),
+        ('09/10/2026', 'A1', 'Almoço', False), ('10/10/2026', 'A1', 'Almoço', True),
+    ])
+    resultado = importar_arquivo(caminho, 'agendamentos.csv')
+
+    assert historico('A1') == [
+        (1, 'falta'), (2, 'presenca'), (3, 'falta'), (4, 'presenca'), (5, 'falta'),
+        (7, 'falta'), (8, 'falta'), (10, 'presenca')
+    ]
+    assert (resultado['inseridos'], resultado['faltas']) == (8, 5)
+    assert db.session.scalar(db.select(db.func.sum(ResumoDiario.quantidade))) == 8
+    assert Aluno.query.filter_by(matricula='A1').one().total_faltas == 5
+
+def test_bloqueio_gravado_descarta_lote_seguinte(app, planilha):
+    importar_arquivo(planilha([(f'0{dia}/10/2026', 'A1', 'Almoço', False) for dia in range(1, 4)]), 'a.csv')
+    resultado = importar_arquivo(planilha([('06/10/2026', 'A1', 'Almoço', True)], 'b.csv'), 'b.csv')
+    assert resultado['inseridos'] == 0
+    assert len(historico('A1')) == 3
+
+def test_retomada_do_csv_conta_registros(tmp_path):
+    caminho = tmp_path / 'quebras.csv'
+    caminho.write_text(
+        'Dia;Identificação;Usuário;Curso/Departamento;Refeição;Comparecimento\n'
+        '01/10/2026;1;"Nome\ncom quebra";Info;Almoço;Não\n\n'
+        '02/10/2026;2;B;Info;Almoço;Sim\n\n'
+        '03/10/2026;3;C;Info;Jantar;Não\n'
+        '04/10/2026;4;D;Info;Jantar;Não\n',
+        encoding='utf-8-sig'
+    )
+    lotes = [(linha, list(df['Identificação'])) for linha, df in ler_planilha_em_lotes(str(caminho), 2, pular=1)]
+    assert lotes == [(3, ['2']), (4, ['3', '4'])]
@@ -0,0 +1,76 @@
+from sqlalchemy import create_engine, inspect, text
+
+from migracoes import MIGRACOES, aplicar_migracoes
+from models import db
+
+# Esquema do banco antes das migrações (historico.refeicao em texto)
+ESQUEMA_ANTIGO = """
+CREATE TABLE aluno (
+    id INTEGER PRIMARY KEY, matricula VARCHAR(20) NOT NULL UNIQUE, nome VARCHAR(100) NOT NULL,
+    curso VARCHAR(100), email VARCHAR(100), total_faltas INTEGER, debito FLOAT,
+    ultima_falta_data DATE, ultima_falta_refeicao VARCHAR(50), ultima_falta_valor FLOAT,
+    bloqueado BOOLEAN, created_at DATETIME
+);
+CREATE TABLE historico (
+    id INTEGER PRIMARY KEY, aluno_id INTEGER NOT NULL REFERENCES aluno (id), data DATE NOT NULL,
+    refeicao VARCHAR(50), tipo VARCHAR(20) NOT NULL, status VARCHAR(20) NOT NULL, valor FLOAT,
+    registro_data DATETIME, created_at DATETIME
+);
+CREATE TABLE pagamento (
+    id INTEGER PRIMARY KEY, aluno_id INTEGER NOT NULL REFERENCES aluno (id), data DATE NOT NULL,
+    valor FLOAT NOT NULL, motivo VARCHAR(200), faltas_quitadas INTEGER, created_at DATETIME
+);
+CREATE TABLE configuracao (
+    id INTEGER PRIMARY KEY, chave VARCHAR(50) NOT NULL UNIQUE, valor VARCHAR(100) NOT NULL,
+    descricao VARCHAR(200), tipo VARCHAR(20)
+);
+CREATE TABLE auditoria (
+    id INTEGER PRIMARY KEY, timestamp DATETIME, usuario VARCHAR(50), acao VARCHAR(200) NOT NULL,
+    tipo VARCHAR(20), detalhes TEXT
+);
+"""
+
+def banco_antigo(caminho):
+    engine = create_engine(f'sqlite:///{caminho}')
+    with engine.begin() as conn:
+        for comando in ESQUEMA_ANTIGO.split(';'):
+            if comando.strip():
+                conn.execute(text(comando))
+        conn.execute(text("INSERT INTO aluno (id, matricula, nome, total_faltas, debito, bloqueado) VALUES (1, 'A1', 'Ana', 2, 11.5, 0)"))
+        conn.execute(text("""
+            INSERT INTO historico (aluno_id, data, refeicao, tipo, status, valor) VALUES
+            (1, '2026-10-01', 'Almoço', 'falta', 'pendente', 8.0),
+            (1, '2026-10-01', 'almoco', 'falta', 'pendente', 8.0),
+            (1, '2026-10-02', 'Lanche da Manhã', 'falta', 'pendente', 3.5),
+            (1, '2026-10-03', 'Sopa', 'presenca', 'presente', 0)
+        """))
+    return engine
+
+def test_migracoes_no_banco_antigo(tmp_path):
+    engine = banco_antigo(tmp_path / 'antigo.db')
+    # Mesma ordem da subida do app: tabelas novas, depois as migrações
+    db.metadata.create_all(engine)
+    assert aplicar_migracoes(engine) == [versao for versao, _, _ in MIGRACOES]
+    assert aplicar_migracoes(engine) == []
+
+    with engine.connect() as conn:
+        colunas = {c['name'] for c in inspect(conn).get_columns('historico')}
+        assert {'refeicao_id', 'ordem_refeicao'} <= colunas and 'refeicao' not in colunas
+        assert {'faltas_consecutivas', 'bloqueado_ate', 'fim_ultimo_bloqueio'} <= {
+            c['name'] for c in inspect(conn).get_columns('aluno')
+        }
+        assert 'dono' in {c['name'] for c in inspect(conn).get_columns('importacao_job')}
+
+        # 'Almoço' e 'almoco' no mesmo dia viram uma linha só; 'Sopa' entra no catálogo
+        linhas = conn.execute(text("""
+            SELECT h.data, r.nome FROM historico h JOIN refeicao r ON r.id = h.refeicao_id
+            ORDER BY h.data, h.ordem_refeicao
+        """)).all()
+        assert [(str(d), nome) for d, nome in linhas] == [
+            ('2026-10-01', 'Almoço'), ('2026-10-02', 'Lanche da Manhã'), ('2026-10-03', 'Sopa')
+        ]
+        resumo = conn.execute(text(
+            "SELECT SUM(quantidade), SUM(valor_total) FROM resumo_diario WHERE tipo = 'falta'"
+        )).one()
+        assert tuple(resumo) == (2, 11.5)
+    engine.dispose()
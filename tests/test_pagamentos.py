@@ -0,0 +1,44 @@
+import io
+
+from app import Aluno, Historico, Pagamento, ResumoDiario, db, importar_arquivo, quitar_faltas
+
+def importar_faltas(planilha, *matriculas):
+    linhas = [(f'0{dia}/10/2026', m, 'Almoço', False) for m in matriculas for dia in (1, 2)]
+    importar_arquivo(planilha(linhas), 'agendamentos.csv')
+    return {a.matricula: a for a in Aluno.query}
+
+def test_quitar_faltas(app, planilha):
+    alunos = importar_faltas(planilha, 'A1', 'A2')
+    assert quitar_faltas([alunos['A1'].id]) == {alunos['A1'].id: 2}
+    db.session.commit()
+
+    a1 = db.session.get(Aluno, alunos['A1'].id)
+    assert (a1.total_faltas, a1.debito, a1.bloqueado) == (0, 0, False)
+    assert Historico.query.filter_by(aluno_id=a1.id, status='paga').count() == 2
+    assert db.session.get(Aluno, alunos['A2'].id).debito == 16.0
+    resumo = ResumoDiario.query.filter_by(tipo='falta').all()
+    assert sum(r.quantidade_paga for r in resumo) == 2
+    assert sum(r.valor_pago for r in resumo) == 16.0
+
+def test_pagamento_em_lote_concilia_com_o_debito(client, planilha):
+    importar_faltas(planilha, 'A1', 'A2', 'A3')
+    arquivo = 'matricula;valor\nA1;16,00\nA2;10,00\nX9;5\nA3;8\nA3;8\n'
+    resposta = client.post('/api/pagamentos/lote', data={
+        'file': (io.BytesIO(arquivo.encode()), 'banco.csv')
+    }).get_json()
+
+    assert (resposta['alunos_quitados'], resposta['faltas_quitadas'], resposta['valor_total']) == (2, 4, 32.0)
+    assert {d['matricula']: d['motivo'] for d in resposta['divergencias']} == {
+        'A2': 'Valor diferente do débito', 'X9': 'Matrícula não encontrada'
+    }
+    assert {a.matricula: a.debito for a in Aluno.query} == {'A1': 0, 'A2': 16.0, 'A3': 0}
+    assert Pagamento.query.count() == 2
+
+def test_pagamento_em_lote_simulado_nao_grava(client, planilha):
+    importar_faltas(planilha, 'A1')
+    resposta = client.post('/api/pagamentos/lote', data={
+        'file': (io.BytesIO(b'matricula;valor\nA1;16\n'), 'banco.csv'), 'simular': '1'
+    }).get_json()
+    assert resposta['simulacao'] and resposta['alunos_quitados'] == 1
+    assert Aluno.query.one().debito == 16.0
+    assert Pagamento.query.count() == 0
@@ -0,0 +1,55 @@
+from datetime import date
+
+import pytest
+
+from app import Aluno, ParametroInvalido, codificar_cursor, db, decodificar_cursor
+
+def test_cursor_ida_e_volta():
+    assert decodificar_cursor(codificar_cursor(date(2026, 10, 1), 7), date.fromisoformat) == (date(2026, 10, 1), 7)
+    assert decodificar_cursor(codificar_cursor('Maria', 3), str) == ('Maria', 3)
+    assert decodificar_cursor(codificar_cursor(None, 12), int) == (None, 12)
+
+@pytest.mark.parametrize('cursor', ['nao-e-base64', codificar_cursor('x', 'y'), ''])
+def test_cursor_invalido(cursor):
+    with pytest.raises(ParametroInvalido):
+        decodificar_cursor(cursor or 'e30=', int)
+
+@pytest.fixture
+def alunos(app):
+    # Empates no total de faltas e na data da última falta, e datas vazias
+    faltas = [2, 0, 2, 1, 2, 0, 1, 2]
+    datas = [date(2026, 10, 1), None, date(2026, 10, 1), date(2026, 9, 1), None, None, date(2026, 9, 1), date(2026, 10, 2)]
+    db.session.add_all([
+        Aluno(matricula=f'M{i}', nome=f'Aluno {i}', total_faltas=f, debito=f * 8.0, ultima_falta_data=d)
+        for i, (f, d) in enumerate(zip(faltas, datas))
+    ])
+    db.session.commit()
+    return Aluno.query.all()
+
+def paginar(client, **params):
+    ids, cursor = [], None
+    while True:
+        dados = client.get('/api/alunos', query_string={**params, 'limite': 2, **({'cursor': cursor} if cursor else {})}).get_json()
+        ids.extend(a['id'] for a in dados['alunos'])
+        cursor = dados['proximo_cursor']
+        if not cursor:
+            return ids
+
+@pytest.mark.parametrize('ordem, chave', [
+    ('faltas', lambda a: a.total_faltas),
+    ('debito', lambda a: a.debito),
+    ('ultima_falta', lambda a: a.ultima_falta_data),
+])
+@pytest.mark.parametrize('desc', [False, True])
+def test_paginas_seguem_a_ordem_com_empates(client, alunos, ordem, chave, desc):
+    # NULL vem primeiro no ASC e por último no DESC; o id desempata
+    if desc:
+        esperado = sorted(alunos, key=lambda a: (chave(a) is not None, chave(a) or 0, a.id), reverse=True)
+    else:
+        esperado = sorted(alunos, key=lambda a: (chave(a) is not None, chave(a) or 0, a.id))
+    ids = paginar(client, ordem=ordem, direcao='desc' if desc else 'asc')
+    assert ids == [a.id for a in esperado]
+
+def test_cursor_invalido_na_api(client, alunos):
+    resposta = client.get('/api/alunos', query_string={'cursor': 'lixo'})
+    assert resposta.status_code == 400